@@ -1,27 +1,76 @@
-import weaviate
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
+import asyncio
+import hashlib
 import json
-import httpx
+import os
+import threading
+import time
+import numpy as np
 from datetime import datetime, timedelta
-from langgraph.graph import StateGraph, END
 from typing_extensions import TypedDict
-from app.tools.sql_tool import SQLTool
+from app.db_pool import DatabasePool
+from app.tools.sql_tool import SQLTool, is_read_query
 from app.tools.budget_analyzer import BudgetAnalyzer
 from app.tools.scenario_planner import ScenarioPlanner
+from app.tools.intent_parser import IntentParser, ParsedIntent
+from app.tools.query_analyzer import QueryAnalyzer, QueryFilters
+from app.tools.intent_router import IntentRouter
 from app.embeddings.embedder import TransactionEmbedder
+from app.embeddings.batcher import EmbeddingBatcher
+from app.embeddings.local_index import LocalVectorIndex
+from app.embeddings.tenancy import TENANT_CLASS, run_user_query, tenant_schema
+from app.embeddings.versions import ActiveEmbeddingVersion, EmbeddingVersion, EMBEDDING_VERSION_CHANNEL
+from app.db_listener import NotificationListener
+from app.nudge_scheduler import NudgeScheduler
+from app.conversation_store import ConversationStore, ConversationNotFoundError
+from app.prompt_builder import PromptBuilder, PromptSection, estimate_tokens
+from app.llm.ollama_client import OllamaClient, OllamaError
+from app.llm.single_flight import SingleFlight
+from app.llm.context_cache import ContextCache
+from app.llm.router import ModelRouter, CLASSIFICATION, NUDGE, SQL, SUMMARY, SYNTHESIS
+from app.llm.scheduler import LLMScheduler, LLMUnavailableError, LLMDeadlineError, LLMCircuitOpenError, Priority
+from app.circuit_breaker import CircuitBreaker, CircuitOpenError
+from app.telemetry import current_trace, metrics, timed
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+TRANSACTION_PROPERTIES = ["transaction_id", "merchant_name", "category", "amount", "transaction_date", "description"]
+
+# Real date property so date ranges are inverted-index filters rather than string matches
+TRANSACTION_DAY_PROPERTY = {"name": "transaction_day", "dataType": ["date"]}
+
+# Channel the transaction processor notifies with a user_id after writing embeddings
+EMBEDDINGS_CHANNEL = "transaction_embeddings"
+
+# Stable synthesis instructions, sent as Ollama's system prompt so every chat shares the same prefix
+SYNTHESIS_SYSTEM_PROMPT = (
+    "You are FinGuru, a helpful AI financial assistant. Answer the user's question using the provided data. "
+    "Provide a clear, actionable answer. Use specific numbers when available. "
+    "If suggesting financial advice, be helpful and practical."
+)
+SYNTHESIS_PREFIX_KEY = hashlib.sha256(SYNTHESIS_SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:16]
+
+# Labels the optional classification model answers with, mapped to (needs_sql, needs_analysis)
+CLASSIFICATION_LABELS = {"data": (True, False), "analysis": (False, True), "both": (True, True), "general": (False, False)}
 
 class AgentState(TypedDict):
     user_id: str
     query: str
     context: List[Dict]
+    parsed_intent: Optional[ParsedIntent]
     sql_result: Optional[str]
     analysis_result: Optional[Dict]
     final_answer: str
     needs_sql: bool
+    needs_vector: bool
     needs_analysis: bool
     confidence: float
+    debug: Dict[str, Any]
+    deadline: float
+    conversation: Optional[Dict[str, Any]]
+    conversation_id: Optional[str]
+    # (model, Ollama context) from synthesis, cached once the turn is stored
+    llm_context: Optional[Tuple[str, List[int]]]
+    query_embedding: Optional[np.ndarray]
 
 class FinGuruAgent:
     def __init__(self, db_url: str, weaviate_url: str, ollama_url: str, llm_model: str):
@@ -30,41 +79,239 @@ class FinGuruAgent:
         self.ollama_url = ollama_url
         self.llm_model = llm_model
         
-        self.weaviate_ready = False
-        self.ollama_ready = False
+        self.weaviate_client = None
+        # Per-user tenants in UserTransaction instead of one filtered Transaction class
+        self.weaviate_multi_tenancy = os.getenv("WEAVIATE_MULTI_TENANCY", "false").lower() == "true"
+        self._graph = None
+        self._graph_lock = threading.Lock()
+        self._model_task = None
+        
+        # Breakers stop calls to a failing dependency and probe it in the background
+        breaker_settings = dict(
+            failure_rate_threshold=float(os.getenv("BREAKER_FAILURE_RATE", "0.5")),
+            window_size=int(os.getenv("BREAKER_WINDOW_SIZE", "20")),
+            min_calls=int(os.getenv("BREAKER_MIN_CALLS", "5")),
+            open_seconds=float(os.getenv("BREAKER_OPEN_SECONDS", "15")),
+        )
+        self.ollama_breaker = CircuitBreaker(
+            "ollama", self._probe_ollama,
+            slow_call_seconds=float(os.getenv("OLLAMA_SLOW_CALL_SECONDS", "45")), **breaker_settings
+        )
+        self.weaviate_breaker = CircuitBreaker(
+            "weaviate", self._probe_weaviate,
+            slow_call_seconds=float(os.getenv("WEAVIATE_SLOW_CALL_SECONDS", "2")), **breaker_settings
+        )
+        
+        # Identical in-flight prompts share one Ollama call
+        self.ollama = OllamaClient(ollama_url, timeout=float(os.getenv("OLLAMA_TIMEOUT", "60")))
+        # Per-task models and options; LLM_<TASK>_MODEL moves a task off the main model
+        self.model_router = ModelRouter(llm_model, keep_alive=os.getenv("LLM_KEEP_ALIVE", "30m"))
+        self._warm_task = None
+        self.llm_single_flight = SingleFlight()
+        # A cached context plus this turn's prompt must leave room for the reply in the synthesis
+        # num_ctx, or Ollama truncates the oldest tokens; each lookup checks its own turn's size.
+        # LLM_CONTEXT_MAX_TOKENS can only lower the cap
+        prompt_token_budget = int(os.getenv("PROMPT_TOKEN_BUDGET", "2048"))
+        synthesis_options = self.model_router.route(SYNTHESIS).options
+        context_cap = max(0, synthesis_options.get("num_ctx", 2048) - synthesis_options.get("num_predict", 512))
+        self.llm_contexts = ContextCache(
+            max_bytes=int(os.getenv("LLM_CONTEXT_CACHE_MB", "64")) * 1024 * 1024,
+            max_tokens=min(int(os.getenv("LLM_CONTEXT_MAX_TOKENS", str(context_cap))), context_cap),
+        )
+        self.llm_scheduler = LLMScheduler(
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "2")),
+            max_queue=int(os.getenv("LLM_MAX_QUEUE", "64")),
+        )
+        self.chat_deadline_seconds = float(os.getenv("CHAT_DEADLINE_SECONDS", "60"))
+        
+        # One connection pool shared by all database-backed tools
+        self.db_pool = DatabasePool(
+            db_url,
+            max_connections=int(os.getenv("DB_POOL_MAX_CONNECTIONS", "10")),
+            checkout_timeout=float(os.getenv("DB_POOL_CHECKOUT_TIMEOUT", "10")),
+        )
         
         # Initialize tools
-        self.sql_tool = SQLTool(db_url)
-        self.budget_analyzer = BudgetAnalyzer(db_url)
-        self.scenario_planner = ScenarioPlanner(db_url)
-        self.embedder = TransactionEmbedder()
+        self.sql_tool = SQLTool(
+            self.db_pool,
+            statement_timeout_ms=int(os.getenv("SQL_STATEMENT_TIMEOUT_MS", "5000")),
+            max_rows=int(os.getenv("SQL_MAX_ROWS", "500")),
+            max_prompt_rows=int(os.getenv("SQL_MAX_PROMPT_ROWS", "20")),
+        )
+        self.budget_analyzer = BudgetAnalyzer(self.db_pool)
+        self.scenario_planner = ScenarioPlanner(
+            self.db_pool,
+            paths=int(os.getenv("SCENARIO_PATHS", "5000")),
+            horizon_months=int(os.getenv("SCENARIO_HORIZON_MONTHS", "12")),
+            emergency_fund_months=float(os.getenv("SCENARIO_EMERGENCY_FUND_MONTHS", "3")),
+        )
+        self.nudge_scheduler = NudgeScheduler(
+            self.db_pool,
+            self.budget_analyzer,
+            interval_seconds=float(os.getenv("NUDGE_INTERVAL_SECONDS", "300")),
+            full_refresh_seconds=float(os.getenv("NUDGE_FULL_REFRESH_SECONDS", "86400")),
+            chunk_size=int(os.getenv("NUDGE_CHUNK_SIZE", "500")),
+            workers=int(os.getenv("NUDGE_WORKERS", "4")),
+            phrase=self._phrase_nudge if self.model_router.route(NUDGE).configured else None,
+        )
+        self.intent_parser = IntentParser()
+        self.query_analyzer = QueryAnalyzer()
+        self.prompt_builder = PromptBuilder(max_prompt_tokens=prompt_token_budget)
+        self.conversations = ConversationStore(
+            self.db_pool,
+            self._summarize_conversation,
+            recent_messages=int(os.getenv("CONVERSATION_RECENT_MESSAGES", "6")),
+            summary_threshold_tokens=int(os.getenv("CONVERSATION_SUMMARY_THRESHOLD_TOKENS", "800")),
+        )
+        self.embedder = TransactionEmbedder(os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2"))
+        self.embedding_load_attempts = max(1, int(os.getenv("EMBEDDING_LOAD_ATTEMPTS", "5")))
+        # Route prototypes are embedded once the embedding model has loaded
+        self.intent_router = IntentRouter(self.embedder)
+        self.embedding_service = EmbeddingBatcher(
+            self.embedder,
+            max_batch_size=int(os.getenv("EMBED_MAX_BATCH_SIZE", "32")),
+            max_wait_ms=float(os.getenv("EMBED_MAX_WAIT_MS", "5")),
+            cache_size=int(os.getenv("EMBED_CACHE_SIZE", "2048")),
+        )
+        
+        # Optional in-process retrieval tier for hot users
+        self.local_index = None
+        self.embeddings_listener = None
+        if os.getenv("LOCAL_VECTOR_INDEX", "false").lower() == "true":
+            self.local_index = LocalVectorIndex(
+                self._load_user_vectors,
+                max_bytes=int(os.getenv("LOCAL_INDEX_MAX_MB", "256")) * 1024 * 1024,
+                max_vectors_per_user=int(os.getenv("LOCAL_INDEX_MAX_VECTORS_PER_USER", "5000")),
+                ttl_seconds=float(os.getenv("LOCAL_INDEX_TTL_SECONDS", "3600")),
+            )
+            self.embeddings_listener = NotificationListener(db_url, EMBEDDINGS_CHANNEL, self.local_index.invalidate)
+        
+        # Retrieval follows the active embedding version; until one is registered, the pre-versioning
+        # class written with the default model (id format as in the processor's embedding_versions.py)
+        self.embedding_version = ActiveEmbeddingVersion(
+            self.db_pool,
+            EmbeddingVersion(
+                f"{self.embedder.model_name}:t1",
+                self.embedder.model_name,
+                TENANT_CLASS if self.weaviate_multi_tenancy else "Transaction",
+            ),
+            self.embedder,
+            on_switch=self.local_index.clear if self.local_index else None,
+        )
+        self.embedding_version_listener = NotificationListener(
+            db_url, EMBEDDING_VERSION_CHANNEL, self.embedding_version.refresh
+        )
+    
+    @property
+    def weaviate_ready(self) -> bool:
+        return self.weaviate_client is not None and self.weaviate_breaker.available
+    
+    @property
+    def ollama_ready(self) -> bool:
+        return self.ollama_breaker.available
     
     async def initialize(self):
         """Initialize connections"""
+        # The embedding model loads in the background; endpoints that don't need it serve right away
+        self._model_task = asyncio.get_running_loop().create_task(self._load_embedding_model_with_retry())
+        
+        if self.embeddings_listener:
+            self.embeddings_listener.start()
+        self.embedding_version_listener.start()
+        
+        # A dependency that is down at startup starts with its breaker open and recovers via probing
+        probes = {"Weaviate": (self._probe_weaviate, self.weaviate_breaker), "Ollama": (self._probe_ollama, self.ollama_breaker)}
+        results = await asyncio.gather(
+            *(asyncio.to_thread(probe) for probe, _ in probes.values()),
+            asyncio.to_thread(self._get_graph),
+            return_exceptions=True,
+        )
+        for (name, (_, breaker)), result in zip(probes.items(), results):
+            if isinstance(result, Exception):
+                print(f"⚠️ {name} connection failed: {result}")
+                breaker.trip(str(result))
+            else:
+                print(f"✅ {name} connected")
+        
+        if self.ollama_ready:
+            self._warm_task = asyncio.get_running_loop().create_task(
+                asyncio.to_thread(self.model_router.warm, self.ollama)
+            )
+    
+    async def _load_embedding_model_with_retry(self):
+        """Retry a failed load with exponential backoff; /ready shows the model as failed in between"""
+        delay = 5.0
+        for attempt in range(1, self.embedding_load_attempts + 1):
+            if await asyncio.to_thread(self._load_embedding_model):
+                return
+            if attempt < self.embedding_load_attempts:
+                print(f"🔁 Retrying embedding model load in {delay:.0f}s ({attempt}/{self.embedding_load_attempts} failed)")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 300.0)
+    
+    def _load_embedding_model(self) -> bool:
+        """Load the model, then calibrate the intent router and pick up the active version. False if the load failed"""
         try:
-            # Test Weaviate connection
-            self.weaviate_client = weaviate.Client(url=self.weaviate_url)
-            self.weaviate_client.schema.get()
-            self.weaviate_ready = True
-            print("✅ Weaviate connected")
-            
-            # Initialize Weaviate schema if not exists
-            await self._init_weaviate_schema()
-            
+            self.embedder.warmup()
+            print(f"✅ Embedding model loaded in {self.embedder.load_seconds}s")
+        except Exception as e:
+            print(f"⚠️ Embedding model failed to load: {e}")
+            return False
+        
+        try:
+            self.intent_router.build()
+            print("✅ Intent router calibrated")
         except Exception as e:
-            print(f"⚠️ Weaviate connection failed: {e}")
+            print(f"⚠️ Intent router unavailable, using keyword routing: {e}")
         
+        # Loads the active version's model too if it differs from the default
+        self.embedding_version.refresh()
+        return True
+    
+    def get_readiness(self) -> Dict[str, Any]:
+        """Per-component readiness and which endpoint groups can take traffic"""
         try:
-            # Test Ollama connection
-            async with httpx.AsyncClient() as client:
-                response = await client.get(f"{self.ollama_url}/api/tags")
-                if response.status_code == 200:
-                    self.ollama_ready = True
-                    print("✅ Ollama connected")
+            with self.db_pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+            database = {"status": "ready"}
         except Exception as e:
-            print(f"⚠️ Ollama connection failed: {e}")
+            database = {"status": "unavailable", "error": str(e)}
+        
+        database_ready = database["status"] == "ready"
+        return {
+            "components": {
+                "database": database,
+                "embedding_model": self.embedder.get_status(),
+                "weaviate": {"status": "ready" if self.weaviate_ready else self.weaviate_breaker.state},
+                "ollama": {"status": "ready" if self.ollama_ready else self.ollama_breaker.state},
+            },
+            # Chat degrades without vector context, so only the database and the LLM gate it
+            "endpoints": {
+                "chat": database_ready and self.ollama_ready,
+                "analyze_budget": database_ready,
+                "scenario_plan": database_ready,
+                "nudges": database_ready,
+            },
+        }
+    
+    def _probe_weaviate(self):
+        """Connect to Weaviate if needed and make sure the schema exists"""
+        if self.weaviate_client is None:
+            import weaviate
+            client = weaviate.Client(url=self.weaviate_url)
+            client.schema.get()
+            self.weaviate_client = client
+            
+            # Initialize Weaviate schema if not exists
+            self._init_weaviate_schema()
+        else:
+            self.weaviate_client.schema.get()
+    
+    def _probe_ollama(self):
+        self.ollama.tags()
     
-    async def _init_weaviate_schema(self):
+    def _init_weaviate_schema(self):
         """Create Weaviate schema for transactions"""
         schema = {
             "class": "Transaction",
@@ -76,151 +323,406 @@ class FinGuruAgent:
                 {"name": "category", "dataType": ["string"]},
                 {"name": "amount", "dataType": ["number"]},
                 {"name": "transaction_date", "dataType": ["string"]},
+                TRANSACTION_DAY_PROPERTY,
                 {"name": "description", "dataType": ["text"]},
             ],
         }
         
         try:
             existing = self.weaviate_client.schema.get()
-            if not any(c['class'] == 'Transaction' for c in existing.get('classes', [])):
+            if self.weaviate_multi_tenancy:
+                if not any(c['class'] == TENANT_CLASS for c in existing.get('classes', [])):
+                    self.weaviate_client.schema.create_class(tenant_schema(schema))
+                    print(f"✅ Weaviate multi-tenant schema {TENANT_CLASS} created")
+                return
+            
+            current = next((c for c in existing.get('classes', []) if c['class'] == 'Transaction'), None)
+            if current is None:
                 self.weaviate_client.schema.create_class(schema)
                 print("✅ Weaviate schema created")
+            elif not any(p['name'] == 'transaction_day' for p in current.get('properties', [])):
+                # The transaction processor backfills existing objects
+                self.weaviate_client.schema.property.create("Transaction", TRANSACTION_DAY_PROPERTY)
+                print("✅ Added transaction_day to Weaviate schema")
         except Exception as e:
             print(f"Schema creation error: {e}")
     
-    async def process_query(self, user_id: str, query: str, conversation_history: List = []) -> Dict:
-        """Main query processing with LangGraph workflow"""
-        
-        # Build the graph
-        workflow = StateGraph(AgentState)
-        
-        # Add nodes
-        workflow.add_node("classify", self._classify_intent)
-        workflow.add_node("retrieve_context", self._retrieve_context)
-        workflow.add_node("execute_sql", self._execute_sql)
-        workflow.add_node("analyze", self._analyze_data)
-        workflow.add_node("synthesize", self._synthesize_answer)
-        
-        # Define edges
-        workflow.set_entry_point("classify")
-        
-        def route_after_classify(state):
-            if state["needs_sql"]:
-                return "execute_sql"
-            else:
-                return "retrieve_context"
-        
-        workflow.add_conditional_edges(
-            "classify",
-            route_after_classify,
-            {
-                "execute_sql": "execute_sql",
-                "retrieve_context": "retrieve_context"
-            }
-        )
-        
-        workflow.add_edge("execute_sql", "analyze")
-        workflow.add_edge("retrieve_context", "analyze")
-        workflow.add_edge("analyze", "synthesize")
-        workflow.add_edge("synthesize", END)
-        
-        # Compile and run
-        graph = workflow.compile()
+    async def process_query(self, user_id: str, query: str, conversation_history: List = [],
+                            include_timings: bool = False, conversation_id: Optional[str] = None,
+                            start_conversation: bool = False) -> Dict:
+        """
+        Main query processing with LangGraph workflow.
+        
+        With a conversation_id the stored summary and recent messages are used
+        and conversation_history is ignored. Without one, a new server-side
+        conversation is started only when the client asks for it or sends
+        history to seed it; otherwise the chat is stateless.
+        """
+        graph = self._get_graph()
+        
+        conversation = None
+        conversation_debug = {}
+        wants_memory = conversation_id is not None or start_conversation or bool(conversation_history)
+        try:
+            if wants_memory:
+                seed = [(m.role, m.content) for m in conversation_history] if conversation_id is None else None
+                with timed("postgres", op="load_conversation"):
+                    conversation_id, conversation = await asyncio.to_thread(
+                        self.conversations.open, user_id, conversation_id, seed
+                    )
+        except ConversationNotFoundError:
+            raise
+        except Exception as e:
+            # Answer without memory rather than fail the chat
+            print(f"⚠️ Conversation load failed: {e}")
+            conversation_debug["conversation_error"] = str(e)
         
         initial_state: AgentState = {
             "user_id": user_id,
             "query": query,
             "context": [],
+            "parsed_intent": None,
             "sql_result": None,
             "analysis_result": None,
             "final_answer": "",
             "needs_sql": False,
+            "needs_vector": False,
             "needs_analysis": False,
-            "confidence": 0.95
+            "confidence": 0.95,
+            "debug": conversation_debug,
+            "deadline": time.monotonic() + self.chat_deadline_seconds,
+            "conversation": conversation,
+            "conversation_id": conversation_id if conversation is not None else None,
+            "llm_context": None,
+            "query_embedding": None
         }
         
-        result = graph.invoke(initial_state)
+        # Run the synchronous graph off the event loop so concurrent chats can
+        # overlap and share embedding batches
+        result = await asyncio.to_thread(graph.invoke, initial_state)
+        
+        if conversation is not None:
+            try:
+                with timed("postgres", op="append_conversation"):
+                    last_seq = await asyncio.to_thread(
+                        self.conversations.append, conversation_id,
+                        [("user", query), ("assistant", result["final_answer"])]
+                    )
+                # The context covers exactly the loaded turns plus this one; if another request
+                # stored turns in between, it would leave them out
+                if result["llm_context"] and last_seq == conversation["last_seq"] + 2:
+                    model, context = result["llm_context"]
+                    self.llm_contexts.put(conversation_id, model, SYNTHESIS_PREFIX_KEY, last_seq, context)
+                else:
+                    self.llm_contexts.invalidate(conversation_id)
+            except Exception as e:
+                self.llm_contexts.invalidate(conversation_id)
+                print(f"⚠️ Conversation append failed: {e}")
+        
+        debug_info = {
+            "used_sql": result["needs_sql"],
+            "fast_path_intent": result["parsed_intent"].name if result["parsed_intent"] else None,
+            "used_vector_search": len(result["context"]) > 0,
+            "analysis_performed": result["needs_analysis"],
+            **result["debug"]
+        }
+        trace = current_trace()
+        if include_timings and trace is not None:
+            debug_info["timings"] = trace.summary()
         
         return {
             "answer": result["final_answer"],
             "confidence": result["confidence"],
             "sources": [c.get("merchant_name", "Unknown") for c in result["context"][:3]],
-            "debug_info": {
-                "used_sql": result["needs_sql"],
-                "used_vector_search": len(result["context"]) > 0,
-                "analysis_performed": result["needs_analysis"]
-            }
+            "debug_info": debug_info,
+            "conversation_id": conversation_id if conversation is not None else None
         }
     
+    def _get_graph(self):
+        """Build and compile the workflow once; langgraph is imported on first use"""
+        with self._graph_lock:
+            if self._graph is not None:
+                return self._graph
+            
+            from langgraph.graph import StateGraph, END
+            
+            # Build the graph
+            workflow = StateGraph(AgentState)
+            
+            # Add nodes
+            workflow.add_node("classify", _timed_node("classify", self._classify_intent))
+            workflow.add_node("retrieve_context", _timed_node("retrieve_context", self._retrieve_context))
+            workflow.add_node("execute_sql", _timed_node("execute_sql", self._execute_sql))
+            workflow.add_node("analyze", _timed_node("analyze", self._analyze_data))
+            workflow.add_node("synthesize", _timed_node("synthesize", self._synthesize_answer))
+            
+            # Define edges
+            workflow.set_entry_point("classify")
+            
+            def route_after_classify(state):
+                if state["needs_sql"]:
+                    return "execute_sql"
+                elif state["needs_vector"]:
+                    return "retrieve_context"
+                else:
+                    return "analyze"
+            
+            def route_after_sql(state):
+                return "retrieve_context" if state["needs_vector"] else "analyze"
+            
+            workflow.add_conditional_edges(
+                "classify",
+                route_after_classify,
+                {
+                    "execute_sql": "execute_sql",
+                    "retrieve_context": "retrieve_context",
+                    "analyze": "analyze"
+                }
+            )
+            workflow.add_conditional_edges(
+                "execute_sql",
+                route_after_sql,
+                {
+                    "retrieve_context": "retrieve_context",
+                    "analyze": "analyze"
+                }
+            )
+            
+            workflow.add_edge("retrieve_context", "analyze")
+            workflow.add_edge("analyze", "synthesize")
+            workflow.add_edge("synthesize", END)
+            
+            self._graph = workflow.compile()
+            return self._graph
+    
     def _classify_intent(self, state: AgentState) -> AgentState:
-        """Classify user intent"""
+        """Decide which stages (SQL, vector search, budget analysis) the question needs"""
+        # Fast path: common question shapes map straight to hand-written SQL
+        state["parsed_intent"] = self.intent_parser.parse(state["user_id"], state["query"])
+        
+        recognized = self._classify_with_router(state) if self.intent_router.ready else None
+        if recognized is None:
+            recognized = self._classify_with_keywords(state)
+        
+        if state["parsed_intent"] is not None:
+            state["needs_sql"] = True
+            state["needs_vector"] = False
+        elif not recognized:
+            # Questions no route recognizes go to a small classification model, if one is configured;
+            # otherwise (or if it fails) an uncertain router decision falls back to the keyword rules
+            label = None
+            if self.model_router.route(CLASSIFICATION).configured:
+                label = self._classify_with_model(state["query"], state["deadline"])
+            if label:
+                state["needs_sql"], state["needs_analysis"] = CLASSIFICATION_LABELS[label]
+                state["needs_vector"] = label != "general" and not state["needs_sql"]
+                state["debug"]["model_classification"] = label
+            elif state["debug"].get("routing") != "keywords":
+                self._classify_with_keywords(state)
+        
+        return state
+    
+    def _classify_with_router(self, state: AgentState) -> Optional[bool]:
+        """Embedding routing; the query embedding is kept for retrieval. None if the query can't be embedded"""
+        try:
+            with timed("embed"):
+                state["query_embedding"] = self.embedding_service.encode(state["query"])
+        except Exception as e:
+            print(f"Intent routing error: {e}")
+            return None
+        
+        decision = self.intent_router.route(state["query_embedding"])
+        state["needs_sql"] = decision.needs_sql
+        state["needs_vector"] = decision.needs_vector
+        state["needs_analysis"] = decision.needs_analysis
+        state["debug"]["route_probabilities"] = decision.probabilities
+        # A confident general question keeps all stages off; only a low-probability decision falls back
+        return not decision.uncertain
+    
+    def _classify_with_keywords(self, state: AgentState) -> bool:
+        """Substring rules used until the intent router is calibrated"""
         query_lower = state["query"].lower()
         
         # Check if query needs specific data lookup
         sql_keywords = ["how much", "total", "spent", "sum", "count", "last month", "this month"]
         state["needs_sql"] = any(keyword in query_lower for keyword in sql_keywords)
+        state["needs_vector"] = not state["needs_sql"]
         
         # Check if needs budget analysis
         analysis_keywords = ["budget", "saving", "overspent", "afford", "goal"]
         state["needs_analysis"] = any(keyword in query_lower for keyword in analysis_keywords)
         
-        return state
+        state["debug"]["routing"] = "keywords"
+        return state["needs_sql"] or state["needs_analysis"]
+    
+    def _classify_with_model(self, query: str, deadline: float) -> Optional[str]:
+        prompt = f"""Classify this question to a personal finance assistant. Reply with exactly one word:
+data - needs the user's transactions, balances or totals
+analysis - needs a review of budgets, savings or goals
+both - needs both
+general - general financial advice
+
+Question: {query}
+Label:"""
+        try:
+            response = self._call_ollama(prompt, CLASSIFICATION, priority=Priority.INTERACTIVE, deadline=deadline)
+        except LLMUnavailableError:
+            return None
+        words = response.strip().lower().split()
+        label = words[0].strip(".,:") if words else ""
+        return label if label in CLASSIFICATION_LABELS else None
     
     def _retrieve_context(self, state: AgentState) -> AgentState:
-        """Retrieve relevant context from Weaviate"""
-        if not self.weaviate_ready:
+        """Retrieve relevant context from the local index or Weaviate"""
+        if not self.weaviate_ready and not self.local_index:
+            return state
+        # Taken together so the query is embedded with the model of the class it searches
+        version, embedder = self.embedding_version.current()
+        if not embedder.ready:
+            state["debug"]["vector_search_skipped"] = f"embedding model {embedder.status}"
             return state
         
         try:
-            # Generate query embedding
-            query_embedding = self.embedder.encode(state["query"])
+            if embedder is self.embedder:
+                # Reuse the embedding computed for routing
+                query_embedding = state["query_embedding"]
+                if query_embedding is None:
+                    with timed("embed"):
+                        query_embedding = self.embedding_service.encode(state["query"])
+            else:
+                with timed("embed", model=embedder.model_name):
+                    query_embedding = embedder.encode(state["query"])
+            # Compact versions search projected vectors
+            query_embedding = version.project(query_embedding)
             
-            # Search in Weaviate
-            result = (
-                self.weaviate_client.query
-                .get("Transaction", ["transaction_id", "merchant_name", "category", "amount", "transaction_date", "description"])
-                .with_near_vector({"vector": query_embedding.tolist()})
-                .with_where({
-                    "path": ["user_id"],
-                    "operator": "Equal",
-                    "valueString": state["user_id"]
-                })
-                .with_limit(5)
-                .do()
-            )
+            # Dates, categories, merchants and amounts in the question narrow the search before ranking
+            filters = self.query_analyzer.analyze(state["query"])
+            if not filters.is_empty():
+                state["debug"]["retrieval_filters"] = filters.describe()
             
-            transactions = result.get("data", {}).get("Get", {}).get("Transaction", [])
-            state["context"] = transactions
+            context = self._search_context(state["user_id"], query_embedding, filters, version.class_name)
+            if not context and not filters.is_empty():
+                # Filters may be too narrow, or older objects may predate transaction_day
+                state["debug"]["retrieval_filters_relaxed"] = True
+                context = self._search_context(state["user_id"], query_embedding, None, version.class_name)
+            state["context"] = context or []
             
+        except CircuitOpenError:
+            state["debug"]["vector_search_skipped"] = "weaviate circuit open"
         except Exception as e:
             print(f"Vector search error: {e}")
             state["context"] = []
         
         return state
     
+    def _search_context(self, user_id: str, query_embedding: np.ndarray, filters: Optional[QueryFilters],
+                        class_name: str, limit: int = 5):
+        """Top matches from the local index or Weaviate, or None if neither can serve"""
+        # Hot users are answered in-process; cold or huge users fall through to Weaviate
+        if self.local_index:
+            with timed("local_index"):
+                local_results = self.local_index.near_vector(user_id, query_embedding, limit=limit, filters=filters)
+            if local_results is not None:
+                return local_results
+        
+        if not self.weaviate_ready:
+            return None
+        
+        # A tenant holds only its user's objects, so the user_id filter is dropped there
+        where = (filters or QueryFilters()).to_where(None if self.weaviate_multi_tenancy else user_id)
+        
+        def build(class_name):
+            query = (
+                self.weaviate_client.query
+                .get(class_name, TRANSACTION_PROPERTIES)
+                .with_near_vector({"vector": query_embedding.tolist()})
+                .with_limit(limit)
+            )
+            return query.with_where(where) if where else query
+        
+        # Search in Weaviate
+        with timed("weaviate", op="near_vector"), self.weaviate_breaker.call():
+            return run_user_query(self.weaviate_client, user_id, build, class_name, self.weaviate_multi_tenancy)
+    
+    def _load_user_vectors(self, user_id: str, max_count: int):
+        """Fetch up to max_count of a user's vectors from Weaviate for the local index"""
+        if not self.weaviate_ready:
+            return None
+        
+        where = QueryFilters().to_where(None if self.weaviate_multi_tenancy else user_id)
+        
+        def build(class_name):
+            query = (
+                self.weaviate_client.query
+                .get(class_name, TRANSACTION_PROPERTIES)
+                .with_additional(["vector"])
+                .with_limit(max_count)
+            )
+            return query.with_where(where) if where else query
+        
+        try:
+            with timed("weaviate", op="load_user_vectors"), self.weaviate_breaker.call():
+                objects = run_user_query(self.weaviate_client, user_id, build, self.embedding_version.version.class_name,
+                                         self.weaviate_multi_tenancy)
+        except Exception as e:
+            print(f"Local index load error: {e}")
+            return None
+        
+        if not objects:
+            return np.zeros((0, 0), dtype=np.float32), []
+        
+        vectors = np.array([obj.pop("_additional")["vector"] for obj in objects], dtype=np.float32)
+        return vectors, objects
+    
     def _execute_sql(self, state: AgentState) -> AgentState:
-        """Execute SQL query using LLM-generated SQL"""
+        """Execute SQL query, using LLM-generated SQL only when the intent parser has no match"""
         try:
+            intent = state["parsed_intent"]
+            if intent:
+                with timed("postgres", op=intent.name):
+                    result = self.sql_tool.execute_bounded(intent.sql, intent.params)
+                state["sql_result"] = json.dumps({"query": intent.description, **result}, default=str)
+                return state
+            
             # Generate SQL using Ollama
-            sql_query = self._generate_sql(state["user_id"], state["query"])
+            sql_query = self._generate_sql(state["user_id"], state["query"], deadline=state["deadline"])
+            result = self._run_generated_sql(sql_query)
             
-            # Execute SQL
-            result = self.sql_tool.execute(sql_query)
-            state["sql_result"] = json.dumps(result)
+            # A small SQL model that produced something unparsable gets one retry on the main model
+            fallback_model = self.model_router.route(SQL).fallback_model
+            if fallback_model and _unparsable(result):
+                metrics.inc("llm_sql_fallbacks_total", help_text="Generated SQL retried on the fallback model")
+                state["debug"]["sql_model_fallback"] = fallback_model
+                sql_query = self._generate_sql(state["user_id"], state["query"], deadline=state["deadline"],
+                                               model=fallback_model)
+                result = self._run_generated_sql(sql_query)
+            state["sql_result"] = json.dumps(result, default=str)
             
+        except LLMCircuitOpenError as e:
+            state["sql_result"] = json.dumps({"error": str(e)})
+        except LLMUnavailableError:
+            raise
         except Exception as e:
             print(f"SQL execution error: {e}")
             state["sql_result"] = json.dumps({"error": str(e)})
         
         return state
     
+    def _run_generated_sql(self, sql_query: str) -> Dict[str, Any]:
+        """Execute SQL with a timeout, read-only transaction and row cap"""
+        if not is_read_query(sql_query):
+            return {"error": "Generated text is not a SELECT query", "unparsable": True}
+        with timed("postgres", op="generated_sql"):
+            return self.sql_tool.execute_bounded(sql_query)
+    
     def _analyze_data(self, state: AgentState) -> AgentState:
         """Perform budget/financial analysis"""
         if not state["needs_analysis"]:
             return state
         
         try:
-            analysis = self.budget_analyzer.analyze(state["user_id"])
+            with timed("postgres", op="budget_analysis"):
+                analysis = self.budget_analyzer.analyze(state["user_id"])
             state["analysis_result"] = analysis
         except Exception as e:
             print(f"Analysis error: {e}")
@@ -228,23 +730,43 @@ class FinGuruAgent:
         return state
     
     def _synthesize_answer(self, state: AgentState) -> AgentState:
-        """Generate final answer using LLM"""
+        """Generate final answer using LLM, continuing the conversation's Ollama context when cached"""
+        conversation_id = state["conversation_id"]
+        model = self.model_router.route(SYNTHESIS).model
         try:
-            # Build prompt
-            prompt = self._build_synthesis_prompt(state)
+            cached = None
+            if conversation_id:
+                # A cached context already holds the system prompt and earlier turns, so only this turn is sent
+                prompt = self._build_synthesis_prompt(state, continuing=True)
+                cached = self.llm_contexts.get(conversation_id, model, SYNTHESIS_PREFIX_KEY,
+                                               state["conversation"]["last_seq"], turn_tokens=estimate_tokens(prompt))
+            if cached is None:
+                prompt = self._build_synthesis_prompt(state)
+            fields = {"context": cached} if cached else {"system": SYNTHESIS_SYSTEM_PROMPT}
+            state["debug"]["llm_context_tokens_reused"] = len(cached) if cached else 0
             
-            # Call Ollama
-            answer = self._call_ollama(prompt)
-            state["final_answer"] = answer
+            data = self._generate(prompt, SYNTHESIS, priority=Priority.INTERACTIVE, deadline=state["deadline"], **fields)
+            state["final_answer"] = data["response"]
+            if conversation_id and data.get("context"):
+                state["llm_context"] = (model, data["context"])
             
+        except LLMCircuitOpenError:
+            state["final_answer"] = "The AI assistant is temporarily unavailable. Please try again in a moment."
+            state["confidence"] = 0.0
+            state["debug"]["llm_unavailable"] = True
+        except LLMUnavailableError:
+            raise
         except Exception as e:
             print(f"Synthesis error: {e}")
+            if conversation_id:
+                self.llm_contexts.invalidate(conversation_id)
             state["final_answer"] = "I apologize, but I encountered an error processing your request. Please try again."
             state["confidence"] = 0.5
         
         return state
     
-    def _generate_sql(self, user_id: str, query: str) -> str:
+    def _generate_sql(self, user_id: str, query: str, deadline: Optional[float] = None,
+                      model: Optional[str] = None) -> str:
         """Generate SQL query using LLM"""
         prompt = f"""Generate a PostgreSQL query to answer this question. Return ONLY the SQL query with no explanation.
 
@@ -260,103 +782,169 @@ Important: Always filter by user_id = '{user_id}' in WHERE clause.
 
 SQL Query:"""
         
-        response = self._call_ollama(prompt)
+        response = self._call_ollama(prompt, SQL, priority=Priority.SQL_GENERATION, deadline=deadline, model=model)
         
         # Extract SQL from response
         sql = response.strip()
-        if "```
-            sql = sql.split("```sql").split("```
+        if "```sql" in sql:
+            sql = sql.split("```sql")[1].split("```")[0].strip()
         elif "```" in sql:
-            sql = sql.split("``````")[0].strip()
+            sql = sql.split("```")[1].split("```")[0].strip()
         
         return sql
     
-    def _build_synthesis_prompt(self, state: AgentState) -> str:
-        """Build prompt for final answer synthesis"""
-        context_str = "\n".join([
-            f"- {t.get('merchant_name', 'Unknown')}: ${t.get('amount', 0)} on {t.get('transaction_date', 'N/A')} ({t.get('category', 'Uncategorized')})"
-            for t in state["context"][:5]
-        ])
-        
-        sql_result_str = state["sql_result"] if state["sql_result"] else "No specific data retrieved"
-        
-        analysis_str = ""
-        if state["analysis_result"]:
-            analysis_str = f"\nBudget Analysis:\n{json.dumps(state['analysis_result'], indent=2)}"
-        
-        prompt = f"""You are FinGuru, a helpful AI financial assistant. Answer the user's question using the provided data.
-
-User Question: {state["query"]}
-
-Recent Transactions:
-{context_str}
-
-Database Query Result:
-{sql_result_str}
-{analysis_str}
-
-Provide a clear, actionable answer. Use specific numbers when available. If suggesting financial advice, be helpful and practical.
+    def _build_synthesis_prompt(self, state: AgentState, continuing: bool = False) -> str:
+        """
+        Build this turn's synthesis prompt within the prompt token budget.
+        
+        The instructions live in SYNTHESIS_SYSTEM_PROMPT. When continuing a
+        cached Ollama context the earlier turns are already in it, so the
+        conversation section is left out.
+        """
+        header = ""
+        footer = f"""User Question: {state["query"]}
 
 Answer:"""
         
+        builder = self.prompt_builder
+        conversation = [] if continuing else self.conversations.render(state["conversation"])
+        sections = [
+            PromptSection("conversation", "Conversation So Far:", conversation),
+            PromptSection("context", "Recent Transactions:", builder.context_renderings(state["context"])),
+            PromptSection("sql_result", "Database Query Result:", builder.sql_result_renderings(state["sql_result"]),
+                          empty_text="No specific data retrieved",
+                          omitted_text=builder.sql_result_omitted_text(state["sql_result"])),
+            PromptSection("analysis", "Budget Analysis:", builder.analysis_renderings(state["analysis_result"])),
+        ]
+        
+        # Vector context is the weakest signal, exact query results the strongest
+        prompt, stats = builder.assemble(header, sections, footer,
+                                         drop_order=["context", "conversation", "analysis", "sql_result"])
+        state["debug"].update(stats)
+        
         return prompt
     
-    def _call_ollama(self, prompt: str) -> str:
-        """Call Ollama LLM API"""
+    def _call_ollama(self, prompt: str, task: str = SYNTHESIS, priority: Priority = Priority.INTERACTIVE,
+                     deadline: Optional[float] = None, model: Optional[str] = None) -> str:
+        """
+        Call Ollama LLM API through admission control, coalescing identical concurrent requests.
+        
+        Raises LLMUnavailableError when the request cannot be served before its
+        deadline, and LLMCircuitOpenError while Ollama's breaker is open, so
+        callers can fail fast instead of timing out. Other failures return an
+        apology as the answer.
+        """
         try:
-            import requests
-            
-            response = requests.post(
-                f"{self.ollama_url}/api/generate",
-                json={
-                    "model": self.llm_model,
-                    "prompt": prompt,
-                    "stream": False
-                },
-                timeout=60
-            )
-            
-            if response.status_code == 200:
-                return response.json()["response"]
-            else:
-                return "I'm having trouble processing your request right now."
-                
+            return self._generate(prompt, task, priority, deadline, model=model)["response"]
+        except LLMUnavailableError:
+            raise
+        except OllamaError as e:
+            print(f"Ollama API error: {e}")
+            return "I'm having trouble processing your request right now."
         except Exception as e:
             print(f"Ollama API error: {e}")
             return "I apologize, but I'm experiencing technical difficulties."
     
+    def _summarize_conversation(self, prompt: str) -> str:
+        """Conversation summaries run behind every interactive and SQL call and raise on failure"""
+        return self._generate(prompt, SUMMARY, priority=Priority.BACKGROUND)["response"]
+    
+    def _phrase_nudge(self, nudge: Dict[str, str]) -> str:
+        """Rewrite a template nudge in a friendlier voice; numbers must survive unchanged"""
+        prompt = f"""Rewrite this budgeting tip as one friendly, encouraging sentence under 30 words.
+Keep every number exactly as written. Reply with the sentence only.
+
+{nudge["title"]}: {nudge["message"]}
+
+Rewritten:"""
+        message = self._generate(prompt, NUDGE, priority=Priority.BACKGROUND)["response"].strip().strip('"')
+        numbers = [word.strip(".,") for word in nudge["message"].split() if any(c.isdigit() for c in word)]
+        if not all(number in message for number in numbers):
+            raise ValueError("rephrased nudge changed its numbers")
+        return message
+    
+    def _generate(self, prompt: str, task: str = SYNTHESIS, priority: Priority = Priority.INTERACTIVE,
+                  deadline: Optional[float] = None, model: Optional[str] = None, **fields) -> Dict[str, Any]:
+        """
+        Ollama's full generate response for a task, using the task's routed model and options.
+        
+        Extra fields (system, context) go into the request. Every failure raises.
+        """
+        if not self.ollama_breaker.allow():
+            raise LLMCircuitOpenError("The language model is temporarily unavailable")
+        
+        route = self.model_router.route(task)
+        model = model or route.model
+        options = route.options
+        fields.setdefault("keep_alive", self.model_router.keep_alive)
+        key = (
+            model,
+            hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+            json.dumps(options or {}, sort_keys=True),
+            hashlib.sha256(json.dumps(fields, sort_keys=True).encode("utf-8")).hexdigest(),
+        )
+        
+        def generate():
+            with self.llm_scheduler.slot(priority, deadline):
+                timeout = None if deadline is None else max(1.0, deadline - time.monotonic())
+                with timed("ollama", model=model, task=task, priority=priority.name.lower()) as span:
+                    with self.ollama_breaker.call():
+                        data = self.ollama.generate(model, prompt, options, timeout=timeout, **fields)
+                    span["prompt_tokens"] = data.get("prompt_eval_count")
+                    span["completion_tokens"] = data.get("eval_count")
+                    metrics.inc("llm_tokens_total", data.get("prompt_eval_count") or 0, help_text="Tokens processed by Ollama", kind="prompt")
+                    metrics.inc("llm_tokens_total", data.get("eval_count") or 0, help_text="Tokens processed by Ollama", kind="completion")
+                    return data
+        
+        try:
+            wait = None if deadline is None else max(0.0, deadline - time.monotonic())
+            # Includes queueing and waiting on a coalesced call, unlike the "ollama" stage
+            with timed("llm_call", priority=priority.name.lower()):
+                return self.llm_single_flight.do(key, generate, timeout=wait)
+        except CircuitOpenError as e:
+            raise LLMCircuitOpenError(str(e))
+        except FutureTimeoutError:
+            raise LLMDeadlineError("Timed out waiting for a shared LLM response")
+    
     async def analyze_budget(self, user_id: str) -> Dict:
         """Perform comprehensive budget analysis"""
-        return self.budget_analyzer.analyze(user_id)
+        with timed("postgres", op="budget_analysis"):
+            return await asyncio.to_thread(self.budget_analyzer.analyze, user_id)
+    
+    def analyze_budget_batch(self, user_ids: Optional[List[str]] = None, shard_index: Optional[int] = None,
+                             shard_count: Optional[int] = None, chunk_size: int = 500):
+        """Stream (user_id, analysis) for a list of users or a hash shard of the users table"""
+        if user_ids is None:
+            user_ids = self.budget_analyzer.iter_shard_user_ids(shard_index, shard_count, page_size=chunk_size)
+        return self.budget_analyzer.analyze_batch(user_ids, chunk_size=chunk_size)
     
     async def plan_scenario(self, user_id: str, scenario: str) -> Dict:
         """Perform what-if scenario planning"""
-        return self.scenario_planner.plan(user_id, scenario)
-    
-    async def generate_nudges(self, user_id: str) -> List[Dict]:
-        """Generate proactive nudges"""
-        nudges = []
-        
-        # Analyze spending patterns
-        analysis = self.budget_analyzer.analyze(user_id)
-        
-        # Generate nudges based on insights
-        if analysis.get("overspent_categories"):
-            for category in analysis["overspent_categories"]:
-                nudges.append({
-                    "title": f"Budget Alert: {category}",
-                    "message": f"You've exceeded your {category} budget by ${analysis['overspent_amount'][category]:.2f}",
-                    "type": "budget_warning",
-                    "priority": "high"
-                })
-        
-        # Check for savings opportunities
-        if analysis.get("savings_opportunity"):
-            nudges.append({
-                "title": "Savings Opportunity",
-                "message": f"You can save ${analysis['savings_opportunity']:.2f} by reducing discretionary spending.",
-                "type": "savings_tip",
-                "priority": "medium"
-            })
-        
-        return nudges
+        with timed("postgres", op="scenario_plan"):
+            return await asyncio.to_thread(self.scenario_planner.plan, user_id, scenario)
+    
+    async def compare_scenarios(self, user_id: str, scenarios: List[str],
+                                emergency_fund_months: Optional[float] = None) -> Dict:
+        """Project several what-if scenarios against the same simulated cash-flow paths"""
+        with timed("postgres", op="scenario_compare"):
+            return await asyncio.to_thread(self.scenario_planner.compare, user_id, scenarios, emergency_fund_months)
+    
+    async def generate_nudges(self, user_id: str, refresh: bool = False) -> List[Dict]:
+        """Serve precomputed nudges, optionally recomputing this user's first"""
+        if refresh:
+            await asyncio.to_thread(self.nudge_scheduler.refresh_users, [user_id])
+        
+        return await asyncio.to_thread(self.nudge_scheduler.get_nudges, user_id)
+
+
+def _unparsable(result: Dict[str, Any]) -> bool:
+    """Generated SQL that wasn't a query, or that Postgres couldn't parse"""
+    return bool(result.get("unparsable")) or "syntax error" in str(result.get("error", ""))
+
+
+def _timed_node(name: str, fn):
+    """Wrap a graph node so its duration is recorded under node:<name>"""
+    def node(state: AgentState) -> AgentState:
+        with timed(f"node:{name}"):
+            return fn(state)
+    return node
@@ -0,0 +1,147 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, Optional, Tuple
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """The dependency's breaker is open; the call was not attempted"""
+
+
+class CircuitBreaker:
+    """
+    Per-dependency circuit breaker driven by error rate and latency.
+
+    Outcomes of the last window_size calls are kept; calls slower than
+    slow_call_seconds count as failures. When the failure rate over at least
+    min_calls reaches failure_rate_threshold the breaker opens and callers
+    fail immediately. While open, a background thread runs the probe every
+    open_seconds (half-open) and closes the breaker on the first success, so
+    user requests are never used as probes.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        probe: Callable[[], Any],
+        failure_rate_threshold: float = 0.5,
+        slow_call_seconds: float = 30.0,
+        window_size: int = 20,
+        min_calls: int = 5,
+        open_seconds: float = 15.0,
+    ):
+        self.name = name
+        self.probe = probe
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+
+        self.state = CLOSED
+        self._outcomes: Deque[Tuple[bool, float]] = deque(maxlen=window_size)
+        self._lock = threading.Lock()
+        self._prober: Optional[threading.Thread] = None
+        self._opened_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.stats = {"calls": 0, "failures": 0, "rejected": 0, "trips": 0, "probes": 0}
+
+    @property
+    def available(self) -> bool:
+        return self.state == CLOSED
+
+    def allow(self) -> bool:
+        """Whether a call may go through; counts a rejection when it may not"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            self.stats["rejected"] += 1
+            return False
+
+    @contextmanager
+    def call(self) -> Iterator[None]:
+        """Guard one call to the dependency, recording its outcome"""
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} is unavailable (circuit open)")
+        started = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self.record(False, time.monotonic() - started, str(e))
+            raise
+        self.record(True, time.monotonic() - started)
+
+    def record(self, success: bool, duration: float, error: Optional[str] = None):
+        if success and duration > self.slow_call_seconds:
+            success = False
+            error = f"slow call ({duration:.1f}s)"
+
+        with self._lock:
+            self.stats["calls"] += 1
+            self._outcomes.append((success, duration))
+            if success:
+                return
+            self.stats["failures"] += 1
+            self.last_error = error
+            failures = sum(1 for ok, _ in self._outcomes if not ok)
+            if (
+                self.state == CLOSED
+                and len(self._outcomes) >= self.min_calls
+                and failures / len(self._outcomes) >= self.failure_rate_threshold
+            ):
+                self._open_locked()
+
+    def trip(self, error: Optional[str] = None):
+        """Open the breaker immediately, e.g. when a startup probe fails"""
+        with self._lock:
+            if error:
+                self.last_error = error
+            if self.state == CLOSED:
+                self._open_locked()
+
+    def _open_locked(self):
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self.stats["trips"] += 1
+        print(f"⚠️ Circuit for {self.name} opened: {self.last_error}")
+        if self._prober is None or not self._prober.is_alive():
+            self._prober = threading.Thread(target=self._probe_loop, name=f"probe-{self.name}", daemon=True)
+            self._prober.start()
+
+    def _probe_loop(self):
+        while True:
+            time.sleep(self.open_seconds)
+            with self._lock:
+                self.state = HALF_OPEN
+                self.stats["probes"] += 1
+            try:
+                self.probe()
+            except Exception as e:
+                with self._lock:
+                    self.state = OPEN
+                    self.last_error = f"probe failed: {e}"
+                continue
+
+            with self._lock:
+                self.state = CLOSED
+                self._outcomes.clear()
+                self._opened_at = None
+            print(f"✅ Circuit for {self.name} closed")
+            return
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            outcomes = list(self._outcomes)
+            stats = dict(self.stats)
+            stats.update({
+                "state": self.state,
+                "window_failure_rate": round(sum(1 for ok, _ in outcomes if not ok) / len(outcomes), 3) if outcomes else 0.0,
+                "window_avg_latency_seconds": round(sum(d for _, d in outcomes) / len(outcomes), 3) if outcomes else None,
+                "open_for_seconds": round(time.monotonic() - self._opened_at, 1) if self._opened_at else None,
+                "last_error": self.last_error,
+            })
+        return stats
@@ -0,0 +1,215 @@
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from psycopg2.extras import RealDictCursor, execute_values
+
+from app.db_pool import DatabasePool
+from app.prompt_builder import CHARS_PER_TOKEN
+
+# Stored messages are capped so one pasted wall of text can't dominate every later prompt
+MAX_MESSAGE_CHARS = 2000
+
+# Upper bound on unsummarized messages loaded per request, should summarization fall behind
+MAX_LOADED_MESSAGES = 40
+
+LOAD_CONVERSATION_SQL = """
+    SELECT c.id, c.user_id, c.summary, c.summarized_through,
+           (SELECT COALESCE(MAX(t.seq), 0) FROM conversation_turns t WHERE t.conversation_id = c.id) AS last_seq
+    FROM conversations c
+    WHERE c.id = %s
+"""
+
+LOAD_TURNS_SQL = """
+    SELECT seq, role, content FROM (
+        SELECT seq, role, content FROM conversation_turns
+        WHERE conversation_id = %s AND seq > %s
+        ORDER BY seq DESC
+        LIMIT %s
+    ) recent
+    ORDER BY seq
+"""
+
+SUMMARY_PROMPT = """Summarize this conversation between a user and FinGuru, their financial assistant, in at most 120 words.
+Keep amounts, dates, goals, preferences and anything the user asked to remember. Write in the third person.
+
+{previous}Messages:
+{messages}
+
+Summary:"""
+
+
+class ConversationNotFoundError(Exception):
+    """No conversation with this id belongs to the user"""
+
+
+class ConversationStore:
+    """
+    Server-side conversation memory keyed by conversation id.
+
+    Messages are kept in Postgres. A request loads the rolling summary plus
+    the messages not yet folded into it. Once those exceed
+    summary_threshold_tokens, all but the last recent_messages are summarized
+    in the background at the LLM's lowest priority, so prompt context stays
+    bounded however long the conversation runs.
+    """
+
+    def __init__(
+        self,
+        db_pool: DatabasePool,
+        summarize: Callable[[str], str],
+        recent_messages: int = 6,
+        summary_threshold_tokens: int = 800,
+        workers: int = 2,
+    ):
+        self.db_pool = db_pool
+        self.summarize = summarize
+        self.recent_messages = recent_messages
+        self.summary_threshold_tokens = summary_threshold_tokens
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="summaries")
+        self._in_flight: Set[str] = set()
+        self._lock = threading.Lock()
+        self.stats = {"opened": 0, "created": 0, "messages_appended": 0, "summaries": 0, "summary_failures": 0}
+
+    def open(self, user_id: str, conversation_id: Optional[str] = None,
+             seed_messages: Optional[List[Tuple[str, str]]] = None) -> Tuple[str, Dict[str, Any]]:
+        """
+        Load a conversation, or start one when no id is given.
+
+        A new conversation can be seeded with client-side history so existing
+        clients keep their context the first time they call without an id.
+        """
+        if conversation_id is None:
+            conversation_id = self._create(user_id, seed_messages or [])
+        self.stats["opened"] += 1
+
+        with self.db_pool.connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                self.db_pool.execute_prepared(cursor, "load_conversation", LOAD_CONVERSATION_SQL, (conversation_id,))
+                row = cursor.fetchone()
+                if row is None or row["user_id"] != user_id:
+                    raise ConversationNotFoundError(f"Conversation {conversation_id} not found")
+                self.db_pool.execute_prepared(cursor, "load_conversation_turns", LOAD_TURNS_SQL,
+                                              (conversation_id, row["summarized_through"], MAX_LOADED_MESSAGES))
+                turns = cursor.fetchall()
+
+        return conversation_id, {
+            "summary": row["summary"],
+            "messages": [{"role": t["role"], "content": t["content"]} for t in turns],
+            "last_seq": row["last_seq"],
+        }
+
+    def append(self, conversation_id: str, messages: List[Tuple[str, str]]) -> int:
+        """
+        Store the new messages and summarize in the background if the window
+        got too large. Returns the seq of the last message stored.
+        """
+        with self.db_pool.connection() as conn:
+            with conn.cursor() as cursor:
+                last_seq = self._insert(cursor, conversation_id, messages)
+                cursor.execute("""
+                    SELECT COALESCE(SUM(LENGTH(t.content)), 0)
+                    FROM conversation_turns t JOIN conversations c ON c.id = t.conversation_id
+                    WHERE t.conversation_id = %s AND t.seq > c.summarized_through
+                """, (conversation_id,))
+                unsummarized_chars = cursor.fetchone()[0]
+        self.stats["messages_appended"] += len(messages)
+
+        if unsummarized_chars / CHARS_PER_TOKEN > self.summary_threshold_tokens:
+            self._schedule_summary(conversation_id)
+        return last_seq
+
+    def render(self, conversation: Optional[Dict[str, Any]]) -> List[str]:
+        """Prompt renderings from richest to cheapest: summary plus recent messages, fewer messages, summary only"""
+        if not conversation or not (conversation["summary"] or conversation["messages"]):
+            return []
+        summary = f"Summary of earlier conversation: {conversation['summary']}\n" if conversation["summary"] else ""
+        lines = [f"{m['role'].capitalize()}: {m['content']}" for m in conversation["messages"]]
+        renderings = [summary + "\n".join(lines[-n:]) for n in (len(lines), self.recent_messages, 2) if n and lines]
+        if summary:
+            renderings.append(summary.strip())
+        return renderings
+
+    def _create(self, user_id: str, seed_messages: List[Tuple[str, str]]) -> str:
+        conversation_id = str(uuid.uuid4())
+        with self.db_pool.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO conversations (id, user_id, summarized_through, created_at, updated_at)
+                    VALUES (%s, %s, 0, NOW(), NOW())
+                """, (conversation_id, user_id))
+                if seed_messages:
+                    self._insert(cursor, conversation_id, seed_messages)
+        self.stats["created"] += 1
+        return conversation_id
+
+    def _insert(self, cursor, conversation_id: str, messages: List[Tuple[str, str]]) -> int:
+        # Locking the conversation row serializes seq allocation between concurrent requests
+        cursor.execute("""
+            UPDATE conversations SET updated_at = NOW() WHERE id = %s
+        """, (conversation_id,))
+        cursor.execute("""
+            SELECT COALESCE(MAX(seq), 0) FROM conversation_turns WHERE conversation_id = %s
+        """, (conversation_id,))
+        last_seq = cursor.fetchone()[0]
+        execute_values(cursor, """
+            INSERT INTO conversation_turns (conversation_id, seq, role, content, created_at)
+            VALUES %s
+        """, [
+            (conversation_id, last_seq + i, role, content[:MAX_MESSAGE_CHARS])
+            for i, (role, content) in enumerate(messages, start=1)
+        ], template="(%s, %s, %s, %s, NOW())")
+        return last_seq + len(messages)
+
+    def _schedule_summary(self, conversation_id: str):
+        with self._lock:
+            if conversation_id in self._in_flight:
+                return
+            self._in_flight.add(conversation_id)
+        self._executor.submit(self._summarize, conversation_id)
+
+    def _summarize(self, conversation_id: str):
+        try:
+            with self.db_pool.connection() as conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                    cursor.execute(LOAD_CONVERSATION_SQL, (conversation_id,))
+                    conversation = cursor.fetchone()
+                    cursor.execute("""
+                        SELECT seq, role, content FROM conversation_turns
+                        WHERE conversation_id = %s AND seq > %s
+                        ORDER BY seq
+                    """, (conversation_id, conversation["summarized_through"]))
+                    turns = cursor.fetchall()
+
+            # Keep the most recent messages verbatim; fold everything older into the summary
+            to_fold = turns[:-self.recent_messages] if self.recent_messages else turns
+            if not to_fold:
+                return
+            previous = f"Previous summary: {conversation['summary']}\n\n" if conversation["summary"] else ""
+            messages = "\n".join(f"{t['role'].capitalize()}: {t['content']}" for t in to_fold)
+            summary = self.summarize(SUMMARY_PROMPT.format(previous=previous, messages=messages)).strip()
+            if not summary:
+                raise ValueError("empty summary")
+
+            with self.db_pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    # Only advance; a concurrent summary of the same range wins once
+                    cursor.execute("""
+                        UPDATE conversations
+                        SET summary = %s, summarized_through = %s
+                        WHERE id = %s AND summarized_through = %s
+                    """, (summary, to_fold[-1]["seq"], conversation_id, conversation["summarized_through"]))
+            self.stats["summaries"] += 1
+        except Exception as e:
+            self.stats["summary_failures"] += 1
+            print(f"⚠️ Conversation summary failed for {conversation_id}: {e}")
+        finally:
+            with self._lock:
+                self._in_flight.discard(conversation_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            in_flight = len(self._in_flight)
+        return {**self.stats, "summaries_in_flight": in_flight}
@@ -0,0 +1,60 @@
+import select
+import threading
+import time
+from typing import Callable, Optional
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+
+class NotificationListener:
+    """
+    Background LISTEN on a Postgres channel.
+
+    Uses its own connection rather than the shared pool, since it is held
+    open for the lifetime of the process. Reconnects after errors.
+    """
+
+    def __init__(self, db_url: str, channel: str, callback: Callable[[str], None], reconnect_delay: float = 5.0):
+        self.db_url = db_url
+        self.channel = channel
+        self.callback = callback
+        self.reconnect_delay = reconnect_delay
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name=f"listen-{self.channel}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(self.db_url)
+                conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {self.channel}")
+                print(f"✅ Listening for '{self.channel}' notifications")
+
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        try:
+                            self.callback(notify.payload)
+                        except Exception as e:
+                            print(f"⚠️ Notification handler error on '{self.channel}': {e}")
+            except Exception as e:
+                print(f"⚠️ Listener for '{self.channel}' failed: {e}")
+                time.sleep(self.reconnect_delay)
+            finally:
+                if conn is not None:
+                    conn.close()
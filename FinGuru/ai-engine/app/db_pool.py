@@ -0,0 +1,158 @@
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Sequence, Set
+
+import psycopg2
+from psycopg2 import pool as pg_pool
+
+
+class PoolExhaustedError(Exception):
+    """Raised when no connection frees up before the checkout timeout"""
+
+
+class DatabasePool:
+    """
+    Thread-safe Postgres connection pool shared by the agent's tools.
+
+    Connections are opened lazily, validated on checkout and carry their own
+    set of prepared statements so fixed queries are planned once per connection.
+    """
+
+    def __init__(
+        self,
+        db_url: str,
+        max_connections: int = 10,
+        checkout_timeout: float = 10.0,
+        idle_check_seconds: float = 30.0,
+    ):
+        self.db_url = db_url
+        self.max_connections = max_connections
+        self.checkout_timeout = checkout_timeout
+        self.idle_check_seconds = idle_check_seconds
+
+        self._pool: Optional[pg_pool.ThreadedConnectionPool] = None
+        self._pool_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._stats_lock = threading.Lock()
+        self._last_used: Dict[int, float] = {}
+        self._prepared: Dict[int, Set[str]] = {}
+        self.stats_counters = {
+            "checkouts": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "health_check_failures": 0,
+            "in_use": 0,
+        }
+
+    def _get_pool(self) -> pg_pool.ThreadedConnectionPool:
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = pg_pool.ThreadedConnectionPool(0, self.max_connections, self.db_url)
+        return self._pool
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        """Check out a healthy connection; commits on success and rolls back on error"""
+        if not self._slots.acquire(blocking=False):
+            with self._stats_lock:
+                self.stats_counters["waits"] += 1
+            if not self._slots.acquire(timeout=self.checkout_timeout):
+                with self._stats_lock:
+                    self.stats_counters["timeouts"] += 1
+                raise PoolExhaustedError(f"No database connection available within {self.checkout_timeout}s")
+
+        conn = None
+        try:
+            conn = self._checkout_healthy()
+            with self._stats_lock:
+                self.stats_counters["checkouts"] += 1
+                self.stats_counters["in_use"] += 1
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                if not conn.closed:
+                    conn.rollback()
+                raise
+        finally:
+            if conn is not None:
+                with self._stats_lock:
+                    self.stats_counters["in_use"] -= 1
+                self._release(conn)
+            self._slots.release()
+
+    def _checkout_healthy(self):
+        """Get a connection from the pool, replacing broken or stale ones"""
+        pool = self._get_pool()
+        for _ in range(self.max_connections + 1):
+            conn = pool.getconn()
+            if self._is_healthy(conn):
+                return conn
+            with self._stats_lock:
+                self.stats_counters["health_check_failures"] += 1
+            self._discard(conn)
+        raise psycopg2.OperationalError("Could not obtain a healthy database connection")
+
+    def _is_healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn))
+        if last_used is not None and time.monotonic() - last_used < self.idle_check_seconds:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _release(self, conn):
+        if conn.closed:
+            self._discard(conn)
+            return
+        self._last_used[id(conn)] = time.monotonic()
+        self._get_pool().putconn(conn)
+
+    def _discard(self, conn):
+        self._last_used.pop(id(conn), None)
+        self._prepared.pop(id(conn), None)
+        try:
+            self._get_pool().putconn(conn, close=True)
+        except Exception as e:
+            print(f"⚠️ Error discarding database connection: {e}")
+
+    def execute_prepared(self, cursor, name: str, sql: str, params: Sequence[Any] = ()):
+        """Execute a fixed query through a per-connection prepared statement"""
+        prepared = self._prepared.setdefault(id(cursor.connection), set())
+        if name not in prepared:
+            counter = iter(range(1, len(params) + 1))
+            statement = re.sub(r"%s", lambda _: f"${next(counter)}", sql)
+            cursor.execute(f"PREPARE {name} AS {statement}")
+            prepared.add(name)
+
+        if params:
+            cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", tuple(params))
+        else:
+            cursor.execute(f"EXECUTE {name}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool utilization for /health"""
+        with self._stats_lock:
+            counters = dict(self.stats_counters)
+        open_connections = 0
+        if self._pool is not None:
+            open_connections = len(self._pool._used) + len(self._pool._pool)
+        counters.update({
+            "max_connections": self.max_connections,
+            "open_connections": open_connections,
+            "utilization": round(counters["in_use"] / self.max_connections, 3),
+        })
+        return counters
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.closeall()
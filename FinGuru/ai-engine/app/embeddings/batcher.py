@@ -0,0 +1,116 @@
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.embeddings.embedder import TransactionEmbedder
+
+
+class EmbeddingBatcher:
+    """
+    Coalesces concurrent single-text encode calls into batched forward passes.
+
+    Callers block on a future while a background thread collects requests for
+    up to max_wait_ms or max_batch_size texts, encodes them in one call and
+    resolves every future. An LRU of recent texts skips the model for repeats.
+    """
+
+    def __init__(
+        self,
+        embedder: TransactionEmbedder,
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        cache_size: int = 2048,
+        timeout: float = 30.0,
+    ):
+        self.embedder = embedder
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.cache_size = cache_size
+        self.timeout = timeout
+
+        self._queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self._cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._thread_lock = threading.Lock()
+        self.stats = {"requests": 0, "cache_hits": 0, "batches": 0, "encoded_texts": 0}
+
+    def encode(self, text: str) -> np.ndarray:
+        """Embed one text, sharing a forward pass with concurrent callers"""
+        key = text.strip()
+        with self._cache_lock:
+            self.stats["requests"] += 1
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.stats["cache_hits"] += 1
+                return cached
+
+        self._ensure_worker()
+        future: Future = Future()
+        self._queue.put((key, future))
+        return future.result(timeout=self.timeout)
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._thread.start()
+
+    def _collect_batch(self) -> List[Tuple[str, Future]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            texts = list(dict.fromkeys(text for text, _ in batch))
+
+            try:
+                vectors = self.embedder.encode_batch(texts)
+            except Exception as e:
+                print(f"Embedding batch error: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            results: Dict[str, np.ndarray] = {}
+            for text, vector in zip(texts, vectors):
+                vector.setflags(write=False)
+                results[text] = vector
+
+            with self._cache_lock:
+                self.stats["batches"] += 1
+                self.stats["encoded_texts"] += len(texts)
+                for text, vector in results.items():
+                    self._cache[text] = vector
+                    self._cache.move_to_end(text)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+            for text, future in batch:
+                future.set_result(results[text])
+
+    def get_stats(self) -> Dict[str, float]:
+        with self._cache_lock:
+            stats = dict(self.stats)
+            stats["cached_texts"] = len(self._cache)
+        stats["avg_batch_size"] = round(stats["encoded_texts"] / stats["batches"], 2) if stats["batches"] else 0.0
+        stats["queue_depth"] = self._queue.qsize()
+        return stats
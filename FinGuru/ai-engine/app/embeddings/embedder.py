@@ -1,15 +1,59 @@
-from sentence_transformers import SentenceTransformer
+from typing import Any, Dict, List, Optional
+import threading
+import time
 import numpy as np
 
 class TransactionEmbedder:
     def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
-        """Initialize embedding model (lightweight and fast)"""
-        self.model = SentenceTransformer(model_name)
+        """Record the model to use; sentence-transformers and torch are imported on first load"""
+        self.model_name = model_name
+        self._model = None
+        self._load_lock = threading.Lock()
+        self.status = "not_loaded"
+        self.load_seconds: Optional[float] = None
+        self.error: Optional[str] = None
+    
+    @property
+    def ready(self) -> bool:
+        return self._model is not None
+    
+    @property
+    def model(self):
+        return self._model if self._model is not None else self.load()
+    
+    def load(self):
+        """Load the model once; concurrent callers wait for the same load"""
+        with self._load_lock:
+            if self._model is None:
+                self.status = "loading"
+                started = time.monotonic()
+                try:
+                    from sentence_transformers import SentenceTransformer
+                    self._model = SentenceTransformer(self.model_name)
+                except Exception as e:
+                    self.status = "failed"
+                    self.error = str(e)
+                    raise
+                self.load_seconds = round(time.monotonic() - started, 2)
+                self.status = "ready"
+        return self._model
+    
+    def warmup(self, batch_size: int = 8):
+        """Load the model and run a dummy batch so the first real request skips lazy initialization"""
+        self.load()
+        self.encode_batch(["warmup transaction"] * batch_size)
+    
+    def get_status(self) -> Dict[str, Any]:
+        return {"status": self.status, "model": self.model_name, "load_seconds": self.load_seconds, "error": self.error}
     
     def encode(self, text: str) -> np.ndarray:
         """Generate embedding for text"""
         return self.model.encode(text)
     
+    def encode_batch(self, texts: List[str]) -> np.ndarray:
+        """Generate embeddings for several texts in one forward pass"""
+        return self.model.encode(texts, batch_size=len(texts), convert_to_numpy=True)
+    
     def encode_transaction(self, transaction: dict) -> np.ndarray:
         """Generate embedding for transaction"""
         text = f"{transaction.get('merchant_name', '')} {transaction.get('category', '')} {transaction.get('description', '')}"
@@ -0,0 +1,218 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Rough per-object overhead of the cached property dicts
+OBJECT_OVERHEAD_BYTES = 400
+
+VectorLoader = Callable[[str, int], Optional[Tuple[np.ndarray, List[Dict[str, Any]]]]]
+
+
+class UserVectors:
+    """One user's transaction vectors as a contiguous, L2-normalized matrix"""
+
+    def __init__(self, matrix: np.ndarray, objects: List[Dict[str, Any]]):
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self.matrix = np.ascontiguousarray(matrix / norms, dtype=np.float32)
+        self.objects = objects
+        self.loaded_at = time.monotonic()
+        self.nbytes = self.matrix.nbytes + len(objects) * OBJECT_OVERHEAD_BYTES
+        self._columns: Optional[Dict[str, np.ndarray]] = None
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        """Filterable properties as arrays, built on the first filtered search"""
+        if self._columns is None:
+            self._columns = {
+                "day": np.array([_day_ordinal(o.get("transaction_date")) for o in self.objects], dtype=np.int64),
+                "amount": np.array([float(o.get("amount") or 0) for o in self.objects], dtype=np.float64),
+                "category": np.array([o.get("category") or "" for o in self.objects], dtype=object),
+                "merchant": np.array([(o.get("merchant_name") or "").lower() for o in self.objects], dtype=object),
+            }
+        return self._columns
+
+    def mask(self, filters) -> np.ndarray:
+        """Boolean mask of objects matching a QueryFilters"""
+        columns = self.columns()
+        keep = np.ones(len(self.objects), dtype=bool)
+        if filters.start:
+            keep &= columns["day"] >= filters.start.toordinal()
+        if filters.end:
+            keep &= columns["day"] < filters.end.toordinal()
+        if filters.category:
+            keep &= columns["category"] == filters.category
+        terms = filters.merchant_terms()
+        if terms:
+            keep &= np.fromiter((all(t in m for t in terms) for m in columns["merchant"]),
+                                dtype=bool, count=len(self.objects))
+        low, high = filters.signed_amount_range()
+        if low is not None:
+            keep &= columns["amount"] >= low
+        if high is not None:
+            keep &= columns["amount"] <= high
+        return keep
+
+
+class LocalVectorIndex:
+    """
+    In-process exact retrieval tier for hot users.
+
+    A user's vectors are loaded on first use and searched with brute-force
+    cosine similarity, which for a few thousand vectors is faster than a
+    network round-trip and keeps working while Weaviate is down. Entries are
+    kept in an LRU bounded by max_bytes; users with more than
+    max_vectors_per_user vectors are left to Weaviate.
+    """
+
+    def __init__(
+        self,
+        loader: VectorLoader,
+        max_bytes: int = 256 * 1024 * 1024,
+        max_vectors_per_user: int = 5000,
+        ttl_seconds: float = 3600.0,
+    ):
+        self.loader = loader
+        self.max_bytes = max_bytes
+        self.max_vectors_per_user = max_vectors_per_user
+        self.ttl_seconds = ttl_seconds
+
+        self._entries: "OrderedDict[str, UserVectors]" = OrderedDict()
+        self._oversized: Dict[str, float] = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._generations: Dict[str, int] = {}
+        self.stats = {"hits": 0, "loads": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def near_vector(self, user_id: str, vector: np.ndarray, limit: int = 5, filters=None) -> Optional[List[Dict[str, Any]]]:
+        """Exact cosine top-k for a user, optionally within QueryFilters, or None if Weaviate must serve the user"""
+        entry = self._get_or_load(user_id)
+        if entry is None:
+            return None
+        if not entry.objects:
+            return []
+
+        # Filter first so only matching rows are scored
+        candidates = None
+        if filters is not None and not filters.is_empty():
+            candidates = np.flatnonzero(entry.mask(filters))
+            if not len(candidates):
+                return []
+
+        query = np.asarray(vector, dtype=np.float32)
+        if entry.matrix.shape[1] != query.shape[0]:
+            # Loaded from an embedding version that has since been switched out
+            self.invalidate(user_id)
+            return None
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+        matrix = entry.matrix if candidates is None else entry.matrix[candidates]
+        scores = matrix @ query
+
+        k = min(limit, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        if candidates is not None:
+            top = candidates[top]
+        return [entry.objects[i] for i in top]
+
+    def _get_or_load(self, user_id: str) -> Optional[UserVectors]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and time.monotonic() - entry.loaded_at < self.ttl_seconds:
+                self._entries.move_to_end(user_id)
+                self.stats["hits"] += 1
+                return entry
+            if time.monotonic() - self._oversized.get(user_id, float("-inf")) < self.ttl_seconds:
+                self.stats["misses"] += 1
+                return None
+            load_lock = self._load_locks.setdefault(user_id, threading.Lock())
+
+        # One loader per user; concurrent requests wait for it instead of loading again
+        with load_lock:
+            with self._lock:
+                entry = self._entries.get(user_id)
+                if entry is not None and time.monotonic() - entry.loaded_at < self.ttl_seconds:
+                    self._entries.move_to_end(user_id)
+                    self.stats["hits"] += 1
+                    return entry
+                generation = self._generations.get(user_id, 0)
+
+            loaded = self.loader(user_id, self.max_vectors_per_user + 1)
+
+            with self._lock:
+                self._load_locks.pop(user_id, None)
+                invalidated = self._generations.pop(user_id, 0) != generation
+                if loaded is None:
+                    self.stats["misses"] += 1
+                    return None
+                matrix, objects = loaded
+                if len(objects) > self.max_vectors_per_user:
+                    self._oversized[user_id] = time.monotonic()
+                    self.stats["misses"] += 1
+                    return None
+
+                # A user without vectors is cached too, as an empty entry, so they don't reload every request
+                matrix = matrix.reshape(len(objects), -1) if objects else np.zeros((0, 0), dtype=np.float32)
+                entry = UserVectors(matrix, objects)
+                if invalidated:
+                    # Invalidated while loading; answer from this snapshot but don't cache it
+                    return entry
+                if entry.nbytes > self.max_bytes:
+                    self.stats["misses"] += 1
+                    return None
+                self._remove(user_id)
+                self._entries[user_id] = entry
+                self._total_bytes += entry.nbytes
+                self.stats["loads"] += 1
+                while self._total_bytes > self.max_bytes and self._entries:
+                    evicted_id, _ = next(iter(self._entries.items()))
+                    self._remove(evicted_id)
+                    self.stats["evictions"] += 1
+                return entry
+
+    def _remove(self, user_id: str):
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._total_bytes -= entry.nbytes
+
+    def invalidate(self, user_id: str):
+        """Drop a user's cached vectors, e.g. after new embeddings were written"""
+        with self._lock:
+            self._remove(user_id)
+            self._oversized.pop(user_id, None)
+            if user_id in self._load_locks:
+                self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            self.stats["invalidations"] += 1
+
+    def clear(self):
+        """Drop every user's cached vectors, e.g. after retrieval switched to another embedding version"""
+        with self._lock:
+            for user_id in list(self._entries):
+                self._remove(user_id)
+            self._oversized.clear()
+            for user_id in self._load_locks:
+                self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            self.stats["invalidations"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+            stats.update({
+                "users": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            })
+        return stats
+
+
+def _day_ordinal(value: Optional[str]) -> int:
+    try:
+        return date.fromisoformat(str(value)[:10]).toordinal()
+    except ValueError:
+        return -1
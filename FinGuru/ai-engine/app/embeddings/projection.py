@@ -0,0 +1,31 @@
+import io
+
+import numpy as np
+
+
+class Projection:
+    """
+    PCA projection of a compact embedding version.
+
+    Fitted offline by the transaction processor (projection.py there) and
+    stored with the version; queries are projected with the same mean and
+    components as the stored vectors.
+    """
+
+    def __init__(self, mean: np.ndarray, components: np.ndarray):
+        self.mean = np.asarray(mean, dtype=np.float32)
+        # (source_dims, dims)
+        self.components = np.asarray(components, dtype=np.float32)
+
+    @property
+    def dims(self) -> int:
+        return self.components.shape[1]
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Projection":
+        arrays = np.load(io.BytesIO(data))
+        return cls(arrays["mean"], arrays["components"])
+
+    def apply(self, vectors: np.ndarray) -> np.ndarray:
+        """Project one vector or a (n, source_dims) batch"""
+        return (np.asarray(vectors, dtype=np.float32) - self.mean) @ self.components
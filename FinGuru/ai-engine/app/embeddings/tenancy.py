@@ -0,0 +1,65 @@
+from typing import Any, Dict, List, Optional
+
+# Multi-tenant copy of the Transaction class: one tenant per user, each with its own HNSW graph
+TENANT_CLASS = "UserTransaction"
+
+
+def tenant_schema(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """The single-class schema turned into the multi-tenant class"""
+    return {
+        **schema,
+        "class": TENANT_CLASS,
+        "description": "Per-user transaction embeddings (one tenant per user)",
+        "multiTenancyConfig": {"enabled": True},
+    }
+
+
+def tenant_problem(errors: Any) -> Optional[str]:
+    """Classify a Weaviate error as a missing ('missing') or offloaded ('inactive') tenant"""
+    text = str(errors).lower()
+    if "tenant not found" in text:
+        return "missing"
+    if "not active" in text or "cold" in text or "inactive" in text:
+        return "inactive"
+    return None
+
+
+def activate_tenant(client, user_id: str, class_name: str = TENANT_CLASS):
+    """Bring a dormant user's tenant back to HOT so it can be read and written"""
+    from weaviate.schema.crud_schema import Tenant, TenantActivityStatus
+    client.schema.update_class_tenants(class_name, [Tenant(name=user_id, activity_status=TenantActivityStatus.HOT)])
+
+
+def run_user_query(client, user_id: str, build, class_name: str, multi_tenancy: bool) -> List[Dict[str, Any]]:
+    """
+    Run a Get query for one user's objects.
+
+    build(class_name) returns a query builder. With multi-tenancy class_name
+    is a multi-tenant class and the query targets the user's tenant; a user
+    without a tenant has no vectors, and a COLD tenant is activated and the
+    query retried once.
+    """
+    if not multi_tenancy:
+        result = build(class_name).do()
+        return result.get("data", {}).get("Get", {}).get(class_name) or []
+
+    for attempt in range(2):
+        try:
+            result = build(class_name).with_tenant(user_id).do()
+            errors = result.get("errors")
+        except Exception as e:
+            result, errors = {}, e
+            if tenant_problem(e) is None:
+                raise
+
+        problem = tenant_problem(errors) if errors else None
+        if problem is None:
+            if errors:
+                raise RuntimeError(f"Weaviate query failed: {errors}")
+            return result.get("data", {}).get("Get", {}).get(class_name) or []
+        if problem == "missing":
+            return []
+        if attempt:
+            raise RuntimeError(f"Tenant for {user_id} is still inactive")
+        activate_tenant(client, user_id, class_name)
+    return []
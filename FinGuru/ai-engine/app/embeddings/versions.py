@@ -0,0 +1,109 @@
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from app.db_pool import DatabasePool
+from app.embeddings.embedder import TransactionEmbedder
+from app.embeddings.projection import Projection
+
+# Sent by the transaction processor's embedding_versions.py on cutover
+EMBEDDING_VERSION_CHANNEL = "embedding_version"
+
+ACTIVE_VERSION_SQL = """
+    SELECT id, model, class_name, projection
+    FROM embedding_versions
+    WHERE status = 'active'
+    ORDER BY activated_at DESC NULLS LAST
+    LIMIT 1
+"""
+
+
+@dataclass(frozen=True)
+class EmbeddingVersion:
+    """An embedding model and the Weaviate class holding its vectors"""
+    id: str
+    model: str
+    class_name: str
+    # Compact versions store vectors projected to fewer dimensions; queries must be projected the same way
+    projection: Optional[Projection] = field(default=None, compare=False, repr=False)
+
+    def project(self, vector: np.ndarray) -> np.ndarray:
+        return vector if self.projection is None else self.projection.apply(vector)
+
+
+class ActiveEmbeddingVersion:
+    """
+    The embedding version retrieval searches.
+
+    Read from the embedding_versions table at startup and again on every
+    cutover notification; until a version is registered, the pre-versioning
+    class is used. A version on another model gets its own embedder, loaded
+    before the switch, and callers take the version and its embedder
+    together, so a query is never embedded with one model and searched
+    against another model's class.
+    """
+
+    def __init__(self, db_pool: DatabasePool, default: EmbeddingVersion, default_embedder: TransactionEmbedder,
+                 on_switch: Optional[Callable[[], None]] = None):
+        self.db_pool = db_pool
+        self.on_switch = on_switch
+        self._current: Tuple[EmbeddingVersion, TransactionEmbedder] = (default, default_embedder)
+        self._embedders: Dict[str, TransactionEmbedder] = {default_embedder.model_name: default_embedder}
+        self._refresh_lock = threading.Lock()
+        self.stats = {"switches": 0, "refresh_errors": 0}
+
+    @property
+    def version(self) -> EmbeddingVersion:
+        return self._current[0]
+
+    def current(self) -> Tuple[EmbeddingVersion, TransactionEmbedder]:
+        return self._current
+
+    def refresh(self, payload: Optional[str] = None):
+        """Switch to the active version in the database; also the cutover notification handler"""
+        with self._refresh_lock:
+            try:
+                with self.db_pool.connection() as conn:
+                    with conn.cursor() as cursor:
+                        cursor.execute(ACTIVE_VERSION_SQL)
+                        row = cursor.fetchone()
+            except Exception as e:
+                self.stats["refresh_errors"] += 1
+                print(f"⚠️ Could not read the active embedding version: {e}")
+                return
+            if row is None or row[0] == self.version.id:
+                return
+
+            version_id, model, class_name, projection = row
+            version = EmbeddingVersion(
+                version_id, model, class_name, Projection.from_bytes(bytes(projection)) if projection is not None else None
+            )
+            embedder = self._embedders.get(version.model)
+            if embedder is None:
+                embedder = TransactionEmbedder(version.model)
+                try:
+                    embedder.warmup()
+                except Exception as e:
+                    # Keep serving from the old class, which cutover leaves in place
+                    self.stats["refresh_errors"] += 1
+                    print(f"⚠️ Embedding model {version.model} failed to load, staying on {self.version.id}: {e}")
+                    return
+                self._embedders[version.model] = embedder
+
+            self._current = (version, embedder)
+            self.stats["switches"] += 1
+        print(f"🔀 Retrieval switched to embedding version {version.id} ({version.class_name})")
+        if self.on_switch:
+            self.on_switch()
+
+    def get_stats(self) -> Dict[str, Any]:
+        version, embedder = self._current
+        return {
+            **self.stats,
+            "version": version.id,
+            "class_name": version.class_name,
+            "projected_dims": version.projection.dims if version.projection else None,
+            "model": embedder.get_status(),
+        }
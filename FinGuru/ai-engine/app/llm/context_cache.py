@@ -0,0 +1,91 @@
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class ContextCache:
+    """
+    Ollama `context` token arrays per conversation, in a byte-bounded LRU.
+
+    Passing the previous turn's context back to /api/generate lets Ollama
+    continue from the tokens it already evaluated, so a follow-up only sends
+    and prefills the new turn. An entry is tied to the model and system prompt
+    that produced it and to the last stored turn it covers; if the
+    conversation has moved on (a turn answered elsewhere), it is a miss.
+
+    max_tokens is the window a context and the next turn's prompt share (the
+    model's num_ctx less room for the reply). A lookup whose context plus the
+    new turn no longer fits is rejected and the entry dropped, since contexts
+    only grow; the conversation then restarts from a full prompt.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, max_tokens: int = 2048):
+        self.max_bytes = max_bytes
+        self.max_tokens = max_tokens
+
+        self._lock = threading.Lock()
+        # conversation_id -> ((model, prefix_key, last_seq), tokens); tokens stored as int32, 4 bytes each
+        self._entries: "OrderedDict[str, Tuple[Tuple[str, str, int], array]]" = OrderedDict()
+        self._bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "rejected_by_cap": 0, "evictions": 0, "resets": 0,
+                      "tokens_reused": 0}
+
+    def get(self, conversation_id: str, model: str, prefix_key: str, last_seq: int,
+            turn_tokens: int = 0) -> Optional[List[int]]:
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is None or entry[0][:2] != (model, prefix_key):
+                self.stats["misses"] += 1
+                return None
+            if entry[0][2] != last_seq:
+                # Turns were added since this context was built; it would silently drop them
+                self._remove(conversation_id)
+                self.stats["stale"] += 1
+                self.stats["misses"] += 1
+                return None
+            if len(entry[1]) + turn_tokens > self.max_tokens:
+                self._remove(conversation_id)
+                self.stats["rejected_by_cap"] += 1
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(conversation_id)
+            self.stats["hits"] += 1
+            self.stats["tokens_reused"] += len(entry[1])
+            return entry[1].tolist()
+
+    def put(self, conversation_id: str, model: str, prefix_key: str, last_seq: int, context: Optional[List[int]]):
+        with self._lock:
+            self._remove(conversation_id)
+            if not context:
+                return
+            if len(context) > self.max_tokens:
+                self.stats["resets"] += 1
+                return
+
+            tokens = array("i", context)
+            self._entries[conversation_id] = ((model, prefix_key, last_seq), tokens)
+            self._bytes += len(tokens) * tokens.itemsize
+            while self._bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.stats["evictions"] += 1
+
+    def invalidate(self, conversation_id: str):
+        with self._lock:
+            self._remove(conversation_id)
+
+    def _remove(self, conversation_id: str):
+        entry = self._entries.pop(conversation_id, None)
+        if entry is not None:
+            self._bytes -= len(entry[1]) * entry[1].itemsize
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self.stats,
+                "conversations": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "max_tokens": self.max_tokens,
+            }
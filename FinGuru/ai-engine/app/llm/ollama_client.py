@@ -0,0 +1,36 @@
+from typing import Any, Dict, Optional
+
+import httpx
+
+
+class OllamaError(Exception):
+    """Ollama answered with a non-200 status"""
+
+
+class OllamaClient:
+    """Thin client for Ollama's /api/generate with a reused, pooled HTTP connection"""
+
+    def __init__(self, base_url: str, timeout: float = 60.0):
+        self.base_url = base_url
+        self.timeout = timeout
+        # httpx.Client is thread-safe, so the graph threads share its connection pool
+        self.session = httpx.Client(timeout=timeout)
+
+    def generate(self, model: str, prompt: str, options: Optional[Dict[str, Any]] = None,
+                 timeout: Optional[float] = None, **fields) -> Dict[str, Any]:
+        """Run a non-streaming generation and return Ollama's JSON body"""
+        payload = {"model": model, "prompt": prompt, "stream": False, **fields}
+        if options:
+            payload["options"] = options
+
+        response = self.session.post(f"{self.base_url}/api/generate", json=payload, timeout=timeout or self.timeout)
+        if response.status_code != 200:
+            raise OllamaError(f"Ollama returned {response.status_code}: {response.text[:200]}")
+        return response.json()
+
+    def tags(self, timeout: float = 5.0) -> Dict[str, Any]:
+        """List local models; used as a cheap liveness probe"""
+        response = self.session.get(f"{self.base_url}/api/tags", timeout=timeout)
+        if response.status_code != 200:
+            raise OllamaError(f"Ollama returned {response.status_code}: {response.text[:200]}")
+        return response.json()
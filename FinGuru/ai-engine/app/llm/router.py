@@ -0,0 +1,83 @@
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Mapping, Optional
+
+# Agent tasks that call the LLM
+CLASSIFICATION = "classification"
+SQL = "sql"
+SYNTHESIS = "synthesis"
+NUDGE = "nudge"
+SUMMARY = "summary"
+TASKS = [CLASSIFICATION, SQL, SYNTHESIS, NUDGE, SUMMARY]
+
+# Generation options per task; LLM_<TASK>_OPTIONS (JSON) overrides individual keys
+DEFAULT_OPTIONS: Dict[str, Dict[str, Any]] = {
+    CLASSIFICATION: {"temperature": 0, "num_predict": 4},
+    SQL: {"temperature": 0, "num_predict": 256, "stop": [";", "\n\n\n"]},
+    # num_ctx is set explicitly: the conversation context cache is sized against it
+    SYNTHESIS: {"num_predict": 512, "num_ctx": 4096},
+    NUDGE: {"temperature": 0.7, "num_predict": 60},
+    SUMMARY: {"temperature": 0.2, "num_predict": 200},
+}
+
+
+@dataclass
+class ModelRoute:
+    """Model and generation options for one agent task"""
+    task: str
+    model: str
+    options: Dict[str, Any] = field(default_factory=dict)
+    # Set when the task runs on a model other than the default; used to retry bad output
+    fallback_model: Optional[str] = None
+    configured: bool = False
+
+
+class ModelRouter:
+    """
+    Maps each agent task to its own Ollama model and options.
+
+    Every task defaults to the main model; LLM_<TASK>_MODEL moves a task to
+    another model (e.g. a small code model for SQL). All requests carry the
+    same keep_alive and warm() loads every routed model up front, so Ollama
+    keeps them resident instead of swapping on each task switch (set
+    OLLAMA_MAX_LOADED_MODELS on the Ollama side to fit them).
+    """
+
+    def __init__(self, default_model: str, keep_alive: str = "30m", env: Optional[Mapping[str, str]] = None):
+        env = os.environ if env is None else env
+        self.default_model = default_model
+        self.keep_alive = keep_alive
+        self.routes: Dict[str, ModelRoute] = {}
+
+        for task in TASKS:
+            model = env.get(f"LLM_{task.upper()}_MODEL")
+            options = {**DEFAULT_OPTIONS[task], **json.loads(env.get(f"LLM_{task.upper()}_OPTIONS") or "{}")}
+            self.routes[task] = ModelRoute(
+                task=task,
+                model=model or default_model,
+                options=options,
+                fallback_model=default_model if model and model != default_model else None,
+                configured=bool(model),
+            )
+
+    def route(self, task: str) -> ModelRoute:
+        return self.routes[task]
+
+    def models(self) -> List[str]:
+        return list(dict.fromkeys(route.model for route in self.routes.values()))
+
+    def warm(self, client):
+        """Load every routed model into Ollama's memory with the router's keep_alive"""
+        for model in self.models():
+            try:
+                client.generate(model, "", timeout=300, keep_alive=self.keep_alive)
+                print(f"✅ LLM model {model} loaded")
+            except Exception as e:
+                print(f"⚠️ LLM model {model} failed to load: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "keep_alive": self.keep_alive,
+            "routes": {task: {"model": r.model, "fallback_model": r.fallback_model} for task, r in self.routes.items()},
+        }
@@ -0,0 +1,151 @@
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from enum import IntEnum
+from typing import Any, Dict, Iterator, List, Optional
+
+
+class Priority(IntEnum):
+    """Lower values are served first"""
+    INTERACTIVE = 0
+    SQL_GENERATION = 1
+    BACKGROUND = 2
+
+
+class LLMUnavailableError(Exception):
+    """The LLM cannot take this request; carries the HTTP status to return"""
+    status_code = 503
+
+
+class LLMOverloadedError(LLMUnavailableError):
+    """The wait queue is full"""
+    status_code = 429
+
+
+class LLMDeadlineError(LLMUnavailableError):
+    """The request would not get a slot before its deadline"""
+    status_code = 503
+
+
+class LLMCircuitOpenError(LLMUnavailableError):
+    """Ollama's circuit breaker is open; the call was not attempted"""
+    status_code = 503
+
+
+class _Waiter:
+    __slots__ = ("priority", "enqueued_at")
+
+    def __init__(self, priority: Priority):
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+
+
+class LLMScheduler:
+    """
+    Admission control in front of Ollama.
+
+    At most max_concurrency generations run at once. Waiting requests are
+    served by priority class, then arrival order. A request whose estimated
+    queue wait already exceeds its deadline is rejected up front instead of
+    timing out inside Ollama, and one still queued at its deadline is
+    rejected then.
+    """
+
+    def __init__(self, max_concurrency: int = 2, max_queue: int = 64, initial_service_seconds: float = 5.0):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+
+        self._cond = threading.Condition()
+        self._active = 0
+        self._heap: List[Any] = []
+        self._counter = itertools.count()
+        self._service_ewma = initial_service_seconds
+        self._wait_ewma = 0.0
+        self.stats = {"admitted": 0, "rejected_overloaded": 0, "rejected_deadline": 0, "max_wait_seconds": 0.0}
+
+    @contextmanager
+    def slot(self, priority: Priority, deadline: Optional[float] = None) -> Iterator[None]:
+        """Hold one generation slot; deadline is an absolute time.monotonic() value"""
+        self._acquire(priority, deadline)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - started)
+
+    def estimated_wait(self, priority: Priority) -> float:
+        """Expected queueing time for a new request of this priority"""
+        with self._cond:
+            return self._estimate_locked(priority)
+
+    def _estimate_locked(self, priority: Priority) -> float:
+        ahead = sum(1 for entry in self._heap if entry[0] <= priority)
+        if self._active < self.max_concurrency and ahead == 0:
+            return 0.0
+        rounds = ahead // self.max_concurrency + 1
+        return rounds * self._service_ewma
+
+    def _acquire(self, priority: Priority, deadline: Optional[float]):
+        with self._cond:
+            if self._active < self.max_concurrency and not self._heap:
+                self._admit(0.0)
+                return
+
+            if len(self._heap) >= self.max_queue:
+                self.stats["rejected_overloaded"] += 1
+                raise LLMOverloadedError("LLM queue is full, please retry shortly")
+
+            # Budget for queueing is the time left minus the expected generation time
+            if deadline is not None:
+                budget = deadline - time.monotonic() - self._service_ewma
+                if self._estimate_locked(priority) > budget:
+                    self.stats["rejected_deadline"] += 1
+                    raise LLMDeadlineError("LLM is busy and cannot answer within the request deadline")
+
+            waiter = _Waiter(priority)
+            entry = (int(priority), next(self._counter), waiter)
+            heapq.heappush(self._heap, entry)
+
+            while not (self._heap[0] is entry and self._active < self.max_concurrency):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._heap.remove(entry)
+                    heapq.heapify(self._heap)
+                    self._cond.notify_all()
+                    self.stats["rejected_deadline"] += 1
+                    raise LLMDeadlineError("Timed out waiting for the LLM")
+                self._cond.wait(timeout=remaining)
+
+            heapq.heappop(self._heap)
+            self._admit(time.monotonic() - waiter.enqueued_at)
+            self._cond.notify_all()
+
+    def _admit(self, waited: float):
+        self._active += 1
+        self.stats["admitted"] += 1
+        self._wait_ewma = 0.8 * self._wait_ewma + 0.2 * waited
+        self.stats["max_wait_seconds"] = max(self.stats["max_wait_seconds"], round(waited, 3))
+
+    def _release(self, service_seconds: float):
+        with self._cond:
+            self._active -= 1
+            self._service_ewma = 0.8 * self._service_ewma + 0.2 * service_seconds
+            self._cond.notify_all()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            depth = {p.name.lower(): 0 for p in Priority}
+            for entry in self._heap:
+                depth[Priority(entry[0]).name.lower()] += 1
+            stats = dict(self.stats)
+            stats.update({
+                "max_concurrency": self.max_concurrency,
+                "active": self._active,
+                "queue_depth": len(self._heap),
+                "queue_depth_by_priority": depth,
+                "avg_wait_seconds": round(self._wait_ewma, 3),
+                "avg_service_seconds": round(self._service_ewma, 3),
+            })
+        return stats
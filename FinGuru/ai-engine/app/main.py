@@ -1,10 +1,18 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
 import os
+import json
+import time
+import asyncio
 from app.agent import FinGuruAgent
-from app.models import ChatRequest, ChatResponse, BudgetAnalysisRequest, BudgetAnalysisResponse
+from app.conversation_store import ConversationNotFoundError
+from app.profiler import SamplingProfiler
+from app.telemetry import EventLoopMonitor, metrics, start_trace
+from app.llm.scheduler import LLMUnavailableError
+from app.models import ChatRequest, ChatResponse, BudgetAnalysisRequest, BudgetAnalysisResponse, BatchBudgetAnalysisRequest, ScenarioComparisonRequest
 
 app = FastAPI(title="FinGuru AI Engine", version="2.0.0")
 
@@ -24,26 +32,108 @@ agent = FinGuruAgent(
     llm_model=os.getenv("LLM_MODEL", "llama3.1:8b")
 )
 
+loop_monitor = EventLoopMonitor()
+
+# Opt-in: PROFILE_SLOWEST_N > 0 keeps collapsed-stack profiles of the slowest requests
+profiler = None
+if int(os.getenv("PROFILE_SLOWEST_N", "0")) > 0:
+    profiler = SamplingProfiler(
+        slowest_n=int(os.getenv("PROFILE_SLOWEST_N")),
+        interval_ms=float(os.getenv("PROFILE_INTERVAL_MS", "10")),
+        output_dir=os.getenv("PROFILE_DIR", "/tmp/finguru-profiles"),
+    )
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Time every request and give graph nodes and external calls a trace to record into"""
+    trace = start_trace(request.url.path)
+    if profiler:
+        profiler.begin(trace)
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        trace.finished = time.monotonic()
+        if profiler:
+            profiler.finish(trace)
+        # Label by route template so ids in the path and unmatched probes can't grow the series count
+        route = request.scope.get("route")
+        metrics.observe(
+            "http_request_duration_seconds", trace.duration, help_text="HTTP request latency",
+            method=request.method, path=route.path if route is not None else "unmatched", status=status,
+        )
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize agent on startup"""
     await agent.initialize()
+    loop_monitor.start()
+    if profiler:
+        profiler.start()
+    if os.getenv("NUDGE_SCHEDULER_ENABLED", "true").lower() == "true":
+        agent.nudge_scheduler.start()
     print("✅ AI Engine initialized successfully")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background work and release pooled database connections"""
+    await agent.nudge_scheduler.stop()
+    await loop_monitor.stop()
+    agent.db_pool.close()
+    if agent.embeddings_listener:
+        agent.embeddings_listener.stop()
+    agent.embedding_version_listener.stop()
+
 @app.get("/")
 async def root():
     return {"service": "FinGuru AI Engine", "status": "healthy"}
 
 @app.get("/health")
 async def health_check():
+    dependencies = {
+        "ollama": agent.ollama_breaker.get_stats(),
+        "weaviate": agent.weaviate_breaker.get_stats(),
+    }
     return {
-        "status": "healthy",
+        "status": "healthy" if all(d["state"] == "closed" for d in dependencies.values()) else "degraded",
         "service": "ai-engine",
         "llm_model": os.getenv("LLM_MODEL"),
-        "weaviate_connected": agent.weaviate_ready,
-        "ollama_connected": agent.ollama_ready
+        "dependencies": dependencies,
+        "database_pool": agent.db_pool.stats(),
+        "embedding_model": agent.embedder.get_status(),
+        "embedding_batcher": agent.embedding_service.get_stats(),
+        "embedding_version": agent.embedding_version.get_stats(),
+        "intent_router": agent.intent_router.get_stats(),
+        "local_vector_index": agent.local_index.get_stats() if agent.local_index else None,
+        "nudge_scheduler": agent.nudge_scheduler.get_stats(),
+        "conversations": agent.conversations.get_stats(),
+        "llm_single_flight": agent.llm_single_flight.get_stats(),
+        "llm_context_cache": agent.llm_contexts.get_stats(),
+        "llm_routes": agent.model_router.get_stats(),
+        "llm_scheduler": agent.llm_scheduler.get_stats(),
+        "profiler": profiler.get_stats() if profiler else None,
+        "event_loop_max_lag_seconds": round(loop_monitor.max_lag, 4)
     }
 
+@app.get("/ready")
+async def readiness_check(endpoint: Optional[str] = None):
+    """Component readiness; with ?endpoint=chat|analyze_budget|scenario_plan|nudges, 503 until that group can serve"""
+    readiness = await asyncio.to_thread(agent.get_readiness)
+    if endpoint is not None:
+        if endpoint not in readiness["endpoints"]:
+            raise HTTPException(status_code=400, detail=f"Unknown endpoint group: {endpoint}")
+        ready = readiness["endpoints"][endpoint]
+    else:
+        ready = readiness["components"]["database"]["status"] == "ready"
+    return JSONResponse({"ready": ready, **readiness}, status_code=200 if ready else 503)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Latency histograms and counters in Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
     """Main conversational endpoint with RAG"""
@@ -51,9 +141,16 @@ async def chat(request: ChatRequest):
         response = await agent.process_query(
             user_id=request.user_id,
             query=request.message,
-            conversation_history=request.conversation_history or []
+            conversation_history=request.conversation_history or [],
+            include_timings=bool(request.include_timings),
+            conversation_id=request.conversation_id,
+            start_conversation=bool(request.start_conversation)
         )
         return response
+    except ConversationNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except LLMUnavailableError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": "5"})
     except Exception as e:
         print(f"❌ Chat error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -68,6 +165,29 @@ async def analyze_budget(request: BudgetAnalysisRequest):
         print(f"❌ Budget analysis error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/analyze/budget/batch")
+async def analyze_budget_batch(request: BatchBudgetAnalysisRequest):
+    """Budget status for many users, streamed back as NDJSON one user per line"""
+    if request.user_ids is None and (request.shard_index is None or not request.shard_count):
+        raise HTTPException(status_code=400, detail="Provide user_ids or shard_index and shard_count")
+    if request.shard_count and not 0 <= (request.shard_index or 0) < request.shard_count:
+        raise HTTPException(status_code=400, detail="shard_index must be in [0, shard_count)")
+    if request.chunk_size < 1:
+        raise HTTPException(status_code=400, detail="chunk_size must be positive")
+    
+    results = agent.analyze_budget_batch(
+        user_ids=request.user_ids,
+        shard_index=request.shard_index,
+        shard_count=request.shard_count,
+        chunk_size=request.chunk_size
+    )
+    
+    def stream():
+        for user_id, analysis in results:
+            yield json.dumps({"user_id": user_id, **analysis}) + "\n"
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
 @app.post("/scenario/plan")
 async def plan_scenario(user_id: str, scenario: str):
     """What-if scenario planning"""
@@ -78,11 +198,22 @@ async def plan_scenario(user_id: str, scenario: str):
         print(f"❌ Scenario planning error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/scenario/compare")
+async def compare_scenarios(request: ScenarioComparisonRequest):
+    """Several what-if scenarios evaluated against the same simulated cash-flow paths"""
+    if not request.scenarios:
+        raise HTTPException(status_code=400, detail="Provide at least one scenario")
+    try:
+        return await agent.compare_scenarios(request.user_id, request.scenarios, request.emergency_fund_months)
+    except Exception as e:
+        print(f"❌ Scenario comparison error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/generate/nudges")
-async def generate_nudges(user_id: str):
-    """Generate proactive financial nudges"""
+async def generate_nudges(user_id: str, refresh: bool = False):
+    """Serve precomputed financial nudges; refresh=true recomputes them first"""
     try:
-        nudges = await agent.generate_nudges(user_id)
+        nudges = await agent.generate_nudges(user_id, refresh=refresh)
         return {"nudges": nudges}
     except Exception as e:
         print(f"❌ Nudge generation error: {str(e)}")
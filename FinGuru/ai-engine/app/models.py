@@ -9,6 +9,9 @@ class ChatRequest(BaseModel):
     user_id: str
     message: str
     conversation_history: Optional[List[ChatMessage]] = []
+    conversation_id: Optional[str] = None  # server-side memory; history is only used to seed a new conversation
+    start_conversation: Optional[bool] = False  # start server-side memory without seeding history
+    include_timings: Optional[bool] = False
 
 class ChatResponse(BaseModel):
     answer: str
@@ -16,11 +19,23 @@ class ChatResponse(BaseModel):
     sources: Optional[List[str]] = []
     suggested_actions: Optional[List[str]] = []
     debug_info: Optional[Dict[str, Any]] = {}
+    conversation_id: Optional[str] = None
 
 class BudgetAnalysisRequest(BaseModel):
     user_id: str
     month: Optional[str] = None
 
+class BatchBudgetAnalysisRequest(BaseModel):
+    user_ids: Optional[List[str]] = None
+    shard_index: Optional[int] = None
+    shard_count: Optional[int] = None
+    chunk_size: int = 500
+
+class ScenarioComparisonRequest(BaseModel):
+    user_id: str
+    scenarios: List[str]
+    emergency_fund_months: Optional[float] = None
+
 class BudgetInsight(BaseModel):
     category: str
     spent: float
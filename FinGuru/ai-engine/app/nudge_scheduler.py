@@ -0,0 +1,318 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from psycopg2.extras import RealDictCursor, execute_values
+
+from app.db_pool import DatabasePool
+from app.telemetry import timed
+from app.tools.budget_analyzer import BudgetAnalyzer
+
+# Nudge types owned by the scheduler; other types in the table are left alone
+GENERATED_NUDGE_TYPES = ["budget_warning", "savings_tip"]
+
+# Phrased messages are reused until the underlying template text (and so its numbers) changes
+PHRASE_CACHE_SIZE = 10000
+
+# Session advisory lock held for a whole run, so only one replica refreshes nudges at a time
+RUN_LOCK_KEY = 0x4E55444745  # "NUDGE"
+
+# Changes are looked up from slightly before the previous run started: a write whose
+# updated_at (its transaction's start) precedes the watermark can commit after it was read
+WATERMARK_OVERLAP = timedelta(seconds=60)
+
+CHANGED_USERS_SQL = """
+    SELECT user_id FROM monthly_spending_rollups WHERE updated_at > %s
+    UNION
+    SELECT user_id FROM budgets WHERE updated_at > %s
+"""
+
+SERVED_NUDGES_SQL = """
+    SELECT id, title, message, nudge_type, priority, created_at
+    FROM nudges
+    WHERE user_id = %s AND read = FALSE AND dismissed = FALSE
+    ORDER BY created_at DESC
+    LIMIT %s
+"""
+
+
+def build_nudges(analysis: Dict[str, Any]) -> List[Dict[str, str]]:
+    """Turn a budget analysis into nudge dicts"""
+    nudges = []
+
+    # Generate nudges based on insights
+    if analysis.get("overspent_categories"):
+        for category in analysis["overspent_categories"]:
+            nudges.append({
+                "title": f"Budget Alert: {category}",
+                "message": f"You've exceeded your {category} budget by ${analysis['overspent_amount'][category]:.2f}",
+                "type": "budget_warning",
+                "priority": "high"
+            })
+
+    # Check for savings opportunities
+    if analysis.get("savings_opportunity"):
+        nudges.append({
+            "title": "Savings Opportunity",
+            "message": f"You can save ${analysis['savings_opportunity']:.2f} by reducing discretionary spending.",
+            "type": "savings_tip",
+            "priority": "medium"
+        })
+
+    return nudges
+
+
+class NudgeScheduler:
+    """
+    Precomputes nudges in the background so /generate/nudges is a single indexed read.
+
+    Each run first processes users whose rollups or budgets changed since the
+    previous run, then, when a full refresh is due, every other active user.
+    Users are analyzed in chunks across a thread pool and the results replace
+    the unread generated nudges in the nudges table. The change watermark is
+    the database's clock, and a Postgres advisory lock keeps replicas from
+    running at the same time.
+    """
+
+    def __init__(
+        self,
+        db_pool: DatabasePool,
+        budget_analyzer: BudgetAnalyzer,
+        interval_seconds: float = 300.0,
+        full_refresh_seconds: float = 86400.0,
+        chunk_size: int = 500,
+        workers: int = 4,
+        phrase: Optional[Callable[[Dict[str, str]], str]] = None,
+    ):
+        self.db_pool = db_pool
+        self.budget_analyzer = budget_analyzer
+        # Optional LLM rewrite of the template message; failures keep the template
+        self.phrase = phrase
+        self._phrased: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+        self._phrase_lock = threading.Lock()
+        self.interval_seconds = interval_seconds
+        self.full_refresh_seconds = full_refresh_seconds
+        self.chunk_size = chunk_size
+        self.workers = workers
+
+        self._task: Optional[asyncio.Task] = None
+        self._run_lock = threading.Lock()
+        self._last_run_started: Optional[datetime] = None
+        self._last_full_refresh: float = float("-inf")
+        # Chunk workers update the counters too
+        self._stats_lock = threading.Lock()
+        self.stats: Dict[str, Any] = {
+            "runs": 0,
+            "last_run_at": None,
+            "last_run_seconds": None,
+            "last_changed_users": 0,
+            "last_users_processed": 0,
+            "last_nudges_written": 0,
+            "errors": 0,
+            "phrase_errors": 0,
+            "skipped_locked": 0,
+        }
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.run_once)
+            except Exception as e:
+                self._count("errors")
+                print(f"⚠️ Nudge scheduler run failed: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    def run_once(self):
+        """One scheduling pass: changed users first, then everyone else if a full refresh is due"""
+        if not self._run_lock.acquire(blocking=False):
+            return
+        try:
+            with self.db_pool.connection() as lock_conn:
+                with lock_conn.cursor() as cursor:
+                    cursor.execute("SELECT pg_try_advisory_lock(%s), NOW()", (RUN_LOCK_KEY,))
+                    locked, started_at = cursor.fetchone()
+                # The lock is per session and survives the commit; don't sit idle in a transaction
+                lock_conn.commit()
+                if not locked:
+                    self._count("skipped_locked")
+                    return
+                try:
+                    self._run(started_at)
+                finally:
+                    with lock_conn.cursor() as cursor:
+                        cursor.execute("SELECT pg_advisory_unlock(%s)", (RUN_LOCK_KEY,))
+        finally:
+            self._run_lock.release()
+
+    def _run(self, started_at: datetime):
+        started = time.monotonic()
+        full_refresh = started - self._last_full_refresh >= self.full_refresh_seconds
+
+        changed: List[str] = []
+        if self._last_run_started is not None:
+            changed = self._changed_users(self._last_run_started - WATERMARK_OVERLAP)
+
+        user_ids: Iterable[str] = changed
+        if full_refresh:
+            changed_set = set(changed)
+            rest = (u for u in self.budget_analyzer.iter_shard_user_ids(0, 1, self.chunk_size) if u not in changed_set)
+            user_ids = _chain(changed, rest)
+
+        processed, written = self._process(user_ids)
+
+        self._last_run_started = started_at
+        if full_refresh:
+            self._last_full_refresh = started
+        with self._stats_lock:
+            self.stats.update({
+                "runs": self.stats["runs"] + 1,
+                "last_run_at": started_at.isoformat(),
+                "last_run_seconds": round(time.monotonic() - started, 3),
+                "last_changed_users": len(changed),
+                "last_users_processed": processed,
+                "last_nudges_written": written,
+            })
+        print(f"✅ Nudges refreshed for {processed} users ({len(changed)} changed, {written} nudges)")
+
+    def refresh_users(self, user_ids: List[str]) -> int:
+        """
+        Recompute nudges for specific users right away. This runs inside a
+        request, so it never waits on the LLM: only already-phrased messages
+        are reused, and anything else keeps its template text.
+        """
+        _, written = self._process(user_ids, cached_phrasing_only=True)
+        return written
+
+    def get_nudges(self, user_id: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """Serve precomputed, unread nudges for a user"""
+        with timed("postgres", op="served_nudges"), self.db_pool.connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                self.db_pool.execute_prepared(cursor, "served_nudges", SERVED_NUDGES_SQL, (user_id, limit))
+                rows = cursor.fetchall()
+        return [
+            {
+                "id": row["id"],
+                "title": row["title"],
+                "message": row["message"],
+                "type": row["nudge_type"],
+                "priority": row["priority"],
+                "created_at": row["created_at"].isoformat() if row["created_at"] else None,
+            }
+            for row in rows
+        ]
+
+    def _changed_users(self, since: datetime) -> List[str]:
+        with self.db_pool.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(CHANGED_USERS_SQL, (since, since))
+                return [row[0] for row in cursor.fetchall()]
+
+    def _process(self, user_ids: Iterable[str], cached_phrasing_only: bool = False):
+        processed = 0
+        written = 0
+        # A bounded window of chunks in flight, so a full refresh streams users instead of
+        # materializing every chunk up front as pool.map would
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="nudges") as pool:
+            for chunk in _chunks(user_ids, self.chunk_size):
+                in_flight.append(pool.submit(self._process_chunk, chunk, cached_phrasing_only))
+                if len(in_flight) >= self.workers * 2:
+                    users, nudges = in_flight.popleft().result()
+                    processed += users
+                    written += nudges
+            while in_flight:
+                users, nudges = in_flight.popleft().result()
+                processed += users
+                written += nudges
+        return processed, written
+
+    def _process_chunk(self, chunk: List[str], cached_phrasing_only: bool = False):
+        rows = []
+        analyzed = []
+        for user_id, analysis in self.budget_analyzer.analyze_batch(chunk, chunk_size=len(chunk)):
+            if "error" in analysis:
+                self._count("errors")
+                continue
+            analyzed.append(user_id)
+            for nudge in build_nudges(analysis):
+                message = self._phrase(nudge, cached_phrasing_only) if self.phrase else nudge["message"]
+                rows.append((user_id, nudge["title"], message, nudge["type"], nudge["priority"]))
+
+        with self.db_pool.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    DELETE FROM nudges
+                    WHERE user_id = ANY(%s) AND read = FALSE AND dismissed = FALSE
+                    AND nudge_type = ANY(%s)
+                """, (analyzed, GENERATED_NUDGE_TYPES))
+                if rows:
+                    # Don't bring back a nudge the user already read or dismissed this month
+                    execute_values(cursor, """
+                        INSERT INTO nudges (id, user_id, title, message, nudge_type, priority)
+                        SELECT gen_random_uuid()::text, v.user_id, v.title, v.message, v.nudge_type, v.priority
+                        FROM (VALUES %s) AS v (user_id, title, message, nudge_type, priority)
+                        WHERE NOT EXISTS (
+                            SELECT 1 FROM nudges n
+                            WHERE n.user_id = v.user_id AND n.title = v.title
+                            AND (n.read OR n.dismissed) AND n.created_at >= DATE_TRUNC('month', NOW())
+                        )
+                    """, rows, page_size=1000)
+        return len(analyzed), len(rows)
+
+    def _phrase(self, nudge: Dict[str, str], cached_only: bool = False) -> str:
+        key = (nudge["title"], nudge["message"])
+        with self._phrase_lock:
+            if key in self._phrased:
+                self._phrased.move_to_end(key)
+                return self._phrased[key]
+        if cached_only:
+            return nudge["message"]
+
+        try:
+            message = self.phrase(nudge).strip() or nudge["message"]
+        except Exception as e:
+            self._count("phrase_errors")
+            print(f"⚠️ Nudge phrasing failed: {e}")
+            return nudge["message"]
+
+        with self._phrase_lock:
+            self._phrased[key] = message
+            if len(self._phrased) > PHRASE_CACHE_SIZE:
+                self._phrased.popitem(last=False)
+        return message
+
+    def _count(self, stat: str):
+        with self._stats_lock:
+            self.stats[stat] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return dict(self.stats)
+
+
+def _chunks(items: Iterable[str], size: int) -> Iterator[List[str]]:
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _chain(first: List[str], rest: Iterable[str]) -> Iterator[str]:
+    yield from first
+    yield from rest
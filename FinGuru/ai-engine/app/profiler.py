@@ -0,0 +1,110 @@
+import heapq
+import os
+import sys
+import threading
+from typing import Any, Dict, List, Set, Tuple
+
+from app.telemetry import RequestTrace
+
+
+class SamplingProfiler:
+    """
+    Opt-in wall-clock sampling profiler for the slowest requests.
+
+    Every interval the sampler captures the stacks of the threads currently
+    running a timed stage for each in-flight request and counts them per
+    request. When a request finishes and is among the slowest_n seen so far,
+    its samples are written to output_dir in collapsed-stack format
+    (one "frame;frame;frame count" line per stack), ready for flamegraph.pl
+    or speedscope. Files of requests pushed out of the top N are removed.
+    """
+
+    def __init__(self, slowest_n: int = 10, interval_ms: float = 10.0, output_dir: str = "/tmp/finguru-profiles"):
+        self.slowest_n = slowest_n
+        self.interval = interval_ms / 1000.0
+        self.output_dir = output_dir
+
+        self._lock = threading.Lock()
+        self._active: Set[RequestTrace] = set()
+        self._slowest: List[Tuple[float, int, str]] = []
+        self._thread = None
+        self._stop = threading.Event()
+        self.stats = {"samples": 0, "profiles_written": 0}
+
+    def start(self):
+        if self._thread is None:
+            os.makedirs(self.output_dir, exist_ok=True)
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def begin(self, trace: RequestTrace):
+        with self._lock:
+            self._active.add(trace)
+
+    def finish(self, trace: RequestTrace):
+        """Stop sampling a request and keep its profile if it is among the slowest"""
+        with self._lock:
+            self._active.discard(trace)
+            if not trace.samples:
+                return
+            entry = (trace.duration, trace.id, self._path(trace))
+            if len(self._slowest) < self.slowest_n:
+                heapq.heappush(self._slowest, entry)
+                evicted = None
+            elif entry[0] > self._slowest[0][0]:
+                evicted = heapq.heapreplace(self._slowest, entry)
+            else:
+                return
+
+        self._write(entry[2], trace)
+        if evicted:
+            try:
+                os.remove(evicted[2])
+            except OSError:
+                pass
+
+    def _path(self, trace: RequestTrace) -> str:
+        name = trace.name.strip("/").replace("/", "_") or "root"
+        return os.path.join(self.output_dir, f"{name}-{trace.id}-{int(trace.duration * 1000)}ms.folded")
+
+    def _write(self, path: str, trace: RequestTrace):
+        with open(path, "w") as f:
+            for stack, count in trace.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        self.stats["profiles_written"] += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                active = list(self._active)
+            if not active:
+                continue
+
+            frames = sys._current_frames()
+            for trace in active:
+                for ident in trace.active_threads():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        trace.samples[_collapse(frame)] += 1
+                        self.stats["samples"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            slowest = sorted(self._slowest, reverse=True)
+        return {
+            **self.stats,
+            "output_dir": self.output_dir,
+            "slowest": [{"ms": round(d * 1000, 1), "profile": path} for d, _, path in slowest],
+        }
+
+
+def _collapse(frame) -> str:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
@@ -0,0 +1,163 @@
+import json
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Llama-family tokenizers average roughly four characters per token on English and JSON
+CHARS_PER_TOKEN = 4
+
+# Columns that rarely help phrase an answer but cost many tokens
+LOW_VALUE_FIELDS = {"id", "transaction_id", "account_id", "plaid_transaction_id", "description", "created_at", "updated_at", "embedding_synced"}
+
+ROW_LIST_KEYS = ("rows", "top_rows", "sample_rows")
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate used for budgeting; no tokenizer round-trip"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+class PromptSection:
+    """
+    A prompt section with renderings ordered from richest to cheapest.
+
+    empty_text stands in when there is no data at all; omitted_text is the
+    last resort when there is data but none of it fits, so the model is
+    never told a truncated result was empty.
+    """
+
+    def __init__(self, name: str, title: str, renderings: Sequence[str], empty_text: str = "",
+                 omitted_text: str = ""):
+        self.name = name
+        self.title = title
+        renderings = [r for r in renderings if r]
+        self.renderings = list(dict.fromkeys(renderings + [omitted_text] if renderings else [empty_text]))
+        self.level = 0
+
+    @property
+    def text(self) -> str:
+        body = self.renderings[self.level]
+        if not body:
+            return ""
+        return f"{self.title}\n{body}\n\n" if self.title else f"{body}\n\n"
+
+    def can_shrink(self) -> bool:
+        return self.level < len(self.renderings) - 1
+
+    def shrink(self):
+        self.level += 1
+
+
+class PromptBuilder:
+    """
+    Assembles prompts within a token budget.
+
+    Each section offers progressively smaller renderings (fewer rows, fewer
+    fields, aggregates only, omitted). While the estimate is over budget the
+    builder shrinks sections in the given drop order, so the least valuable
+    data goes first and the question itself is never cut.
+    """
+
+    def __init__(self, max_prompt_tokens: int = 2048):
+        self.max_prompt_tokens = max_prompt_tokens
+
+    def assemble(self, header: str, sections: List[PromptSection], footer: str,
+                 drop_order: Sequence[str]) -> Tuple[str, Dict[str, Any]]:
+        """Join header, sections and footer, shrinking sections until the prompt fits"""
+        by_name = {section.name: section for section in sections}
+        fixed_tokens = estimate_tokens(header) + estimate_tokens(footer)
+
+        def total() -> int:
+            return fixed_tokens + sum(estimate_tokens(s.text) for s in sections)
+
+        for name in drop_order:
+            section = by_name.get(name)
+            while section and total() > self.max_prompt_tokens and section.can_shrink():
+                section.shrink()
+
+        # Give back detail to earlier-dropped sections if later shrinking made room
+        for name in reversed(drop_order):
+            section = by_name.get(name)
+            while section and section.level > 0:
+                section.level -= 1
+                if total() > self.max_prompt_tokens:
+                    section.level += 1
+                    break
+
+        prompt = header + "".join(section.text for section in sections) + footer
+        stats = {
+            "prompt_tokens": estimate_tokens(prompt),
+            "prompt_token_budget": self.max_prompt_tokens,
+            "prompt_sections": {s.name: {"tokens": estimate_tokens(s.text), "level": s.level} for s in sections},
+        }
+        return prompt, stats
+
+    # Renderings for the synthesis prompt's data sections
+
+    def context_renderings(self, context: List[Dict]) -> List[str]:
+        lines = [
+            f"- {t.get('merchant_name', 'Unknown')}: ${t.get('amount', 0)} on {t.get('transaction_date', 'N/A')} ({t.get('category', 'Uncategorized')})"
+            for t in context[:5]
+        ]
+        return ["\n".join(lines[:n]) for n in (5, 3, 1)]
+
+    def sql_result_renderings(self, sql_result: Optional[str]) -> List[str]:
+        if not sql_result:
+            return []
+        try:
+            result = json.loads(sql_result)
+        except ValueError:
+            return [sql_result[:2000], sql_result[:500]]
+        if not isinstance(result, dict):
+            result = {"rows": result}
+
+        renderings = [_dumps(result)]
+
+        trimmed = _map_rows(result, lambda rows: [{k: v for k, v in row.items() if k not in LOW_VALUE_FIELDS} for row in rows])
+        renderings.append(_dumps(trimmed))
+
+        keep = max((len(trimmed.get(key) or []) for key in ROW_LIST_KEYS), default=0)
+        while keep > 3:
+            keep //= 2
+            renderings.append(_dumps(_map_rows(trimmed, lambda rows: rows[:max(keep, 3)], note=True)))
+
+        summary = {k: v for k, v in trimmed.items() if k not in ROW_LIST_KEYS}
+        if summary != trimmed:
+            summary["rows_omitted_for_length"] = sum(len(trimmed.get(key) or []) for key in ROW_LIST_KEYS)
+            renderings.append(_dumps(summary))
+        return renderings
+
+    def sql_result_omitted_text(self, sql_result: Optional[str]) -> str:
+        """Marker for a query result dropped entirely to fit the budget"""
+        try:
+            result = json.loads(sql_result or "")
+        except ValueError:
+            return "Query result omitted for length"
+        if isinstance(result, list):
+            count = len(result)
+        elif isinstance(result, dict):
+            count = result.get("row_count", sum(len(result.get(key) or []) for key in ROW_LIST_KEYS))
+        else:
+            count = 0
+        return f"{count} rows omitted for length" if count else "Query result omitted for length"
+
+    def analysis_renderings(self, analysis: Optional[Dict]) -> List[str]:
+        if not analysis:
+            return []
+        compact = {k: v for k, v in analysis.items() if v not in (None, [], {}, "")}
+        essentials = {k: compact[k] for k in ("status", "total_spent", "total_limit", "overspent_categories") if k in compact}
+        return [_dumps(compact), _dumps(essentials)]
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, separators=(",", ":"), default=str)
+
+
+def _map_rows(result: Dict[str, Any], fn, note: bool = False) -> Dict[str, Any]:
+    mapped = dict(result)
+    for key in ROW_LIST_KEYS:
+        rows = mapped.get(key)
+        if isinstance(rows, list) and rows and isinstance(rows[0], dict):
+            shrunk = fn(rows)
+            if note and len(shrunk) < len(rows):
+                mapped["rows_shown"] = f"{len(shrunk)} of {len(rows)}"
+            mapped[key] = shrunk
+    return mapped
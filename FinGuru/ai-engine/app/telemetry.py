@@ -0,0 +1,250 @@
+import asyncio
+import bisect
+import itertools
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Seconds; covers sub-millisecond cache hits up to full LLM generations
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram in the Prometheus style"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-th observation"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        for bound, cumulative in zip(self.buckets, itertools.accumulate(self.counts)):
+            if cumulative >= rank:
+                return bound
+        return float("inf")
+
+
+class MetricsRegistry:
+    """Thread-safe histograms and counters rendered in Prometheus text format"""
+
+    def __init__(self, namespace: str = "finguru"):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._help: Dict[str, str] = {}
+
+    def observe(self, name: str, value: float, help_text: str = "", **labels: str):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+            if help_text:
+                self._help.setdefault(name, help_text)
+
+    def inc(self, name: str, amount: float = 1, help_text: str = "", **labels: str):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+            if help_text:
+                self._help.setdefault(name, help_text)
+
+    def summary(self, name: str) -> Dict[str, Dict[str, Any]]:
+        """p50/p95/p99 bucket bounds per label set, for dashboards and benchmarks"""
+        with self._lock:
+            series = dict(self._histograms.get(name, {}))
+            return {
+                ",".join(f"{k}={v}" for k, v in key) or "all": {
+                    "count": h.count,
+                    "avg": round(h.total / h.count, 4) if h.count else None,
+                    "p50": h.quantile(0.50),
+                    "p95": h.quantile(0.95),
+                    "p99": h.quantile(0.99),
+                }
+                for key, h in series.items()
+            }
+
+    def render(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                full = f"{self.namespace}_{name}"
+                lines.append(f"# HELP {full} {self._help.get(name, name)}")
+                lines.append(f"# TYPE {full} counter")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{full}{_format_labels(key)} {value:g}")
+
+            for name, series in sorted(self._histograms.items()):
+                full = f"{self.namespace}_{name}"
+                lines.append(f"# HELP {full} {self._help.get(name, name)}")
+                lines.append(f"# TYPE {full} histogram")
+                for key, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                        lines.append(f"{full}_bucket{_format_labels(key + (('le', le),))} {cumulative}")
+                    lines.append(f"{full}_sum{_format_labels(key)} {histogram.total:.6f}")
+                    lines.append(f"{full}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def _format_labels(key: LabelKey) -> str:
+    if not key:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"') for _, v in key)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(key, escaped)) + "}"
+
+
+metrics = MetricsRegistry()
+
+
+class RequestTrace:
+    """Timed stages of one HTTP request, plus profiler samples when profiling is on"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, name: str):
+        self.id = next(self._ids)
+        self.name = name
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+        self.stages: List[Dict[str, Any]] = []
+        self.samples: Counter = Counter()
+        self._threads: Counter = Counter()
+        self._lock = threading.Lock()
+
+    @property
+    def duration(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+    def enter_thread(self):
+        with self._lock:
+            self._threads[threading.get_ident()] += 1
+
+    def exit_thread(self):
+        ident = threading.get_ident()
+        with self._lock:
+            self._threads[ident] -= 1
+            if self._threads[ident] <= 0:
+                del self._threads[ident]
+
+    def active_threads(self) -> List[int]:
+        with self._lock:
+            return list(self._threads)
+
+    def add(self, span: Dict[str, Any]):
+        with self._lock:
+            self.stages.append(span)
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            stages = list(self.stages)
+        totals: Dict[str, float] = {}
+        for span in stages:
+            totals[span["stage"]] = totals.get(span["stage"], 0.0) + span["ms"]
+        return {
+            "total_ms": round(self.duration * 1000, 2),
+            "stage_totals_ms": {k: round(v, 2) for k, v in totals.items()},
+            "stages": stages,
+        }
+
+
+_current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("request_trace", default=None)
+
+
+def start_trace(name: str) -> RequestTrace:
+    trace = RequestTrace(name)
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def timed(stage: str, **fields: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Time a graph node or external call.
+
+    The duration goes into the stage_duration_seconds histogram and, when a
+    request trace is active, into that trace. Callers may add fields such as
+    token counts to the yielded span.
+    """
+    trace = _current_trace.get()
+    span: Dict[str, Any] = {"stage": stage, **fields}
+    if trace is not None:
+        span["offset_ms"] = round((time.monotonic() - trace.started) * 1000, 2)
+        trace.enter_thread()
+    started = time.monotonic()
+    try:
+        yield span
+    except Exception as e:
+        span["error"] = f"{type(e).__name__}: {e}"[:200]
+        metrics.inc("stage_errors_total", help_text="Exceptions raised inside timed stages", stage=stage)
+        raise
+    finally:
+        elapsed = time.monotonic() - started
+        span["ms"] = round(elapsed * 1000, 2)
+        metrics.observe("stage_duration_seconds", elapsed, help_text="Duration of graph nodes and external calls", stage=stage)
+        if trace is not None:
+            trace.exit_thread()
+            trace.add(span)
+
+
+class EventLoopMonitor:
+    """
+    Measures event-loop blocking by how late a periodic sleep wakes up.
+
+    Lag per tick goes into the event_loop_lag_seconds histogram and lag above
+    the threshold accumulates in event_loop_blocked_seconds_total.
+    """
+
+    def __init__(self, interval_seconds: float = 0.05, threshold_seconds: float = 0.01):
+        self.interval = interval_seconds
+        self.threshold = threshold_seconds
+        self.max_lag = 0.0
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - expected)
+            self.max_lag = max(self.max_lag, lag)
+            metrics.observe("event_loop_lag_seconds", lag, help_text="Event loop wake-up delay per tick")
+            if lag > self.threshold:
+                metrics.inc("event_loop_blocked_seconds_total", lag, help_text="Event loop lag above threshold")
@@ -1,70 +1,130 @@
-import psycopg2
 from psycopg2.extras import RealDictCursor
 from datetime import datetime
-from typing import Dict, Any
+from itertools import islice
+from typing import Dict, Any, Iterable, Iterator, List, Tuple
+from app.db_pool import DatabasePool
+
+BUDGET_LIMITS_SQL = """
+    SELECT category, monthly_limit, current_spend
+    FROM budgets
+    WHERE user_id = %s AND month = %s
+"""
+
+# Maintained incrementally by the transaction processor, so this is an index lookup
+MONTH_SPENDING_SQL = """
+    SELECT category, total_spent
+    FROM monthly_spending_rollups
+    WHERE user_id = %s AND month = %s
+"""
+
+# One set-based query per chunk of users: budgets joined to aggregated spend
+BATCH_BUDGET_SQL = """
+    SELECT b.user_id, b.category, b.monthly_limit, COALESCE(r.total_spent, 0) AS total_spent
+    FROM budgets b
+    LEFT JOIN monthly_spending_rollups r
+        ON r.user_id = b.user_id AND r.month = b.month AND r.category = b.category
+    WHERE b.user_id = ANY(%s) AND b.month = %s
+"""
+
+SHARD_USERS_SQL = """
+    SELECT id
+    FROM users
+    WHERE is_active = TRUE
+    AND MOD(ABS(HASHTEXT(id)::bigint), %s) = %s
+    AND id > %s
+    ORDER BY id
+    LIMIT %s
+"""
 
 class BudgetAnalyzer:
-    def __init__(self, db_url: str):
-        self.db_url = db_url
+    def __init__(self, db_pool: DatabasePool):
+        self.db_pool = db_pool
     
     def analyze(self, user_id: str) -> Dict[str, Any]:
         """Analyze user's budget status"""
         try:
-            conn = psycopg2.connect(self.db_url)
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            
-            # Get current month's budgets
             current_month = datetime.now().replace(day=1).date()
-            cursor.execute("""
-                SELECT category, monthly_limit, current_spend
-                FROM budgets
-                WHERE user_id = %s AND month = %s
-            """, (user_id, current_month))
             
-            budgets = cursor.fetchall()
+            with self.db_pool.connection() as conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                    # Get current month's budgets
+                    self.db_pool.execute_prepared(cursor, "budget_limits", BUDGET_LIMITS_SQL, (user_id, current_month))
+                    budgets = cursor.fetchall()
+                    
+                    # Calculate spending this month
+                    self.db_pool.execute_prepared(cursor, "budget_month_spending", MONTH_SPENDING_SQL, (user_id, current_month))
+                    spending = {row['category']: float(row['total_spent']) for row in cursor.fetchall()}
             
-            # Calculate spending this month
-            cursor.execute("""
-                SELECT category, SUM(ABS(amount)) as total_spent
-                FROM transactions
-                WHERE user_id = %s 
-                AND transaction_date >= %s
-                AND amount < 0
-                GROUP BY category
-            """, (user_id, current_month))
+            return self._summarize([(b['category'], float(b['monthly_limit']), spending.get(b['category'], 0)) for b in budgets])
             
-            spending = {row['category']: float(row['total_spent']) for row in cursor.fetchall()}
+        except Exception as e:
+            print(f"Budget analysis error: {e}")
+            return {"error": str(e)}
+    
+    def analyze_batch(self, user_ids: Iterable[str], chunk_size: int = 500) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Analyze many users with one query per chunk, yielding (user_id, analysis) as chunks complete"""
+        current_month = datetime.now().replace(day=1).date()
+        user_iter = iter(user_ids)
+        
+        while True:
+            chunk = list(islice(user_iter, chunk_size))
+            if not chunk:
+                return
             
-            cursor.close()
-            conn.close()
+            try:
+                with self.db_pool.connection() as conn:
+                    with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                        self.db_pool.execute_prepared(cursor, "budget_batch", BATCH_BUDGET_SQL, (chunk, current_month))
+                        rows = cursor.fetchall()
+            except Exception as e:
+                print(f"Batch budget analysis error: {e}")
+                for user_id in chunk:
+                    yield user_id, {"error": str(e)}
+                continue
             
-            # Analyze
-            overspent_categories = []
-            overspent_amounts = {}
-            total_spent = 0
-            total_limit = 0
+            budgets_by_user: Dict[str, List[Tuple[str, float, float]]] = {}
+            for row in rows:
+                budgets_by_user.setdefault(row['user_id'], []).append(
+                    (row['category'], float(row['monthly_limit']), float(row['total_spent']))
+                )
             
-            for budget in budgets:
-                category = budget['category']
-                limit = float(budget['monthly_limit'])
-                spent = spending.get(category, 0)
-                
-                total_spent += spent
-                total_limit += limit
-                
-                if spent > limit:
-                    overspent_categories.append(category)
-                    overspent_amounts[category] = spent - limit
+            for user_id in chunk:
+                yield user_id, self._summarize(budgets_by_user.get(user_id, []))
+    
+    def iter_shard_user_ids(self, shard_index: int, shard_count: int, page_size: int = 500) -> Iterator[str]:
+        """Active user ids in one hash shard of the users table, paged by primary key"""
+        last_id = ""
+        while True:
+            with self.db_pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    self.db_pool.execute_prepared(cursor, "budget_shard_users", SHARD_USERS_SQL, (shard_count, shard_index, last_id, page_size))
+                    page = [row[0] for row in cursor.fetchall()]
             
-            return {
-                "total_spent": total_spent,
-                "total_limit": total_limit,
-                "overspent_categories": overspent_categories,
-                "overspent_amount": overspent_amounts,
-                "savings_opportunity": max(0, total_limit - total_spent) * 0.1,
-                "status": "good" if not overspent_categories else "warning"
-            }
+            yield from page
+            if len(page) < page_size:
+                return
+            last_id = page[-1]
+    
+    def _summarize(self, budgets: List[Tuple[str, float, float]]) -> Dict[str, Any]:
+        """Turn (category, limit, spent) rows into the analysis dict"""
+        overspent_categories = []
+        overspent_amounts = {}
+        total_spent = 0
+        total_limit = 0
+        
+        for category, limit, spent in budgets:
+            total_spent += spent
+            total_limit += limit
             
-        except Exception as e:
-            print(f"Budget analysis error: {e}")
-            return {"error": str(e)}
+            if spent > limit:
+                overspent_categories.append(category)
+                overspent_amounts[category] = spent - limit
+        
+        return {
+            "total_spent": total_spent,
+            "total_limit": total_limit,
+            "overspent_categories": overspent_categories,
+            "overspent_amount": overspent_amounts,
+            "savings_opportunity": max(0, total_limit - total_spent) * 0.1,
+            "status": "good" if not overspent_categories else "warning"
+        }
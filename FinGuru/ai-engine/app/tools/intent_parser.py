@@ -0,0 +1,401 @@
+import re
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Dict, Optional, Set, Tuple
+
+# Maps user phrasing to the category names written by the transaction categorizer
+CATEGORY_SYNONYMS = {
+    "Food & Dining": ["food", "dining", "restaurants", "restaurant", "eating out", "takeout", "coffee"],
+    "Groceries": ["groceries", "grocery", "supermarket"],
+    "Transportation": ["transportation", "transport", "gas", "fuel", "uber", "lyft", "rideshare", "parking"],
+    "Shopping": ["shopping", "clothes", "clothing", "electronics"],
+    "Entertainment": ["entertainment", "streaming", "movies", "games", "gaming", "concerts"],
+    "Healthcare": ["healthcare", "health", "medical", "pharmacy", "doctor", "fitness", "gym"],
+    "Bills & Utilities": ["bills", "utilities", "utility", "phone", "internet", "electricity"],
+    "Housing": ["housing", "rent", "mortgage"],
+    "Travel": ["travel", "hotels", "hotel", "flights", "flight", "airfare"],
+    "Personal Care": ["personal care", "salon", "haircuts", "beauty"],
+    "Education": ["education", "tuition", "books", "courses"],
+    "Financial": ["fees", "bank fees", "insurance", "investments"],
+    "Pets": ["pets", "pet", "vet"],
+}
+
+NUMBER_WORDS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+    "seven": 7, "eight": 8, "nine": 9, "ten": 10, "twelve": 12,
+}
+
+SPEND_WORDS = re.compile(r"\b(spend|spent|spending|pay|paid|expenses?)\b")
+# "spent in total" / "on everything" don't narrow the question
+TOTAL_WORDS = {"total", "all", "everything", "overall", "general", "all categories"}
+UNRESOLVABLE_MERCHANT = re.compile(r"(a|an|all|each|every|average|things|stuff|home|work|places?|stores?)\b")
+PERIOD_PATTERN = re.compile(
+    r"\b(?:in |during |over |for )?(?:the )?"
+    r"(?:(this|last|past|previous) (\d+|" + "|".join(NUMBER_WORDS) + r") (days?|weeks?|months?)"
+    r"|(this|last|previous|past) (week|month|year)"
+    r"|(today|yesterday)"
+    r"|(so far this month|month to date|year to date|ytd))\b"
+)
+
+
+@dataclass
+class ParsedIntent:
+    """A question recognised by the rule parser, with the SQL that answers it"""
+    name: str
+    sql: str
+    params: Tuple
+    description: str
+    slots: Dict[str, str] = field(default_factory=dict)
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def add_months(day: date, months: int) -> date:
+    month_index = day.year * 12 + day.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def parse_period(text: str, today: date) -> Optional[Tuple[date, date, str]]:
+    """Extract a relative period as (start, end_exclusive, label)"""
+    match = PERIOD_PATTERN.search(text)
+    if not match:
+        return None
+
+    tomorrow = today + timedelta(days=1)
+    relative, count, unit, anchor, span, single_day, to_date = match.groups()
+
+    if count:
+        n = int(count) if count.isdigit() else NUMBER_WORDS[count]
+        if unit.startswith("day"):
+            start = tomorrow - timedelta(days=n)
+        elif unit.startswith("week"):
+            start = tomorrow - timedelta(weeks=n)
+        else:
+            start = tomorrow - timedelta(days=30 * n)
+        return start, tomorrow, f"{relative} {n} {unit}"
+
+    if span == "week":
+        this_week = today - timedelta(days=today.weekday())
+        if anchor == "this":
+            return this_week, tomorrow, "this week"
+        if anchor == "past":
+            return tomorrow - timedelta(days=7), tomorrow, "past week"
+        return this_week - timedelta(weeks=1), this_week, "last week"
+
+    if span == "month":
+        if anchor == "this":
+            return month_start(today), tomorrow, "this month"
+        if anchor == "past":
+            return tomorrow - timedelta(days=30), tomorrow, "past month"
+        return add_months(month_start(today), -1), month_start(today), "last month"
+
+    if span == "year":
+        this_year = date(today.year, 1, 1)
+        if anchor == "this":
+            return this_year, tomorrow, "this year"
+        if anchor == "past":
+            return tomorrow - timedelta(days=365), tomorrow, "past year"
+        return date(today.year - 1, 1, 1), this_year, "last year"
+
+    if single_day == "today":
+        return today, tomorrow, "today"
+    if single_day == "yesterday":
+        return today - timedelta(days=1), today, "yesterday"
+
+    if to_date in ("year to date", "ytd"):
+        return date(today.year, 1, 1), tomorrow, "year to date"
+    return month_start(today), tomorrow, "this month"
+
+
+def match_category(text: str) -> Optional[str]:
+    """Return the category whose synonym appears in the text, preferring the longest synonym"""
+    best = None
+    best_length = 0
+    for category, synonyms in CATEGORY_SYNONYMS.items():
+        for synonym in synonyms + [category.lower()]:
+            if len(synonym) > best_length and re.search(r"\b" + re.escape(synonym) + r"\b", text):
+                best = category
+                best_length = len(synonym)
+    return best
+
+
+def matched_categories(text: str) -> Set[str]:
+    """Every category with a synonym in the text"""
+    return {
+        category for category, synonyms in CATEGORY_SYNONYMS.items()
+        if any(re.search(r"\b" + re.escape(synonym) + r"\b", text) for synonym in synonyms + [category.lower()])
+    }
+
+
+def is_category_phrase(text: str) -> bool:
+    """The text is exactly a category name or synonym"""
+    return any(text in synonyms or text == category.lower() for category, synonyms in CATEGORY_SYNONYMS.items())
+
+
+class IntentParser:
+    """
+    Grammar-based parser for the high-volume question shapes.
+
+    Recognised questions map directly to hand-written, parameterized SQL so the
+    LLM is only needed to phrase the answer. Anything else returns None and
+    falls back to LLM-generated SQL.
+    """
+
+    def parse(self, user_id: str, query: str, today: Optional[date] = None) -> Optional[ParsedIntent]:
+        """Parse a question into a fast-path intent, or None if it is not recognised"""
+        today = today or date.today()
+        # Apostrophes stay: merchant names like "trader joe's" need them
+        text = " ".join(query.lower().replace("?", " ").replace("\u2019", "'").split())
+
+        for parser in (
+            self._parse_balance,
+            self._parse_month_over_month,
+            self._parse_top_merchants,
+            self._parse_budget_remaining,
+            self._parse_spend,
+        ):
+            intent = parser(user_id, text, today)
+            if intent:
+                return intent
+
+        return None
+
+    def _parse_balance(self, user_id: str, text: str, today: date) -> Optional[ParsedIntent]:
+        """What's my balance / how much money do I have"""
+        if not re.search(r"\b(balances?|how much (money )?do i have|net worth)\b", text):
+            return None
+        if SPEND_WORDS.search(text):
+            return None
+
+        sql = """
+            SELECT account_type, COUNT(*) AS accounts, SUM(balance) AS total_balance
+            FROM accounts
+            WHERE user_id = %s AND is_active = TRUE
+            GROUP BY ROLLUP(account_type)
+            ORDER BY account_type NULLS LAST
+        """
+        return ParsedIntent(
+            name="balance_totals",
+            sql=sql,
+            params=(user_id,),
+            description="Account balances by account type (the row with account_type NULL is the grand total)",
+        )
+
+    def _parse_month_over_month(self, user_id: str, text: str, today: date) -> Optional[ParsedIntent]:
+        """Compare this month with last month, optionally for one category"""
+        compare = re.search(r"\b(month over month|month-over-month)\b", text) or (
+            re.search(r"\b(compare|compared|vs|versus|than)\b", text)
+            and "last month" in text
+            and re.search(r"\b(this month|so far|month to date)\b", text)
+        )
+        if not compare:
+            return None
+        # Two categories against each other, or spending against a budget, is a different question
+        if len(matched_categories(text)) > 1 or re.search(r"\bbudgets?\b", text):
+            return None
+
+        this_month = month_start(today)
+        last_month = add_months(this_month, -1)
+        category = match_category(text)
+
+        sql = """
+            SELECT DATE_TRUNC('month', transaction_date)::date AS month,
+                   SUM(ABS(amount)) AS total_spent,
+                   COUNT(*) AS transactions
+            FROM transactions
+            WHERE user_id = %s
+            AND amount < 0
+            AND transaction_date >= %s AND transaction_date < %s
+        """
+        params = [user_id, last_month, today + timedelta(days=1)]
+        description = f"Spending in {last_month:%B %Y} vs {this_month:%B %Y} (month to date)"
+        if category:
+            sql += "            AND category = %s\n"
+            params.append(category)
+            description += f" for {category}"
+        sql += """
+            GROUP BY 1
+            ORDER BY 1
+        """
+        return ParsedIntent(
+            name="month_over_month",
+            sql=sql,
+            params=tuple(params),
+            description=description,
+            slots={"category": category} if category else {},
+        )
+
+    def _parse_top_merchants(self, user_id: str, text: str, today: date) -> Optional[ParsedIntent]:
+        """Top N merchants / where do I spend the most"""
+        match = re.search(r"\b(?:top|biggest|largest) (\d+|" + "|".join(NUMBER_WORDS) + r")? ?(merchants|stores|places|vendors)\b", text)
+        if not match and not re.search(r"\bwhere (do|did) i (spend|spent) (the )?most\b", text):
+            return None
+
+        limit = 5
+        if match and match.group(1):
+            limit = int(match.group(1)) if match.group(1).isdigit() else NUMBER_WORDS[match.group(1)]
+        limit = max(1, min(limit, 20))
+
+        sql = """
+            SELECT merchant_name, SUM(ABS(amount)) AS total_spent, COUNT(*) AS transactions
+            FROM transactions
+            WHERE user_id = %s
+            AND amount < 0
+        """
+        params = [user_id]
+        description = f"Top {limit} merchants by spending"
+        period = parse_period(text, today)
+        if period:
+            sql += "            AND transaction_date >= %s AND transaction_date < %s\n"
+            params.extend(period[:2])
+            description += f" ({period[2]})"
+        category = match_category(text)
+        if category:
+            sql += "            AND category = %s\n"
+            params.append(category)
+            description += f" in {category}"
+        sql += """
+            GROUP BY merchant_name
+            ORDER BY total_spent DESC
+            LIMIT %s
+        """
+        params.append(limit)
+        return ParsedIntent(
+            name="top_merchants",
+            sql=sql,
+            params=tuple(params),
+            description=description,
+        )
+
+    def _parse_budget_remaining(self, user_id: str, text: str, today: date) -> Optional[ParsedIntent]:
+        """How much budget do I have left (for a category)"""
+        if not re.search(r"\bbudgets?\b", text) or not re.search(r"\b(left|remaining|remain|over|status)\b", text):
+            return None
+
+        this_month = month_start(today)
+        category = match_category(text)
+        sql = """
+            SELECT b.category, b.monthly_limit,
+                   COALESCE(s.total_spent, 0) AS spent,
+                   b.monthly_limit - COALESCE(s.total_spent, 0) AS remaining
+            FROM budgets b
+            LEFT JOIN (
+                SELECT category, SUM(ABS(amount)) AS total_spent
+                FROM transactions
+                WHERE user_id = %s AND amount < 0 AND transaction_date >= %s
+                GROUP BY category
+            ) s ON s.category = b.category
+            WHERE b.user_id = %s AND b.month = %s
+        """
+        params = [user_id, this_month, user_id, this_month]
+        description = f"Budget limits, spending and remaining amounts for {this_month:%B %Y}"
+        if category:
+            sql += "            AND b.category = %s\n"
+            params.append(category)
+            description += f" ({category})"
+        sql += "            ORDER BY remaining\n"
+        return ParsedIntent(
+            name="budget_remaining",
+            sql=sql,
+            params=tuple(params),
+            description=description,
+        )
+
+    def _parse_spend(self, user_id: str, text: str, today: date) -> Optional[ParsedIntent]:
+        """How much did I spend (on a category / at a merchant) over a relative period"""
+        if not SPEND_WORDS.search(text):
+            return None
+        # Comparisons ("more on groceries than on dining", "than my budget") are left to the LLM
+        if re.search(r"\b(than|vs|versus|compare|compared)\b", text):
+            return None
+
+        period = parse_period(text, today)
+        if not period:
+            return None
+        start, end, label = period
+
+        remainder = " ".join(PERIOD_PATTERN.sub(" ", text).split())
+        by_category = re.search(r"\b(by|per|each) category\b|\bbreakdown\b|\bbroken down\b", remainder)
+
+        if by_category:
+            sql = """
+                SELECT category, SUM(ABS(amount)) AS total_spent, COUNT(*) AS transactions
+                FROM transactions
+                WHERE user_id = %s
+                AND amount < 0
+                AND transaction_date >= %s AND transaction_date < %s
+                GROUP BY category
+                ORDER BY total_spent DESC
+            """
+            return ParsedIntent(
+                name="spend_by_category",
+                sql=sql,
+                params=(user_id, start, end),
+                description=f"Spending by category ({label})",
+            )
+
+        # Several categories ("food and groceries") need a breakdown the LLM can phrase
+        if len(matched_categories(remainder)) > 1:
+            return None
+
+        # After the spend word, "at X" names a merchant and "on/for/in X" what was bought
+        spend = SPEND_WORDS.search(remainder)
+        parts = re.split(r"\b(at|on|for|in)\b", remainder[spend.end():] if spend else "")
+        clauses = [(parts[i], re.sub(r"^(the|my) ", "", parts[i + 1].strip())) for i in range(1, len(parts) - 1, 2)]
+        clauses = [(preposition, target) for preposition, target in clauses if target and target not in TOTAL_WORDS]
+        merchants = [target for preposition, target in clauses if preposition == "at"]
+        objects = [target for preposition, target in clauses if preposition != "at"]
+        if len(merchants) > 1 or len(objects) > 1:
+            return None
+        merchant = merchants[0] if merchants else None
+        spent_on = objects[0] if objects else None
+
+        if spent_on:
+            category = match_category(spent_on)
+            if not category:
+                # "taxes", "the weekend", "christmas gifts": nothing we can filter on, so the LLM answers
+                return None
+            if (not merchant and len(spent_on.split()) > 1 and not is_category_phrase(spent_on)
+                    and not re.search(r"\b(and|or)\b", spent_on)):
+                # A multi-word name that merely contains a category word ("uber eats") is a merchant
+                merchant, category = spent_on, None
+        else:
+            category = match_category(remainder[:spend.start()] + parts[0] if spend else remainder)
+        if merchant and UNRESOLVABLE_MERCHANT.match(merchant):
+            return None
+
+        sql = """
+            SELECT SUM(ABS(amount)) AS total_spent, COUNT(*) AS transactions
+            FROM transactions
+            WHERE user_id = %s
+            AND amount < 0
+            AND transaction_date >= %s AND transaction_date < %s
+        """
+        params = [user_id, start, end]
+        slots = {"period": label}
+        name = "spend_total"
+        description = f"Total spending ({label})"
+        if category:
+            sql += "            AND category = %s\n"
+            params.append(category)
+            slots["category"] = category
+            name = "spend_by_category_total"
+            description = f"Total spending on {category} ({label})"
+        if merchant:
+            # Apostrophes dropped on both sides, so "trader joes" also matches "Trader Joe's"
+            sql += "            AND REPLACE(merchant_name, '''', '') ILIKE %s\n"
+            params.append("%" + merchant.replace("'", "") + "%")
+            slots["merchant"] = merchant
+            name = "spend_by_merchant"
+            spending = f"Total spending on {category}" if category else "Total spending"
+            description = f"{spending} at merchants matching '{merchant}' ({label})"
+
+        return ParsedIntent(
+            name=name,
+            sql=sql,
+            params=tuple(params),
+            description=description,
+            slots=slots,
+        )
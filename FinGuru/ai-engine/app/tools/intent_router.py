@@ -0,0 +1,167 @@
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+# Example questions per route. "general" only contrasts the others: advice that needs no user data.
+ROUTE_PROTOTYPES: Dict[str, List[str]] = {
+    "sql": [
+        "How much did I spend last month?",
+        "What is my total spending on groceries this year?",
+        "How many transactions did I make in March?",
+        "What's my average monthly spend on dining?",
+        "Which category did I spend the most on?",
+        "What is my current account balance?",
+        "Sum of my subscription payments this month",
+        "How much income did I receive in the last 90 days?",
+        "Show my spending by category for this month",
+        "What were my top 5 merchants by amount?",
+    ],
+    "vector": [
+        "Did I buy anything at an electronics store recently?",
+        "Find the charge from that coffee shop downtown",
+        "What was that weird payment I made last week?",
+        "Show me transactions that look like travel bookings",
+        "Have I paid for any streaming services?",
+        "Which purchases were for my car?",
+        "Is there a duplicate charge on my card?",
+        "What did I order online before the holidays?",
+        "Any payments to a gym or fitness club?",
+        "Find my pharmacy purchases",
+    ],
+    "analysis": [
+        "Am I on track with my budget?",
+        "Can I afford a $2,000 vacation next month?",
+        "Where am I overspending?",
+        "How can I save more money each month?",
+        "Will I reach my emergency fund goal this year?",
+        "Am I spending too much on eating out compared to my plan?",
+        "How is my financial health looking?",
+        "What should I cut back on to save for a house?",
+        "Did I go over my limits this month?",
+        "How much could I put into savings?",
+    ],
+    "general": [
+        "What is a good credit score?",
+        "Explain the difference between a Roth IRA and a traditional IRA",
+        "How does compound interest work?",
+        "What is an index fund?",
+        "Should I pay off debt or invest first?",
+        "What does APR mean?",
+        "Hello, what can you do?",
+        "Give me tips for building good money habits",
+        "How do credit card rewards work?",
+        "What is inflation?",
+    ],
+}
+
+
+@dataclass
+class RouteDecision:
+    """Which stages a question needs, with the calibrated probability behind each decision"""
+    needs_sql: bool
+    needs_vector: bool
+    needs_analysis: bool
+    # A confident "general" question needs none of the stages
+    general: bool = False
+    probabilities: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def uncertain(self) -> bool:
+        """No route, general included, cleared its threshold"""
+        return not (self.needs_sql or self.needs_vector or self.needs_analysis or self.general)
+
+
+class IntentRouter:
+    """
+    Routes a question by comparing its embedding with prototype questions per route.
+
+    Prototypes are embedded once, after the embedding model loads. A query is
+    scored with a single matrix-vector product; each route's score is its best
+    prototype similarity minus the best score of any other route. Margins
+    become probabilities with a per-route logistic fitted on the prototypes
+    themselves (leave-one-out margins of each route's own prototypes against
+    everyone else's), so thresholds adapt to whichever embedding model is in
+    use. Routes with close scores can both fire.
+    """
+
+    def __init__(self, embedder, prototypes: Optional[Dict[str, List[str]]] = None):
+        self.embedder = embedder
+        self.prototypes = prototypes or ROUTE_PROTOTYPES
+        self.routes = list(self.prototypes)
+
+        self._lock = threading.Lock()
+        self._matrix: Optional[np.ndarray] = None
+        self._mask: Optional[np.ndarray] = None
+        self._threshold: Optional[np.ndarray] = None
+        self._scale: Optional[np.ndarray] = None
+        self.stats = {"routed": 0, "uncertain": 0}
+
+    @property
+    def ready(self) -> bool:
+        return self._matrix is not None
+
+    def build(self):
+        """Embed the prototypes and calibrate per-route thresholds"""
+        texts = [text for route in self.routes for text in self.prototypes[route]]
+        labels = np.array([i for i, route in enumerate(self.routes) for _ in self.prototypes[route]])
+        matrix = _normalize(np.asarray(self.embedder.encode_batch(texts), dtype=np.float32))
+        # (routes, prototypes): which prototypes belong to each route
+        mask = labels[None, :] == np.arange(len(self.routes))[:, None]
+
+        # Each prototype's best similarity per route, excluding itself
+        sims = matrix @ matrix.T
+        np.fill_diagonal(sims, -np.inf)
+        scores = _margins(np.where(mask[None, :, :], sims[:, None, :], -np.inf).max(axis=2))
+
+        own = labels[:, None] == np.arange(len(self.routes))[None, :]
+        positive = np.array([scores[own[:, r], r].mean() for r in range(len(self.routes))])
+        negative = np.array([scores[~own[:, r], r].mean() for r in range(len(self.routes))])
+
+        with self._lock:
+            self._matrix = matrix
+            self._mask = mask
+            self._threshold = (positive + negative) / 2
+            # The own-route mean lands near p=0.88 and the other-route mean near p=0.12
+            self._scale = np.maximum((positive - negative) / 4, 0.02)
+
+    def route(self, query_embedding: np.ndarray) -> RouteDecision:
+        query = _normalize(np.asarray(query_embedding, dtype=np.float32)[None, :])[0]
+        with self._lock:
+            matrix, mask, threshold, scale = self._matrix, self._mask, self._threshold, self._scale
+
+        sims = matrix @ query
+        scores = _margins(np.where(mask, sims[None, :], -np.inf).max(axis=1)[None, :])[0]
+        probabilities = 1.0 / (1.0 + np.exp(-(scores - threshold) / scale))
+        by_route = {route: round(float(p), 3) for route, p in zip(self.routes, probabilities)}
+
+        decision = RouteDecision(
+            needs_sql=by_route.get("sql", 0.0) >= 0.5,
+            needs_vector=by_route.get("vector", 0.0) >= 0.5,
+            needs_analysis=by_route.get("analysis", 0.0) >= 0.5,
+            general=by_route.get("general", 0.0) >= 0.5,
+            probabilities=by_route,
+        )
+        self.stats["routed"] += 1
+        if decision.uncertain:
+            self.stats["uncertain"] += 1
+        return decision
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {**self.stats, "ready": self.ready}
+        if self.ready:
+            stats["thresholds"] = {route: round(float(t), 3) for route, t in zip(self.routes, self._threshold)}
+        return stats
+
+
+def _margins(scores: np.ndarray) -> np.ndarray:
+    """Each route's score minus the best score among the other routes, row-wise"""
+    top_two = np.sort(scores, axis=1)[:, -2:]
+    best_other = np.where(scores >= top_two[:, 1:], top_two[:, :1], top_two[:, 1:])
+    return scores - best_other
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
@@ -0,0 +1,141 @@
+import re
+from dataclasses import dataclass
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+from app.tools.intent_parser import PERIOD_PATTERN, match_category, parse_period
+
+AMOUNT_PATTERN = re.compile(
+    r"\b(between)\s+\$?(\d[\d,]*(?:\.\d+)?)\s+and\s+\$?(\d[\d,]*(?:\.\d+)?)"
+    r"|\b(over|more than|above|greater than|at least|under|less than|below|at most|cheaper than)\s+"
+    r"(\$)?(\d[\d,]*(?:\.\d+)?)(?!\s*(?:days?|weeks?|months?|years?|times?|transactions?)\b)"
+)
+MIN_WORDS = {"over", "more than", "above", "greater than", "at least"}
+INCOME_WORDS = re.compile(r"\b(income|deposits?|paychecks?|salary|refunds?|received|earned|got paid)\b")
+MERCHANT_PATTERN = re.compile(r"\b(?:at|from) (?:the )?([a-z0-9&.'\- ]{2,40}?)(?=\s+(?:in|during|over|for|since|on|this|last|recently|lately|before|so far)\b|\s*$)")
+# Weaviate's word tokenization splits on anything that isn't a letter or digit
+MERCHANT_TERM_PATTERN = re.compile(r"[a-z0-9]+")
+GENERIC_TARGETS = re.compile(r"(my|a|an|all|each|every|any|the|some|least|most|home|work|stores?|places?|merchants?|things|stuff)\b")
+
+
+def _to_rfc3339(day: date) -> str:
+    return f"{day.isoformat()}T00:00:00Z"
+
+
+@dataclass
+class QueryFilters:
+    """Structured constraints pulled from a question, applied before vector ranking"""
+    start: Optional[date] = None
+    end: Optional[date] = None
+    category: Optional[str] = None
+    merchant: Optional[str] = None
+    min_amount: Optional[float] = None
+    max_amount: Optional[float] = None
+    direction: str = "expense"
+
+    def is_empty(self) -> bool:
+        return not any([self.start, self.end, self.category, self.merchant,
+                        self.min_amount is not None, self.max_amount is not None])
+
+    def describe(self) -> Dict[str, Any]:
+        described = {
+            "start": self.start.isoformat() if self.start else None,
+            "end_exclusive": self.end.isoformat() if self.end else None,
+            "category": self.category,
+            "merchant": self.merchant,
+            "min_amount": self.min_amount,
+            "max_amount": self.max_amount,
+        }
+        described = {k: v for k, v in described.items() if v is not None}
+        if self.min_amount is not None or self.max_amount is not None:
+            described["direction"] = self.direction
+        return described
+
+    def signed_amount_range(self):
+        """(low, high) bounds on the signed amount; expenses are stored negative"""
+        low = high = None
+        if self.direction == "income":
+            low = self.min_amount if self.min_amount is not None else (0.0 if self.max_amount is not None else None)
+            high = self.max_amount
+        else:
+            low = -self.max_amount if self.max_amount is not None else None
+            high = -self.min_amount if self.min_amount is not None else (0.0 if self.max_amount is not None else None)
+        return low, high
+
+    def merchant_terms(self) -> List[str]:
+        """
+        Words that must each appear, case-insensitively and as a substring, in
+        the merchant name; Weaviate and the local index both match this way.
+        A possessive "'s" is dropped so "trader joe's" doesn't also require an "s".
+        """
+        return MERCHANT_TERM_PATTERN.findall(re.sub(r"'s\b", "", self.merchant.lower())) if self.merchant else []
+
+    def to_where(self, user_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Weaviate where filter: the user (omitted for per-user tenants) plus every extracted constraint, ANDed"""
+        operands: List[Dict[str, Any]] = []
+        if user_id is not None:
+            operands.append({"path": ["user_id"], "operator": "Equal", "valueString": user_id})
+        if self.start:
+            operands.append({"path": ["transaction_day"], "operator": "GreaterThanEqual", "valueDate": _to_rfc3339(self.start)})
+        if self.end:
+            operands.append({"path": ["transaction_day"], "operator": "LessThan", "valueDate": _to_rfc3339(self.end)})
+        if self.category:
+            operands.append({"path": ["category"], "operator": "Equal", "valueString": self.category})
+        for term in self.merchant_terms():
+            operands.append({"path": ["merchant_name"], "operator": "Like", "valueString": f"*{term}*"})
+
+        low, high = self.signed_amount_range()
+        if low is not None:
+            operands.append({"path": ["amount"], "operator": "GreaterThanEqual", "valueNumber": low})
+        if high is not None:
+            operands.append({"path": ["amount"], "operator": "LessThanEqual", "valueNumber": high})
+
+        if len(operands) <= 1:
+            return operands[0] if operands else None
+        return {"operator": "And", "operands": operands}
+
+
+class QueryAnalyzer:
+    """
+    Extracts date ranges, categories, merchants and amount bounds from a question.
+
+    Reuses the intent parser's period and category grammar so retrieval and
+    the SQL fast path agree on what "last month" or "groceries" means.
+    """
+
+    def analyze(self, query: str, today: Optional[date] = None) -> QueryFilters:
+        today = today or date.today()
+        text = " ".join(query.lower().replace("?", " ").replace("\u2019", "'").split())
+        filters = QueryFilters()
+
+        period = parse_period(text, today)
+        if period:
+            filters.start, filters.end, _ = period
+        remainder = PERIOD_PATTERN.sub(" ", text)
+
+        amount = AMOUNT_PATTERN.search(remainder)
+        if amount:
+            between, low, high, comparator, _, value = amount.groups()
+            if between:
+                bounds = sorted([_number(low), _number(high)])
+                filters.min_amount, filters.max_amount = bounds
+            elif comparator in MIN_WORDS:
+                filters.min_amount = _number(value)
+            else:
+                filters.max_amount = _number(value)
+            remainder = AMOUNT_PATTERN.sub(" ", remainder)
+        if INCOME_WORDS.search(text):
+            filters.direction = "income"
+
+        filters.category = match_category(remainder)
+        if not filters.category:
+            for target in MERCHANT_PATTERN.finditer(" ".join(remainder.split())):
+                if not GENERIC_TARGETS.match(target.group(1)):
+                    filters.merchant = target.group(1).strip()
+                    break
+
+        return filters
+
+
+def _number(text: str) -> float:
+    return float(text.replace(",", ""))
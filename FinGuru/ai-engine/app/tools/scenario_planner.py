@@ -1,80 +1,245 @@
-import psycopg2
 from psycopg2.extras import RealDictCursor
-from typing import Dict, Any
+from datetime import date
+from typing import Dict, Any, List, Optional
 import re
+import zlib
+import numpy as np
+from app.db_pool import DatabasePool
+
+TOTAL_BALANCE_SQL = """
+    SELECT SUM(balance) as total_balance
+    FROM accounts
+    WHERE user_id = %s AND account_type IN ('checking', 'savings')
+"""
+
+# Completed months only; the current month is still accumulating
+MONTHLY_FLOWS_SQL = """
+    SELECT month, SUM(total_income) as income, SUM(total_spent) as spent
+    FROM monthly_spending_rollups
+    WHERE user_id = %s
+      AND month >= (DATE_TRUNC('month', NOW()) - make_interval(months => %s))::date
+      AND month < DATE_TRUNC('month', NOW())::date
+    GROUP BY month
+    ORDER BY month
+"""
+
+# A $-prefixed amount wins over other numbers ("2 tickets for $300")
+DOLLAR_AMOUNT_PATTERN = re.compile(r'\$\s?(\d+(?:,\d{3})*(?:\.\d{1,2})?)(\s*[kK]\b)?')
+# Then the price after "at"/"for" ("3 months of rent at 1500"), then any number that isn't a duration or count
+PRICED_AMOUNT_PATTERN = re.compile(r'\b(?:at|for)\s+(\d+(?:,\d{3})*(?:\.\d{1,2})?)(\s*[kK]\b)?')
+AMOUNT_PATTERN = re.compile(
+    r'(\d+(?:,\d{3})*(?:\.\d{1,2})?)(\s*[kK]\b)?(?!\s*(?:days?|weeks?|months?|years?|times|x)\b)'
+)
+# Kinds that only add money; they can't make a plan riskier
+INFLOW_KINDS = {"one_time_income", "recurring_saving", "income_change"}
+# "a month" only right after an amount ("$50 a month"), not "in a month"
+RECURRING_PATTERN = re.compile(r'\b(per|each|every) month\b|\d(\s*[kK])?\s+a month\b|\bmonthly\b|/\s*mo(nth)?\b')
+# Cancelling something (a membership, a subscription) saves its cost every month
+CANCEL_PATTERN = re.compile(r'\b(quit|cancel|cancell?ing|drop|stop paying)\b')
+WINDFALL_PATTERN = re.compile(r'\b(bonus|windfall|inheritance|inherit|tax refund|refund|gift|lottery|settlement)\b')
+INCOME_PATTERN = re.compile(
+    r'\b(raise|pay rise|salary (increase|bump)|side (job|gig|hustle)|paid more|earn (an extra|more)|extra income|more income)\b'
+)
+INCOME_LOSS_PATTERN = re.compile(
+    r'\b(lose|lost|quit|quitting|leave|leaving) (my|our) (job|income|work)\b|\blaid off\b|\bget fired\b|\bno income\b|\bunemployed\b'
+)
+
 
 class ScenarioPlanner:
-    def __init__(self, db_url: str):
-        self.db_url = db_url
-    
+    """
+    What-if planning by Monte Carlo projection of the user's cash flow.
+
+    Completed months of (income, spending) from the rollups are bootstrapped
+    into `paths` simulated 12-month futures in one array operation. Every
+    scenario in a request is applied to the same sampled months, so their
+    differences come from the scenarios rather than sampling noise, and the
+    user's seed keeps answers stable between calls.
+    """
+
+    def __init__(self, db_pool: DatabasePool, paths: int = 5000, horizon_months: int = 12,
+                 history_months: int = 24, emergency_fund_months: float = 3.0, max_risk: float = 0.2):
+        # max_risk bounds how much a scenario may raise the chance of dipping below the
+        # emergency fund over the baseline, so users already below it aren't flagged on everything
+        self.db_pool = db_pool
+        self.paths = paths
+        self.horizon_months = horizon_months
+        self.history_months = history_months
+        self.emergency_fund_months = emergency_fund_months
+        self.max_risk = max_risk
+
     def plan(self, user_id: str, scenario: str) -> Dict[str, Any]:
         """Evaluate what-if scenarios"""
+        result = self.compare(user_id, [scenario])
+        if "error" in result:
+            return result
+        return result["scenarios"][0]
+
+    def compare(self, user_id: str, scenarios: List[str], emergency_fund_months: Optional[float] = None) -> Dict[str, Any]:
+        """Project every scenario against the same simulated paths"""
         try:
-            # Extract amount from scenario
-            amount_match = re.search(r'\$?(\d+(?:,\d{3})*(?:\.\d{2})?)', scenario)
-            if not amount_match:
-                return {"error": "Could not extract amount from scenario"}
-            
-            amount = float(amount_match.group(1).replace(',', ''))
-            
-            # Get user's financial data
-            conn = psycopg2.connect(self.db_url)
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            
-            # Get total balance
-            cursor.execute("""
-                SELECT SUM(balance) as total_balance
-                FROM accounts
-                WHERE user_id = %s AND account_type IN ('checking', 'savings')
-            """, (user_id,))
-            
-            balance_row = cursor.fetchone()
-            total_balance = float(balance_row['total_balance']) if balance_row else 0
-            
-            # Get average monthly spending
-            cursor.execute("""
-                SELECT AVG(monthly_total) as avg_monthly
-                FROM (
-                    SELECT DATE_TRUNC('month', transaction_date) as month,
-                           SUM(ABS(amount)) as monthly_total
-                    FROM transactions
-                    WHERE user_id = %s AND amount < 0
-                    GROUP BY DATE_TRUNC('month', transaction_date)
-                    ORDER BY month DESC
-                    LIMIT 3
-                ) as monthly_spending
-            """, (user_id,))
-            
-            avg_row = cursor.fetchone()
-            avg_monthly_spend = float(avg_row['avg_monthly']) if avg_row else 0
-            
-            cursor.close()
-            conn.close()
-            
-            # Calculate affordability
-            remaining_balance = total_balance - amount
-            months_of_runway = remaining_balance / avg_monthly_spend if avg_monthly_spend > 0 else 0
-            
-            affordable = remaining_balance >= (avg_monthly_spend * 3)  # At least 3 months emergency fund
-            
+            parsed = [_parse_scenario(s) for s in scenarios]
+            if not parsed:
+                return {"error": "No scenarios given"}
+
+            total_balance, income, spent = self._load_history(user_id)
+            if len(spent) == 0:
+                return {"error": "Not enough transaction history to project cash flow"}
+
+            avg_monthly_spend = float(spent[-3:].mean())
+            emergency_months = self.emergency_fund_months if emergency_fund_months is None else emergency_fund_months
+            emergency_fund = emergency_months * avg_monthly_spend
+
+            # (paths, horizon) month indices shared by every scenario
+            rng = np.random.default_rng(zlib.crc32(user_id.encode("utf-8")))
+            picks = rng.integers(0, len(spent), size=(self.paths, self.horizon_months))
+            sampled_income, sampled_spent = income[picks], spent[picks]
+
+            # Row 0 is the baseline (no change) so each scenario can be read against it
+            valid = [_BASELINE] + [p for p in parsed if "error" not in p]
+            one_time = np.array([p["one_time"] for p in valid])[:, None, None]
+            monthly = np.array([p["monthly"] for p in valid])[:, None, None]
+            income_factor = np.array([p["income_factor"] for p in valid])[:, None, None]
+
+            # (scenarios, paths, horizon) end-of-month balances
+            net = sampled_income[None] * income_factor - sampled_spent[None] + monthly
+            balances = total_balance - one_time + np.cumsum(net, axis=2)
+
+            below_zero = balances < 0
+            runway = np.where(below_zero.any(axis=2), below_zero.argmax(axis=2), self.horizon_months)
+            runway_pct = np.percentile(runway, [10, 50, 90], axis=1)
+            ending_pct = np.percentile(balances[:, :, -1], [10, 50, 90], axis=1)
+            below_emergency = (balances.min(axis=2) < emergency_fund).mean(axis=1)
+
+            confidence = round(min(0.95, 0.4 + 0.05 * len(spent)), 2)
+            results = []
+            i = 1
+            for text, scenario in zip(scenarios, parsed):
+                if "error" in scenario:
+                    results.append({"scenario": text, **scenario})
+                    continue
+                results.append(self._describe(
+                    text, scenario, total_balance, avg_monthly_spend, emergency_fund,
+                    runway_pct[:, i], ending_pct[:, i], float(below_emergency[i]), float(below_emergency[0]), confidence
+                ))
+                i += 1
+
+            # Least added risk first; higher median ending balance breaks ties
+            ranked = sorted((r for r in results if "error" not in r),
+                            key=lambda r: (r["risk_change"], -r["ending_balance_percentiles"]["p50"]))
+
             return {
-                "scenario": scenario,
-                "amount": amount,
+                "user_id": user_id,
                 "current_balance": total_balance,
-                "remaining_after_purchase": remaining_balance,
                 "avg_monthly_spending": avg_monthly_spend,
-                "months_of_runway": round(months_of_runway, 1),
-                "affordable": affordable,
-                "recommendation": (
-                    f"✅ You can afford this purchase. You'll have ${remaining_balance:.2f} remaining, "
-                    f"which covers {months_of_runway:.1f} months of expenses."
-                    if affordable else
-                    f"⚠️ This purchase is risky. You'll only have ${remaining_balance:.2f} remaining, "
-                    f"which covers {months_of_runway:.1f} months. Consider saving more first."
-                ),
-                "confidence": 0.90
+                "emergency_fund_threshold": round(emergency_fund, 2),
+                "history_months": len(spent),
+                "simulated_paths": self.paths,
+                "horizon_months": self.horizon_months,
+                "scenarios": results,
+                "ranking": [r["scenario"] for r in ranked],
             }
-            
+
         except Exception as e:
             print(f"Scenario planning error: {e}")
             return {"error": str(e)}
+
+    def _load_history(self, user_id: str):
+        with self.db_pool.connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                # Get total balance
+                self.db_pool.execute_prepared(cursor, "scenario_total_balance", TOTAL_BALANCE_SQL, (user_id,))
+                balance_row = cursor.fetchone()
+                total_balance = float(balance_row['total_balance']) if balance_row and balance_row['total_balance'] is not None else 0
+
+                self.db_pool.execute_prepared(cursor, "scenario_monthly_flows", MONTHLY_FLOWS_SQL, (user_id, self.history_months))
+                rows = cursor.fetchall()
+
+        if not rows:
+            return total_balance, np.zeros(0), np.zeros(0)
+
+        # Months without any rollup rows had no activity; they are real zero months, not gaps
+        first = rows[0]['month']
+        last = rows[-1]['month']
+        months = (last.year - first.year) * 12 + last.month - first.month + 1
+        income = np.zeros(months)
+        spent = np.zeros(months)
+        for row in rows:
+            index = _month_index(row['month'], first)
+            income[index] = float(row['income'] or 0)
+            spent[index] = float(row['spent'] or 0)
+        return total_balance, income, spent
+
+    def _describe(self, text: str, scenario: Dict[str, Any], total_balance: float, avg_monthly_spend: float,
+                  emergency_fund: float, runway_pct: np.ndarray, ending_pct: np.ndarray,
+                  below_emergency: float, baseline_below_emergency: float, confidence: float) -> Dict[str, Any]:
+        remaining_balance = total_balance - scenario["one_time"]
+        median_runway = float(runway_pct[1])
+        runway_text = f"{self.horizon_months}+" if median_runway >= self.horizon_months else f"{median_runway:.0f}"
+        risk_change = below_emergency - baseline_below_emergency
+        if scenario["kind"] in INFLOW_KINDS:
+            affordable = True
+        else:
+            affordable = remaining_balance >= 0 and risk_change <= self.max_risk
+        risk_text = (
+            f"There is a {below_emergency:.0%} chance your balance dips below your ${emergency_fund:.2f} "
+            f"emergency fund in the next {self.horizon_months} months ({baseline_below_emergency:.0%} without "
+            f"this change), and your median runway is {runway_text} months."
+        )
+
+        return {
+            "scenario": text,
+            "kind": scenario["kind"],
+            "amount": scenario["amount"],
+            "current_balance": total_balance,
+            "remaining_after_purchase": remaining_balance,
+            "avg_monthly_spending": avg_monthly_spend,
+            "months_of_runway": round(median_runway, 1),
+            "runway_months_percentiles": {"p10": float(runway_pct[0]), "p50": median_runway, "p90": float(runway_pct[2])},
+            "ending_balance_percentiles": {
+                "p10": round(float(ending_pct[0]), 2), "p50": round(float(ending_pct[1]), 2), "p90": round(float(ending_pct[2]), 2)
+            },
+            "probability_below_emergency_fund": round(below_emergency, 3),
+            "baseline_probability_below_emergency_fund": round(baseline_below_emergency, 3),
+            "risk_change": round(risk_change, 3),
+            "affordable": affordable,
+            "recommendation": (
+                f"✅ This looks affordable. {risk_text}"
+                if affordable else
+                f"⚠️ This is risky. {risk_text} Consider saving more first."
+            ),
+            "confidence": confidence
+        }
+
+
+_BASELINE = {"kind": "baseline", "amount": None, "one_time": 0.0, "monthly": 0.0, "income_factor": 1.0}
+
+
+def _parse_scenario(scenario: str) -> Dict[str, Any]:
+    """One-time purchase or windfall, recurring monthly cost or saving, monthly income change, or income loss"""
+    text = scenario.lower()
+    amount_match = (DOLLAR_AMOUNT_PATTERN.search(text) or PRICED_AMOUNT_PATTERN.search(text)
+                    or AMOUNT_PATTERN.search(text))
+    amount = None
+    if amount_match:
+        amount = float(amount_match.group(1).replace(',', ''))
+        if amount_match.group(2):
+            amount *= 1000
+
+    if INCOME_LOSS_PATTERN.search(text):
+        return {"kind": "income_loss", "amount": amount, "one_time": 0.0, "monthly": 0.0, "income_factor": 0.0}
+    if amount is None:
+        return {"error": "Could not extract amount from scenario"}
+    if WINDFALL_PATTERN.search(text):
+        # A one-time inflow: a negative one-time cost
+        return {"kind": "one_time_income", "amount": amount, "one_time": -amount, "monthly": 0.0, "income_factor": 1.0}
+    if CANCEL_PATTERN.search(text):
+        return {"kind": "recurring_saving", "amount": amount, "one_time": 0.0, "monthly": amount, "income_factor": 1.0}
+    if INCOME_PATTERN.search(text):
+        return {"kind": "income_change", "amount": amount, "one_time": 0.0, "monthly": amount, "income_factor": 1.0}
+    if RECURRING_PATTERN.search(text):
+        return {"kind": "recurring_expense", "amount": amount, "one_time": 0.0, "monthly": -amount, "income_factor": 1.0}
+    return {"kind": "one_time_expense", "amount": amount, "one_time": amount, "monthly": 0.0, "income_factor": 1.0}
+
+
+def _month_index(month: date, first: date) -> int:
+    return (month.year - first.year) * 12 + month.month - first.month
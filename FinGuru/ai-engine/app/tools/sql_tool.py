@@ -1,21 +1,152 @@
-import psycopg2
+import re
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
 from psycopg2.extras import RealDictCursor
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Sequence
+from app.db_pool import DatabasePool
+
+MAX_CELL_CHARS = 200
+MAX_GROUPS = 20
+
+READ_QUERY_PATTERN = re.compile(r"^\s*(select|with)\b", re.IGNORECASE)
+
+
+def is_read_query(query: str) -> bool:
+    """Whether generated text at least looks like a single SELECT (or WITH ... SELECT) statement"""
+    return bool(READ_QUERY_PATTERN.match(query)) and query.count("(") == query.count(")") and query.count("'") % 2 == 0
+
+
+def _to_number(value: Any) -> Optional[float]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float, Decimal)):
+        return float(value)
+    return None
+
+
+def _clean_value(value: Any) -> Any:
+    """Make a cell JSON-friendly and bound its size"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, str) and len(value) > MAX_CELL_CHARS:
+        return value[:MAX_CELL_CHARS] + "..."
+    if isinstance(value, (list, dict, bytes, memoryview)):
+        text = str(value)
+        return text[:MAX_CELL_CHARS] + "..." if len(text) > MAX_CELL_CHARS else text
+    return value
+
+
+def compact_rows(rows: List[Dict[str, Any]], max_rows: int, truncated: bool = False) -> Dict[str, Any]:
+    """
+    Summarize a result set so its size does not depend on the number of rows.
+
+    Small results are returned as-is. Larger ones are replaced by per-column
+    aggregates, totals per low-cardinality text column and the top-k rows by
+    the main numeric column.
+    """
+    rows = [{key: _clean_value(value) for key, value in row.items()} for row in rows]
+    result: Dict[str, Any] = {"row_count": len(rows), "truncated": truncated}
+    if truncated:
+        result["note"] = f"Result truncated after {len(rows)} rows; aggregates cover only those rows"
+
+    if len(rows) <= max_rows:
+        result["rows"] = rows
+        return result
+
+    columns = list(rows[0].keys())
+    numeric_columns = [c for c in columns if any(_to_number(r.get(c)) is not None for r in rows)]
+    text_columns = [c for c in columns if c not in numeric_columns and any(isinstance(r.get(c), str) for r in rows)]
+
+    aggregates = {}
+    for column in numeric_columns:
+        values = [_to_number(r.get(column)) for r in rows]
+        values = [v for v in values if v is not None]
+        aggregates[column] = {
+            "count": len(values),
+            "sum": round(sum(values), 2),
+            "min": min(values),
+            "max": max(values),
+            "avg": round(sum(values) / len(values), 2),
+        }
+    result["aggregates"] = aggregates
+
+    rank_column = "amount" if "amount" in numeric_columns else (numeric_columns[0] if numeric_columns else None)
+    if rank_column:
+        groups = {}
+        for column in text_columns:
+            totals: Dict[str, float] = {}
+            for row in rows:
+                key = row.get(column)
+                if key is None:
+                    continue
+                totals[key] = totals.get(key, 0.0) + (_to_number(row.get(rank_column)) or 0.0)
+                if len(totals) > MAX_GROUPS:
+                    break
+            if 0 < len(totals) <= MAX_GROUPS:
+                groups[column] = {k: round(v, 2) for k, v in sorted(totals.items(), key=lambda kv: -abs(kv[1]))}
+        if groups:
+            result["totals_by"] = {"value_column": rank_column, "groups": groups}
+
+        ranked = sorted(rows, key=lambda r: abs(_to_number(r.get(rank_column)) or 0.0), reverse=True)
+        result["top_rows"] = ranked[:max_rows]
+        result["top_rows_ranked_by"] = rank_column
+    else:
+        result["sample_rows"] = rows[:max_rows]
+
+    result["compacted"] = True
+    return result
+
 
 class SQLTool:
-    def __init__(self, db_url: str):
-        self.db_url = db_url
-    
-    def execute(self, query: str) -> List[Dict[str, Any]]:
+    def __init__(
+        self,
+        db_pool: DatabasePool,
+        statement_timeout_ms: int = 5000,
+        max_rows: int = 500,
+        max_prompt_rows: int = 20,
+    ):
+        self.db_pool = db_pool
+        self.statement_timeout_ms = statement_timeout_ms
+        self.max_rows = max_rows
+        self.max_prompt_rows = max_prompt_rows
+
+    def execute(self, query: str, params: Optional[Sequence[Any]] = None) -> List[Dict[str, Any]]:
         """Execute SQL query and return results"""
         try:
-            conn = psycopg2.connect(self.db_url)
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute(query)
-            results = cursor.fetchall()
-            cursor.close()
-            conn.close()
+            with self.db_pool.connection() as conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                    cursor.execute(query, params)
+                    results = cursor.fetchall()
             return [dict(row) for row in results]
         except Exception as e:
             print(f"SQL execution error: {e}")
             return [{"error": str(e)}]
+
+    def execute_bounded(self, query: str, params: Optional[Sequence[Any]] = None) -> Dict[str, Any]:
+        """
+        Execute untrusted SQL with bounded time, memory and output size.
+
+        Runs inside a read-only transaction with a statement timeout, streams
+        through a server-side cursor that never fetches more than max_rows + 1
+        rows, and compacts the result for the prompt.
+        """
+        query = query.strip().rstrip(";")
+        try:
+            with self.db_pool.connection() as conn:
+                with conn.cursor() as setup:
+                    setup.execute("SET TRANSACTION READ ONLY")
+                    setup.execute("SET LOCAL statement_timeout = %s", (str(self.statement_timeout_ms),))
+
+                with conn.cursor(name=f"sql_tool_{uuid.uuid4().hex}", cursor_factory=RealDictCursor) as cursor:
+                    cursor.itersize = min(self.max_rows + 1, 200)
+                    cursor.execute(query, params)
+                    rows = cursor.fetchmany(self.max_rows + 1)
+
+            truncated = len(rows) > self.max_rows
+            return compact_rows([dict(row) for row in rows[:self.max_rows]], self.max_prompt_rows, truncated)
+        except Exception as e:
+            print(f"SQL execution error: {e}")
+            return {"error": str(e)}
@@ -0,0 +1,274 @@
+"""
+Load-test the ai-engine and report latency, throughput and event-loop blocking as JSON.
+
+Typical run against stub Ollama/Weaviate and a local Postgres:
+
+    DATABASE_URL=postgresql://... python -m benchmarks.run --start-stubs --start-engine \\
+        --seed-users 100 --concurrency 16 --duration 30 --output results.json
+
+Without --start-engine the engine at --base-url is used as is, so it must
+already point at the stubs (OLLAMA_URL, WEAVIATE_URL) or at real services.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+import psycopg2
+
+from benchmarks import seed as seeding
+from benchmarks.stubs import create_ollama_app, create_weaviate_app, serve_in_thread
+
+ENGINE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHAT_QUESTIONS = [
+    "How much did I spend on groceries last month?",
+    "What are my top merchants this month?",
+    "How much is left in my dining budget?",
+    "Am I overspending on shopping?",
+    "Where does most of my money go?",
+    "Compare my spending this month to last month",
+    "Can I afford a $2000 vacation?",
+    "What did I buy at Amazon recently?",
+]
+SCENARIOS = ["What if I lose my job?", "What if my rent goes up by $300?", "What if I save $500 a month?"]
+
+ENDPOINTS = ["chat", "budget", "scenario", "nudges"]
+
+
+def build_request(endpoint: str, user_id: str, rng: random.Random) -> Dict[str, Any]:
+    if endpoint == "chat":
+        return {"method": "POST", "url": "/chat", "json": {"user_id": user_id, "message": rng.choice(CHAT_QUESTIONS)}}
+    if endpoint == "budget":
+        return {"method": "POST", "url": "/analyze/budget", "json": {"user_id": user_id}}
+    if endpoint == "scenario":
+        return {"method": "POST", "url": "/scenario/plan", "params": {"user_id": user_id, "scenario": rng.choice(SCENARIOS)}}
+    return {"method": "POST", "url": "/generate/nudges", "params": {"user_id": user_id}}
+
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile in milliseconds"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q * len(sorted_values))) - 1))
+    return round(sorted_values[index] * 1000, 2)
+
+
+async def run_phase(client: httpx.AsyncClient, endpoint: str, user_ids: List[str], concurrency: int,
+                    duration: float, warmup_requests: int, rng: random.Random) -> Dict[str, Any]:
+    for _ in range(warmup_requests):
+        await client.request(**build_request(endpoint, rng.choice(user_ids), rng))
+
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    stop_at = time.monotonic() + duration
+
+    async def worker():
+        while time.monotonic() < stop_at:
+            started = time.monotonic()
+            try:
+                response = await client.request(**build_request(endpoint, rng.choice(user_ids), rng))
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            if status == "200":
+                latencies.append(time.monotonic() - started)
+            else:
+                errors[status] = errors.get(status, 0) + 1
+
+    before = parse_metrics((await client.get("/metrics")).text)
+    started = time.monotonic()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.monotonic() - started
+    after = parse_metrics((await client.get("/metrics")).text)
+
+    latencies.sort()
+    return {
+        "requests": len(latencies) + sum(errors.values()),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "latency_ms": {
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": percentile(latencies, 1.0),
+        },
+        "event_loop": event_loop_delta(before, after, elapsed),
+    }
+
+
+METRIC_LINE = re.compile(r"^(\w+)(?:\{(.*)\})?\s+(\S+)$")
+
+
+def parse_metrics(text: str) -> Dict[str, float]:
+    """Flatten Prometheus text into {'name{labels}': value}"""
+    values = {}
+    for line in text.splitlines():
+        match = METRIC_LINE.match(line)
+        if match:
+            name, labels, value = match.groups()
+            values[f"{name}{{{labels}}}" if labels else name] = float(value)
+    return values
+
+
+def event_loop_delta(before: Dict[str, float], after: Dict[str, float], elapsed: float) -> Dict[str, Any]:
+    def delta(key: str) -> float:
+        return after.get(key, 0.0) - before.get(key, 0.0)
+
+    blocked = delta("finguru_event_loop_blocked_seconds_total")
+    ticks = delta("finguru_event_loop_lag_seconds_count")
+    lag_sum = delta("finguru_event_loop_lag_seconds_sum")
+
+    # p99 tick lag from the histogram buckets accumulated during this phase
+    buckets = sorted(
+        (float(key.split('le="')[1].rstrip('"}')), delta(key))
+        for key in after if key.startswith("finguru_event_loop_lag_seconds_bucket")
+    )
+    p99 = None
+    for bound, cumulative in buckets:
+        if ticks and cumulative >= 0.99 * ticks:
+            p99 = bound
+            break
+
+    return {
+        "blocked_seconds": round(blocked, 4),
+        "blocked_fraction": round(blocked / elapsed, 4) if elapsed else None,
+        "avg_lag_ms": round(lag_sum / ticks * 1000, 3) if ticks else None,
+        "p99_lag_ms_upper_bound": None if p99 is None else round(p99 * 1000, 3),
+    }
+
+
+def start_engine(port: int, env: Dict[str, str]) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=ENGINE_DIR, env={**os.environ, **env},
+    )
+    deadline = time.monotonic() + 180
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"ai-engine exited with code {process.returncode}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health", timeout=2).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(1)
+    process.terminate()
+    raise RuntimeError("ai-engine did not become healthy in time")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ENGINE_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+
+    conn = psycopg2.connect(args.database_url)
+    try:
+        user_ids = seeding.seeded_user_ids(conn, args.max_users)
+        if len(user_ids) < args.seed_users:
+            seeding.seed(conn, args.seed_users - len(user_ids), args.transactions_per_user, 6, rng)
+            user_ids = seeding.seeded_user_ids(conn, args.max_users)
+    finally:
+        conn.close()
+    if not user_ids:
+        raise SystemExit("No seeded users; pass --seed-users N")
+
+    results = {}
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.request_timeout, limits=limits) as client:
+        for endpoint in args.endpoints:
+            print(f"⏱️ {endpoint}: {args.concurrency} concurrent for {args.duration}s", file=sys.stderr)
+            results[endpoint] = await run_phase(client, endpoint, user_ids, args.concurrency, args.duration,
+                                                args.warmup_requests, rng)
+        stages = parse_metrics((await client.get("/metrics")).text)
+
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "config": {
+            "base_url": args.base_url,
+            "concurrency": args.concurrency,
+            "duration_seconds": args.duration,
+            "users": len(user_ids),
+            "stub_ollama": {"latency_ms": args.ollama_latency_ms, "tokens_per_second": args.ollama_tokens_per_second}
+            if args.start_stubs else None,
+            "stub_weaviate": {"latency_ms": args.weaviate_latency_ms} if args.start_stubs else None,
+        },
+        "endpoints": results,
+        "stage_seconds_total": {
+            key.split('stage="')[1].rstrip('"}'): round(value, 3)
+            for key, value in stages.items() if key.startswith("finguru_stage_duration_seconds_sum")
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--endpoints", type=lambda s: s.split(","), default=ENDPOINTS,
+                        help=f"comma-separated subset of {','.join(ENDPOINTS)}")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per endpoint")
+    parser.add_argument("--warmup-requests", type=int, default=3)
+    parser.add_argument("--request-timeout", type=float, default=120.0)
+    parser.add_argument("--seed-users", type=int, default=0, help="seed until at least this many users exist")
+    parser.add_argument("--transactions-per-user", type=int, default=200)
+    parser.add_argument("--max-users", type=int, default=1000, help="seeded users to spread requests over")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--start-stubs", action="store_true", help="serve stub Ollama and Weaviate in-process")
+    parser.add_argument("--ollama-port", type=int, default=11435)
+    parser.add_argument("--ollama-latency-ms", type=float, default=200.0)
+    parser.add_argument("--ollama-tokens-per-second", type=float, default=40.0)
+    parser.add_argument("--weaviate-port", type=int, default=8089)
+    parser.add_argument("--weaviate-latency-ms", type=float, default=10.0)
+    parser.add_argument("--start-engine", action="store_true", help="launch the ai-engine pointed at the stubs")
+    parser.add_argument("--engine-port", type=int, default=8765)
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    unknown = set(args.endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+
+    if args.start_stubs:
+        serve_in_thread(create_ollama_app(args.ollama_latency_ms, args.ollama_tokens_per_second), args.ollama_port)
+        serve_in_thread(create_weaviate_app(args.weaviate_latency_ms), args.weaviate_port)
+
+    engine = None
+    if args.start_engine:
+        engine = start_engine(args.engine_port, {
+            "DATABASE_URL": args.database_url,
+            "OLLAMA_URL": f"http://127.0.0.1:{args.ollama_port}",
+            "WEAVIATE_URL": f"http://127.0.0.1:{args.weaviate_port}",
+        })
+        args.base_url = f"http://127.0.0.1:{args.engine_port}"
+
+    try:
+        report = asyncio.run(run(args))
+    finally:
+        if engine:
+            engine.terminate()
+            engine.wait(timeout=30)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Seed Postgres with synthetic users, accounts, transactions, budgets and rollups for load tests.
+
+Expects the Prisma schema to be applied already. Seeded users share an email
+domain so they can be removed again with --reset.
+
+    python -m benchmarks.seed --users 200 --transactions-per-user 300
+"""
+import argparse
+import os
+import random
+import uuid
+from datetime import date, timedelta
+from typing import List
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+SEED_EMAIL_DOMAIN = "bench.finguru.local"
+
+CATEGORY_MERCHANTS = {
+    "Food & Dining": ["Starbucks", "Chipotle", "McDonald's", "Sweetgreen"],
+    "Groceries": ["Whole Foods", "Trader Joe's", "Kroger"],
+    "Transportation": ["Uber", "Lyft", "Shell", "Chevron"],
+    "Shopping": ["Amazon", "Target", "Best Buy"],
+    "Entertainment": ["Netflix", "Spotify", "AMC Theatres"],
+    "Bills & Utilities": ["Comcast", "Verizon", "PG&E"],
+    "Housing": ["Greystar Rent"],
+    "Healthcare": ["CVS Pharmacy", "Planet Fitness"],
+}
+BUDGET_LIMITS = {"Food & Dining": 400, "Groceries": 600, "Transportation": 250, "Shopping": 300, "Entertainment": 100}
+
+
+def seed(conn, users: int, transactions_per_user: int, months: int, rng: random.Random) -> List[str]:
+    today = date.today()
+    this_month = today.replace(day=1)
+    user_ids = []
+
+    with conn.cursor() as cursor:
+        for _ in range(users):
+            user_id = str(uuid.uuid4())
+            account_id = str(uuid.uuid4())
+            user_ids.append(user_id)
+
+            cursor.execute("""
+                INSERT INTO users (id, email, password_hash, first_name, last_name, updated_at)
+                VALUES (%s, %s, 'x', 'Bench', 'User', NOW())
+            """, (user_id, f"{user_id}@{SEED_EMAIL_DOMAIN}"))
+            cursor.execute("""
+                INSERT INTO accounts (id, user_id, institution_name, account_type, balance, updated_at)
+                VALUES (%s, %s, 'Bench Bank', 'checking', %s, NOW())
+            """, (account_id, user_id, round(rng.uniform(500, 20000), 2)))
+
+            rows = []
+            for i in range(transactions_per_user):
+                txn_date = today - timedelta(days=rng.randint(0, months * 30))
+                # Roughly one paycheck for every fifteen purchases
+                if i % 15 == 0:
+                    category, merchant, amount = "Income", "Employer Payroll", round(rng.uniform(1500, 4000), 2)
+                else:
+                    category = rng.choice(list(CATEGORY_MERCHANTS))
+                    merchant = rng.choice(CATEGORY_MERCHANTS[category])
+                    amount = -round(rng.uniform(3, 180), 2)
+                rows.append((str(uuid.uuid4()), account_id, user_id, amount, merchant, category, txn_date,
+                             f"{merchant} purchase", category, amount, txn_date.replace(day=1)))
+
+            execute_values(cursor, """
+                INSERT INTO transactions (id, account_id, user_id, amount, merchant_name, category,
+                                          transaction_date, description, embedding_synced, rollup_category, rollup_amount,
+                                          rollup_month)
+                VALUES %s
+            """, rows, template="(%s, %s, %s, %s, %s, %s, %s, %s, TRUE, %s, %s, %s)")
+
+            execute_values(cursor, """
+                INSERT INTO budgets (id, user_id, category, monthly_limit, month, updated_at)
+                VALUES %s
+            """, [(str(uuid.uuid4()), user_id, category, limit, this_month) for category, limit in BUDGET_LIMITS.items()],
+                template="(%s, %s, %s, %s, %s, NOW())")
+
+        # Same aggregation the transaction processor's rollup rebuild performs
+        cursor.execute("""
+            INSERT INTO monthly_spending_rollups (user_id, month, category, total_spent, total_income, transaction_count, updated_at)
+            SELECT user_id, rollup_month, rollup_category,
+                   SUM(CASE WHEN rollup_amount < 0 THEN -rollup_amount ELSE 0 END),
+                   SUM(CASE WHEN rollup_amount > 0 THEN rollup_amount ELSE 0 END),
+                   COUNT(*), NOW()
+            FROM transactions
+            WHERE user_id = ANY(%s)
+            GROUP BY 1, 2, 3
+        """, (user_ids,))
+        cursor.execute("""
+            UPDATE budgets b SET current_spend = r.total_spent
+            FROM monthly_spending_rollups r
+            WHERE b.user_id = ANY(%s) AND r.user_id = b.user_id AND r.month = b.month AND r.category = b.category
+        """, (user_ids,))
+
+    conn.commit()
+    return user_ids
+
+
+def seeded_user_ids(conn, limit: int = None) -> List[str]:
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT id FROM users WHERE email LIKE %s ORDER BY id LIMIT %s",
+                       (f"%@{SEED_EMAIL_DOMAIN}", limit))
+        return [row[0] for row in cursor.fetchall()]
+
+
+def reset(conn):
+    """Remove seeded users; dependent rows cascade"""
+    with conn.cursor() as cursor:
+        cursor.execute("DELETE FROM users WHERE email LIKE %s", (f"%@{SEED_EMAIL_DOMAIN}",))
+        deleted = cursor.rowcount
+    conn.commit()
+    return deleted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--transactions-per-user", type=int, default=200)
+    parser.add_argument("--months", type=int, default=6)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reset", action="store_true", help="delete previously seeded users first")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.database_url)
+    try:
+        if args.reset:
+            print(f"🗑️ Removed {reset(conn)} seeded users")
+        user_ids = seed(conn, args.users, args.transactions_per_user, args.months, random.Random(args.seed))
+        print(f"✅ Seeded {len(user_ids)} users with {args.transactions_per_user} transactions each")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Stand-ins for Ollama and Weaviate so the ai-engine can be load-tested without a GPU or a vector database.
+
+    python -m benchmarks.stubs ollama --port 11435 --latency-ms 200 --tokens-per-second 40
+    python -m benchmarks.stubs weaviate --port 8089 --latency-ms 15
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+from datetime import date, timedelta
+from typing import Any, Dict, List
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+CATEGORIES = ["Food & Dining", "Groceries", "Transportation", "Shopping", "Entertainment", "Bills & Utilities"]
+MERCHANTS = ["Starbucks", "Whole Foods", "Uber", "Amazon", "Netflix", "Comcast", "Chipotle", "Shell", "Target"]
+VECTOR_DIMENSIONS = 384  # all-MiniLM-L6-v2
+
+FILLER = ("Based on your recent transactions your spending is on track this month, "
+          "with dining and shopping as the largest categories. ").split()
+
+
+def create_ollama_app(latency_ms: float = 200.0, tokens_per_second: float = 40.0, completion_tokens: int = 80) -> FastAPI:
+    """Ollama-compatible /api/generate (streaming and not) with configurable prompt latency and token rate"""
+    app = FastAPI(title="Stub Ollama")
+
+    def completion(prompt: str) -> List[str]:
+        # SQL-generation prompts get a valid query so the SQL path is exercised end to end
+        if "Generate a PostgreSQL query" in prompt:
+            match = re.search(r"User ID: (\S+)", prompt)
+            user_id = match.group(1) if match else ""
+            sql = (f"SELECT category, SUM(amount) AS total FROM transactions "
+                   f"WHERE user_id = '{user_id}' GROUP BY category ORDER BY total LIMIT 10")
+            return sql.split(" ")
+        return [FILLER[i % len(FILLER)] for i in range(completion_tokens)]
+
+    def body(model: str, prompt: str, text: str, eval_count: int, started: float) -> Dict[str, Any]:
+        return {
+            "model": model,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "response": text,
+            "done": True,
+            "total_duration": int((time.monotonic() - started) * 1e9),
+            "prompt_eval_count": max(1, len(prompt) // 4),
+            "eval_count": eval_count,
+        }
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": "llama3.1:8b"}, {"name": "llama3.2:3b"}]}
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        payload = await request.json()
+        started = time.monotonic()
+        model = payload.get("model", "")
+        prompt = payload.get("prompt", "")
+        tokens = completion(prompt)
+
+        await asyncio.sleep(latency_ms / 1000.0)
+
+        if not payload.get("stream", True):
+            await asyncio.sleep(len(tokens) / tokens_per_second)
+            return body(model, prompt, " ".join(tokens), len(tokens), started)
+
+        async def stream():
+            for token in tokens:
+                await asyncio.sleep(1.0 / tokens_per_second)
+                yield json.dumps({"model": model, "response": token + " ", "done": False}) + "\n"
+            yield json.dumps(body(model, prompt, "", len(tokens), started)) + "\n"
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    return app
+
+
+def create_weaviate_app(latency_ms: float = 10.0, objects_per_user: int = 200) -> FastAPI:
+    """Enough of Weaviate's REST and GraphQL API for the v3 client: readiness, meta, schema and Get queries"""
+    app = FastAPI(title="Stub Weaviate")
+    classes: List[Dict[str, Any]] = []
+
+    def user_objects(user_id: str, limit: int, with_vector: bool) -> List[Dict[str, Any]]:
+        rng = random.Random(user_id)
+        today = date.today()
+        objects = []
+        for i in range(min(limit, objects_per_user)):
+            obj = {
+                "transaction_id": f"{user_id}-{i}",
+                "merchant_name": rng.choice(MERCHANTS),
+                "category": rng.choice(CATEGORIES),
+                "amount": -round(rng.uniform(3, 250), 2),
+                "transaction_date": (today - timedelta(days=rng.randint(0, 180))).isoformat(),
+                "description": "synthetic transaction",
+            }
+            if with_vector:
+                obj["_additional"] = {"vector": [rng.uniform(-1, 1) for _ in range(VECTOR_DIMENSIONS)]}
+            objects.append(obj)
+        return objects
+
+    @app.get("/v1/.well-known/ready")
+    @app.get("/v1/.well-known/live")
+    async def ready():
+        return JSONResponse({})
+
+    @app.get("/v1/meta")
+    async def meta():
+        return {"hostname": "http://[::]:8080", "modules": {}, "version": "1.23.0"}
+
+    @app.get("/v1/schema")
+    async def get_schema():
+        return {"classes": classes}
+
+    @app.post("/v1/schema")
+    async def create_class(request: Request):
+        schema = await request.json()
+        classes.append(schema)
+        return schema
+
+    @app.post("/v1/graphql")
+    async def graphql(request: Request):
+        query = (await request.json()).get("query", "")
+        await asyncio.sleep(latency_ms / 1000.0)
+
+        class_match = re.search(r"Get\s*\{\s*(\w+)", query)
+        user_match = re.search(r'valueString:\s*"([^"]*)"', query)
+        limit_match = re.search(r"limit:\s*(\d+)", query)
+        class_name = class_match.group(1) if class_match else "Transaction"
+        objects = user_objects(
+            user_match.group(1) if user_match else "anonymous",
+            int(limit_match.group(1)) if limit_match else 25,
+            with_vector="vector" in query,
+        )
+        return {"data": {"Get": {class_name: objects}}}
+
+    return app
+
+
+def serve_in_thread(app: FastAPI, port: int, host: str = "127.0.0.1") -> uvicorn.Server:
+    """Run an app on a background thread; returns once it accepts connections"""
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("service", choices=["ollama", "weaviate"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--latency-ms", type=float, default=None)
+    parser.add_argument("--tokens-per-second", type=float, default=40.0)
+    parser.add_argument("--completion-tokens", type=int, default=80)
+    args = parser.parse_args()
+
+    if args.service == "ollama":
+        app = create_ollama_app(200.0 if args.latency_ms is None else args.latency_ms, args.tokens_per_second, args.completion_tokens)
+    else:
+        app = create_weaviate_app(10.0 if args.latency_ms is None else args.latency_ms)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
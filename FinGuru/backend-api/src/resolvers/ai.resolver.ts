@@ -12,14 +12,19 @@ export const aiResolver = {
         const response = await axios.post(`${AI_ENGINE_URL}/chat`, {
           user_id: context.user.userId,
           message: args.message,
+          // The AI engine keeps the conversation; clients send back the id it returns
+          conversation_id: args.conversationId || undefined,
+          start_conversation: Boolean(args.startConversation),
         });
         
         return {
           answer: response.data.answer,
           confidence: response.data.confidence || 0.95,
           sources: response.data.sources || [],
+          conversationId: response.data.conversation_id || null,
         };
-      } catch (error) {
+      } catch (error: any) {
+        if (error.response?.status === 404) throw new Error('Conversation not found');
         console.error('AI Engine error:', error);
         throw new Error('Failed to process AI request');
       }
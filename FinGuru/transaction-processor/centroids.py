@@ -0,0 +1,184 @@
+"""
+Nearest-centroid fallback for transactions the keyword rules leave as "Other".
+
+Each (category, subcategory) seen in already-categorized transactions gets a
+centroid: the normalized mean embedding of its recent rows. The centroids
+are one small float32 matrix saved with their labels to CENTROIDS_PATH
+(.npz), and a batch of uncategorized rows is scored with a single matrix
+multiply. The worker rebuilds them periodically; to build by hand:
+
+    python centroids.py build [--per-subcategory 200] [--min-rows 10]
+"""
+import argparse
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+CENTROIDS_PATH = os.getenv("CENTROIDS_PATH", "category_centroids.npz")
+
+# The most recent rows per subcategory; older spending patterns matter less.
+# Rows the centroids labelled themselves are left out so they don't reinforce their own mistakes.
+CENTROID_SAMPLE_SQL = """
+    SELECT category, subcategory, merchant_name, description, amount
+    FROM (
+        SELECT category, subcategory, merchant_name, description, amount,
+               ROW_NUMBER() OVER (PARTITION BY category, subcategory ORDER BY transaction_date DESC) AS rn
+        FROM transactions
+        WHERE category IS NOT NULL AND category <> 'Other'
+          AND subcategory IS NOT NULL AND subcategory <> ''
+          AND category_source IS DISTINCT FROM 'centroid'
+    ) recent
+    WHERE rn <= %s
+"""
+
+ENCODE_BATCH_SIZE = 256
+
+
+class CentroidCategorizer:
+    """Assigns the closest subcategory centroid when it is similar enough"""
+
+    def __init__(self, path: str = CENTROIDS_PATH, min_similarity: float = 0.5):
+        self.path = path
+        self.min_similarity = min_similarity
+        self.centroids: Optional[np.ndarray] = None
+        self.labels: List[Tuple[str, str]] = []
+        self.built_at: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.centroids is not None
+
+    def load(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        try:
+            data = np.load(self.path)
+            self._swap(data["centroids"], list(zip(data["categories"].tolist(), data["subcategories"].tolist())),
+                       float(data["built_at"]))
+        except Exception as e:
+            print(f"⚠️ Could not load category centroids from {self.path}: {e}")
+            return False
+        print(f"✅ Loaded {len(self.labels)} category centroids from {self.path}")
+        return True
+
+    def classify_batch(self, vectors: Sequence[np.ndarray]) -> List[Optional[Tuple[str, str, float]]]:
+        """(category, subcategory, similarity) per vector, or None below min_similarity"""
+        centroids, labels = self.centroids, self.labels
+        if centroids is None or len(vectors) == 0:
+            return [None] * len(vectors)
+
+        similarities = _normalize(np.asarray(vectors, dtype=np.float32)) @ centroids.T
+        best = similarities.argmax(axis=1)
+        scores = similarities[np.arange(len(best)), best]
+        return [
+            (*labels[i], round(float(score), 3)) if score >= self.min_similarity else None
+            for i, score in zip(best, scores)
+        ]
+
+    def build(self, conn, encode: Callable[[List[str]], np.ndarray], text_for: Callable[[Dict], str],
+              per_subcategory: int = 200, min_rows: int = 10) -> int:
+        """Recompute centroids from categorized transactions, save them and start using them"""
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(CENTROID_SAMPLE_SQL, (per_subcategory,))
+            rows = cursor.fetchall()
+
+        groups: Dict[Tuple[str, str], List[Dict]] = defaultdict(list)
+        for row in rows:
+            groups[(row['category'], row['subcategory'])].append(row)
+        groups = {label: members for label, members in groups.items() if len(members) >= min_rows}
+        if not groups:
+            print("⚠️ Not enough categorized transactions to build centroids")
+            return 0
+
+        labels = sorted(groups)
+        centroids = []
+        for label in labels:
+            texts = [text_for(row) for row in groups[label]]
+            vectors = np.concatenate([
+                np.asarray(encode(texts[i:i + ENCODE_BATCH_SIZE]), dtype=np.float32)
+                for i in range(0, len(texts), ENCODE_BATCH_SIZE)
+            ])
+            centroids.append(_normalize(vectors).mean(axis=0))
+        matrix = _normalize(np.stack(centroids))
+
+        built_at = time.time()
+        self._save(matrix, labels, built_at)
+        self._swap(matrix, labels, built_at)
+        print(f"✅ Built {len(labels)} category centroids from {len(rows)} transactions")
+        return len(labels)
+
+    def _save(self, matrix: np.ndarray, labels: List[Tuple[str, str]], built_at: float):
+        # Write then rename so a crash never leaves a half-written file behind
+        tmp_path = f"{self.path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            centroids=matrix,
+            categories=np.array([c for c, _ in labels]),
+            subcategories=np.array([s for _, s in labels]),
+            built_at=np.array(built_at),
+        )
+        os.replace(tmp_path, self.path)
+
+    def _swap(self, matrix: np.ndarray, labels: List[Tuple[str, str]], built_at: float):
+        # Readers take self.centroids and self.labels together; assign labels first so a
+        # concurrent reader never indexes a new matrix with old labels
+        self.labels = labels
+        self.centroids = matrix.astype(np.float32)
+        self.built_at = built_at
+
+
+class CentroidRefresher(threading.Thread):
+    """Rebuilds the centroids from the database every interval_seconds"""
+
+    def __init__(self, categorizer: CentroidCategorizer, rebuild: Callable[[], int], interval_seconds: float):
+        super().__init__(name="centroid-refresher", daemon=True)
+        self.categorizer = categorizer
+        self.rebuild = rebuild
+        self.interval_seconds = interval_seconds
+
+    def run(self):
+        next_run = (self.categorizer.built_at or 0) + self.interval_seconds
+        while True:
+            time.sleep(max(0.0, next_run - time.time()))
+            try:
+                self.rebuild()
+                # Scheduled from the attempt, not built_at: a build with too little data leaves built_at unset
+                next_run = time.time() + self.interval_seconds
+            except Exception as e:
+                print(f"⚠️ Centroid rebuild failed: {e}")
+                next_run = time.time() + min(self.interval_seconds, 300)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    build_parser = sub.add_parser("build", help="rebuild the centroids from categorized transactions")
+    build_parser.add_argument("--per-subcategory", type=int, default=200)
+    build_parser.add_argument("--min-rows", type=int, default=10)
+    args = parser.parse_args()
+
+    # The worker owns the embedding model and the text the vectors are built from
+    from worker import TransactionProcessor
+
+    processor = TransactionProcessor()
+    conn = psycopg2.connect(DATABASE_URL)
+    try:
+        processor.rebuild_centroids(conn, per_subcategory=args.per_subcategory, min_rows=args.min_rows)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
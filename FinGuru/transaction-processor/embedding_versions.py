@@ -0,0 +1,533 @@
+"""
+Versioned transaction embeddings: shadow class builds and atomic cutover.
+
+An embedding version is an embedding model plus the version of the text the
+worker embeds (EMBEDDING_TEXT_VERSION in worker.py), and each version lives
+in its own Weaviate class. The embedding_versions table records which
+version is active (the one the ai-engine searches) and which, if any, is
+building. While a version builds, the worker writes every transaction to
+both classes and the build job backfills the shadow class from Postgres.
+To switch models or the embedding text:
+
+    1. python embedding_versions.py start --model all-mpnet-base-v2
+    2. python embedding_versions.py build [--max-rate 500] [--batch-size 256]
+    3. python embedding_versions.py status              progress, rate and ETA
+    4. python embedding_versions.py cutover             readers switch right away
+    5. python embedding_versions.py drop <version>      once the old class is no longer needed
+
+`start --dims 128` makes a compact version: a PCA projection is fitted on a
+sample of our transactions and stored with the version, and `--pq` turns on
+Weaviate product quantization for its class once the backfill completes.
+Both are part of the version id, so `start --pq` on the active model makes a
+new version rather than colliding with the active one.
+Measure the trade-off first with evaluate_compact.py.
+
+The build can be stopped and resumed. Objects are keyed by transaction id,
+so a re-run or a live write to the same transaction overwrites rather than
+duplicates.
+"""
+import argparse
+import hashlib
+import os
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import psycopg2
+from psycopg2.extras import RealDictCursor
+import weaviate
+from weaviate.util import generate_uuid5
+
+import tenants
+from projection import Projection, default_pq_segments, pq_config
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+WEAVIATE_URL = os.getenv("WEAVIATE_URL", "http://weaviate:8080")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+
+# The ai-engine listens here and switches classes on cutover
+CHANNEL = "embedding_version"
+SOURCE_CLASS = "Transaction"
+
+# Vectors written before versioning: the default model with the first embedding text
+LEGACY_TEXT_VERSION = 1
+
+# How long a worker may keep writing to the old set of versions after start
+REGISTRY_TTL_SECONDS = 30.0
+
+WRITE_TARGETS_SQL = """
+    SELECT id, model, text_version, class_name, status, projection
+    FROM embedding_versions
+    WHERE status IN ('active', 'building')
+    ORDER BY status
+"""
+
+# Keyset pages over every transaction; ids are UUID strings, so text order is stable
+BACKFILL_PAGE_SQL = """
+    SELECT id, user_id, merchant_name, category, subcategory, amount, transaction_date, description
+    FROM transactions
+    WHERE %s::text IS NULL OR id > %s
+    ORDER BY id
+    LIMIT %s
+"""
+
+FIT_SAMPLE_SQL = """
+    SELECT merchant_name, category, subcategory, amount, description
+    FROM transactions
+    ORDER BY random()
+    LIMIT %s
+"""
+
+ENCODE_BATCH_SIZE = 256
+
+# Objects Weaviate rejects in a backfill batch are retried this many times before the build stops
+BATCH_ATTEMPTS = 3
+
+
+@dataclass(frozen=True)
+class EmbeddingVersion:
+    """One embedding model and text version and the Weaviate class holding its vectors"""
+    id: str
+    model: str
+    text_version: int
+    class_name: str
+    status: str = "active"
+    # Compact versions store projected vectors
+    projection: Optional[Projection] = field(default=None, compare=False, repr=False)
+
+    def project(self, vectors: np.ndarray) -> np.ndarray:
+        return vectors if self.projection is None else self.projection.apply(vectors)
+
+
+def version_id(model: str, text_version: int, projection: Optional[Projection] = None,
+               pq_segments: Optional[int] = None) -> str:
+    suffix = f":pca{projection.dims}-{projection.fingerprint()}" if projection else ""
+    if pq_segments:
+        suffix += f":pq{pq_segments}"
+    return f"{model}:t{text_version}{suffix}"
+
+
+def source_class() -> str:
+    return tenants.TENANT_CLASS if tenants.enabled() else SOURCE_CLASS
+
+
+def class_name_for(version: str) -> str:
+    """Weaviate class names allow only letters, digits and underscores, so versions get a hash suffix"""
+    return f"{source_class()}_{hashlib.sha1(version.encode('utf-8')).hexdigest()[:10]}"
+
+
+def legacy_version() -> EmbeddingVersion:
+    """The pre-versioning class, active until the first cutover"""
+    return EmbeddingVersion(version_id(EMBEDDING_MODEL, LEGACY_TEXT_VERSION), EMBEDDING_MODEL,
+                            LEGACY_TEXT_VERSION, source_class())
+
+
+class VersionRegistry:
+    """The versions the worker writes to (active first, then building), re-read every ttl_seconds"""
+
+    def __init__(self, connect: Callable[[], Any], ttl_seconds: float = REGISTRY_TTL_SECONDS):
+        self.connect = connect
+        self.ttl_seconds = ttl_seconds
+        self._targets: List[EmbeddingVersion] = [legacy_version()]
+        self._projections: Dict[str, Projection] = {}
+        self._loaded_at = float("-inf")
+
+    def targets(self) -> List[EmbeddingVersion]:
+        if time.monotonic() - self._loaded_at >= self.ttl_seconds:
+            try:
+                self._targets = self._load()
+            except Exception as e:
+                # Keep writing to the last known versions rather than stop embedding
+                print(f"⚠️ Could not read embedding versions: {e}")
+            self._loaded_at = time.monotonic()
+        return self._targets
+
+    def _load(self) -> List[EmbeddingVersion]:
+        conn = self.connect()
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(WRITE_TARGETS_SQL)
+                rows = cursor.fetchall()
+        finally:
+            conn.close()
+
+        versions = []
+        for row in rows:
+            data = row.pop('projection')
+            if data is not None and row['id'] not in self._projections:
+                self._projections[row['id']] = Projection.from_bytes(bytes(data))
+            versions.append(EmbeddingVersion(**row, projection=self._projections.get(row['id'])))
+        if not any(v.status == "active" for v in versions):
+            versions.insert(0, legacy_version())
+        return versions
+
+
+def write_object(client, version: EmbeddingVersion, user_id: str, data_object: Dict[str, Any],
+                 vector: List[float], uuid: str):
+    """Create or overwrite one transaction's object in a version's class"""
+    data_object = {**data_object, "embedding_version": version.id}
+    tenant = user_id if tenants.enabled() else None
+    try:
+        if tenant:
+            tenants.create_object(client, user_id, data_object, vector, uuid=uuid, class_name=version.class_name)
+        else:
+            client.data_object.create(data_object=data_object, class_name=version.class_name, uuid=uuid, vector=vector)
+    except Exception as e:
+        # The build job or an earlier write got there first
+        if "already exists" not in str(e).lower():
+            raise
+        client.data_object.replace(data_object=data_object, class_name=version.class_name, uuid=uuid,
+                                   vector=vector, tenant=tenant)
+
+
+def object_uuid(transaction_id: Any) -> str:
+    return generate_uuid5(str(transaction_id))
+
+
+def _rejected_objects(results) -> Dict[str, str]:
+    """uuid -> error message for every object a Weaviate batch rejected"""
+    rejected = {}
+    for result in results or []:
+        errors = (result.get("result") or {}).get("errors")
+        if errors:
+            rejected[result.get("id")] = "; ".join(e.get("message", "") for e in errors.get("error", [])) or str(errors)
+    return rejected
+
+
+def fit_projection(conn, processor, model: str, dims: int, sample: int = 20000) -> Projection:
+    """PCA over a random sample of transactions, embedded the way the worker embeds them"""
+    with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        cursor.execute(FIT_SAMPLE_SQL, (sample,))
+        rows = cursor.fetchall()
+    embedder = processor.embedder_for(model)
+    texts = [processor._build_embedding_text(row) for row in rows]
+    vectors = np.concatenate([
+        np.asarray(embedder.encode(texts[i:i + ENCODE_BATCH_SIZE]), dtype=np.float32)
+        for i in range(0, len(texts), ENCODE_BATCH_SIZE)
+    ])
+    projection = Projection.fit(vectors, dims)
+    print(f"✅ Fitted a {projection.source_dims}->{dims} projection on {len(rows)} transactions "
+          f"({projection.explained_variance:.1%} of variance kept)")
+    return projection
+
+
+def start(conn, client, processor, model: str, text_version: int, dims: Optional[int] = None,
+          pq_segments: Optional[int] = None, fit_sample: int = 20000) -> Optional[EmbeddingVersion]:
+    """Create the shadow class for a new version and register it as building"""
+    with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        cursor.execute("SELECT id, status FROM embedding_versions WHERE status IN ('active', 'building')")
+        current = {row['status']: row['id'] for row in cursor.fetchall()}
+    if current.get("building"):
+        print(f"❌ {current['building']} is already building; drop it first")
+        return None
+
+    # Load the model before anything is registered, so a bad model name fails here
+    processor.embedder_for(model).encode(["embedding version probe"])
+
+    projection = fit_projection(conn, processor, model, dims, fit_sample) if dims else None
+    vid = version_id(model, text_version, projection, pq_segments)
+    version = EmbeddingVersion(vid, model, text_version, class_name_for(vid), "building", projection)
+    if current.get("active", legacy_version().id) == version.id:
+        print(f"❌ {version.id} is already active")
+        return None
+
+    from worker import transaction_schema
+
+    existing = {c['class'] for c in client.schema.get().get('classes', [])}
+    if version.class_name not in existing:
+        schema = transaction_schema(version.class_name)
+        client.schema.create_class(tenants.tenant_schema(schema, version.class_name) if tenants.enabled() else schema)
+        print(f"✅ Weaviate class {version.class_name} created")
+
+    legacy = legacy_version()
+    with conn.cursor() as cursor:
+        # Record the pre-versioning class as active so cutover has something to retire
+        cursor.execute("""
+            INSERT INTO embedding_versions (id, model, text_version, class_name, status, activated_at, updated_at)
+            SELECT %s, %s, %s, %s, 'active', NOW(), NOW()
+            WHERE NOT EXISTS (SELECT 1 FROM embedding_versions WHERE status = 'active')
+            ON CONFLICT (id) DO NOTHING
+        """, (legacy.id, legacy.model, legacy.text_version, legacy.class_name))
+        cursor.execute("""
+            INSERT INTO embedding_versions
+                (id, model, text_version, class_name, status, projection, pq_segments, started_at, updated_at)
+            VALUES (%s, %s, %s, %s, 'building', %s, %s, NOW(), NOW())
+            ON CONFLICT (id) DO UPDATE SET
+                status = 'building', class_name = EXCLUDED.class_name, projection = EXCLUDED.projection,
+                pq_segments = EXCLUDED.pq_segments, started_at = NOW(), updated_at = NOW(),
+                backfill_cursor = NULL, objects_done = 0, objects_total = 0, rate_per_second = NULL,
+                backfill_completed_at = NULL, activated_at = NULL
+        """, (version.id, version.model, version.text_version, version.class_name,
+              psycopg2.Binary(projection.to_bytes()) if projection else None, pq_segments))
+    conn.commit()
+    print(f"✅ {version.id} registered as building; workers start dual-writing within {REGISTRY_TTL_SECONDS:.0f}s")
+    return version
+
+
+def build(conn, client, processor, max_rate: float = 0, batch_size: int = 256, restart: bool = False) -> int:
+    """
+    Backfill the building version's class from Postgres.
+
+    Batches are embedded in one forward pass and written with the Weaviate
+    batch API. max_rate (objects per second, 0 for no limit) keeps the job
+    from starving live traffic of CPU and Weaviate write capacity. Progress
+    is saved after every batch, so a stopped build resumes where it left off.
+    """
+    with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        cursor.execute("""
+            SELECT id, model, text_version, class_name, projection, pq_segments, backfill_cursor, objects_done,
+                   EXTRACT(EPOCH FROM NOW() - started_at) AS age_seconds
+            FROM embedding_versions WHERE status = 'building'
+        """)
+        row = cursor.fetchone()
+        cursor.execute("SELECT COUNT(*) AS total FROM transactions")
+        total = cursor.fetchone()['total']
+    if row is None:
+        print("❌ No version is building; run start first")
+        return 0
+
+    from worker import EMBEDDING_TEXT_VERSION
+
+    projection = Projection.from_bytes(bytes(row['projection'])) if row['projection'] is not None else None
+    version = EmbeddingVersion(row['id'], row['model'], row['text_version'], row['class_name'], "building", projection)
+    if version.text_version != EMBEDDING_TEXT_VERSION:
+        print(f"❌ {version.id} needs text version {version.text_version}; this worker builds {EMBEDDING_TEXT_VERSION}")
+        return 0
+    # Transactions written before every worker saw the new version only reach it through this backfill
+    wait = REGISTRY_TTL_SECONDS - float(row['age_seconds'] or 0)
+    if wait > 0:
+        print(f"⏳ Waiting {wait:.0f}s for workers to start dual-writing")
+        time.sleep(wait)
+
+    embedder = processor.embedder_for(version.model)
+    after = None if restart else row['backfill_cursor']
+    done = 0 if restart else row['objects_done']
+    known = set(tenants.existing_tenants(client, version.class_name)) if tenants.enabled() else set()
+    written = 0
+    started = time.monotonic()
+
+    while True:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(BACKFILL_PAGE_SQL, (after, after, batch_size))
+            rows = cursor.fetchall()
+        if not rows:
+            break
+
+        vectors = version.project(embedder.encode([processor._build_embedding_text(r) for r in rows]))
+
+        if tenants.enabled():
+            new_tenants = {r['user_id'] for r in rows} - known
+            if new_tenants:
+                tenants.add_tenants(client, new_tenants, version.class_name)
+                known |= new_tenants
+
+        # The cursor only moves past a page once every object in it is stored, so cutover never
+        # switches readers to a class with holes in it
+        pending = list(zip(rows, vectors))
+        for attempt in range(1, BATCH_ATTEMPTS + 1):
+            for r, vector in pending:
+                client.batch.add_data_object(
+                    data_object={**processor._build_weaviate_object(r, r['user_id']), "embedding_version": version.id},
+                    class_name=version.class_name,
+                    uuid=object_uuid(r['id']),
+                    vector=vector.tolist(),
+                    tenant=r['user_id'] if tenants.enabled() else None
+                )
+            rejected = _rejected_objects(client.batch.create_objects())
+            pending = [(r, vector) for r, vector in pending if object_uuid(r['id']) in rejected]
+            if not pending:
+                break
+            print(f"⚠️ Weaviate rejected {len(pending)} objects (attempt {attempt}/{BATCH_ATTEMPTS}): "
+                  f"{next(iter(rejected.values()))}")
+            time.sleep(2 ** attempt)
+        if pending:
+            print(f"❌ Build of {version.id} stopped at {done} objects; fix the errors above and run build again to resume")
+            return written
+
+        after = rows[-1]['id']
+        done += len(rows)
+        written += len(rows)
+
+        # Throttle: never run ahead of max_rate averaged over this run
+        if max_rate > 0:
+            ahead = written / max_rate - (time.monotonic() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+
+        rate = written / max(time.monotonic() - started, 1e-6)
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE embedding_versions
+                SET backfill_cursor = %s, objects_done = %s, objects_total = %s, rate_per_second = %s, updated_at = NOW()
+                WHERE id = %s
+            """, (after, done, total, rate, version.id))
+        conn.commit()
+        print(f"⏳ {version.id}: {_progress(done, total, rate)}")
+
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            UPDATE embedding_versions
+            SET backfill_completed_at = NOW(), objects_total = GREATEST(objects_total, objects_done), updated_at = NOW()
+            WHERE id = %s
+        """, (version.id,))
+    conn.commit()
+    print(f"✅ Backfill of {version.id} complete: {done} objects; run cutover to switch readers")
+
+    # PQ trains its codebooks on the vectors already in the index, so it is enabled once they are there
+    if row['pq_segments']:
+        client.schema.update_config(version.class_name, {"vectorIndexConfig": pq_config(row['pq_segments'])})
+        print(f"✅ Product quantization enabled on {version.class_name} ({row['pq_segments']} bytes per vector)")
+    return written
+
+
+def status(conn) -> List[Dict[str, Any]]:
+    with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        cursor.execute("""
+            SELECT id, class_name, status, pq_segments, objects_done, objects_total, rate_per_second,
+                   backfill_completed_at, activated_at, updated_at
+            FROM embedding_versions
+            WHERE status <> 'dropped'
+            ORDER BY updated_at DESC
+        """)
+        rows = cursor.fetchall()
+
+    if not rows:
+        print(f"{legacy_version().id} [active] {source_class()} (not yet registered)")
+    for row in rows:
+        line = f"{row['id']} [{row['status']}] {row['class_name']}"
+        if row['pq_segments']:
+            line += f" pq={row['pq_segments']}B"
+        if row['status'] == 'building':
+            progress = _progress(row['objects_done'], row['objects_total'], row['rate_per_second'] or 0)
+            line += " backfill complete" if row['backfill_completed_at'] else f" {progress}, updated {row['updated_at']}"
+        elif row['activated_at']:
+            line += f" activated {row['activated_at']}"
+        print(line)
+    return rows
+
+
+def cutover(conn, force: bool = False) -> bool:
+    """Make the building version active in one transaction and tell the ai-engine to switch"""
+    with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        cursor.execute("SELECT id, backfill_completed_at FROM embedding_versions WHERE status = 'building' FOR UPDATE")
+        row = cursor.fetchone()
+        if row is None:
+            conn.rollback()
+            print("❌ No version is building")
+            return False
+        if row['backfill_completed_at'] is None and not force:
+            conn.rollback()
+            print(f"❌ Backfill of {row['id']} has not finished; pass --force to switch anyway")
+            return False
+
+        cursor.execute("UPDATE embedding_versions SET status = 'retired', updated_at = NOW() WHERE status = 'active'")
+        cursor.execute("""
+            UPDATE embedding_versions SET status = 'active', activated_at = NOW(), updated_at = NOW()
+            WHERE id = %s
+        """, (row['id'],))
+        # Delivered on commit, together with the switch
+        cursor.execute("SELECT pg_notify(%s, %s)", (CHANNEL, row['id']))
+    conn.commit()
+    print(f"✅ {row['id']} is now active")
+    return True
+
+
+def drop(conn, client, version: str) -> bool:
+    """Delete a retired or building version's class; the active version can't be dropped"""
+    with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        cursor.execute("SELECT class_name, status FROM embedding_versions WHERE id = %s FOR UPDATE", (version,))
+        row = cursor.fetchone()
+        if row is None or row['status'] not in ('retired', 'building'):
+            conn.rollback()
+            print(f"❌ {version} is not a retired or building version")
+            return False
+        cursor.execute("UPDATE embedding_versions SET status = 'dropped', updated_at = NOW() WHERE id = %s", (version,))
+    # Stop the workers' dual writes before the class disappears under them
+    conn.commit()
+    time.sleep(REGISTRY_TTL_SECONDS)
+    client.schema.delete_class(row['class_name'])
+    print(f"🗑️ Dropped {version} ({row['class_name']})")
+    return True
+
+
+def _progress(done: int, total: int, rate: float) -> str:
+    percent = f" ({done / total:.0%})" if total else ""
+    eta = f", ETA {_duration((total - done) / rate)}" if rate > 0 and total > done else ""
+    return f"{done}/{total}{percent} at {rate:.0f}/s{eta}"
+
+
+def _duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m" if hours else f"{minutes}m{seconds:02d}s"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    start_parser = sub.add_parser("start", help="create the shadow class for a new version")
+    start_parser.add_argument("--model", default=EMBEDDING_MODEL)
+    start_parser.add_argument("--text-version", type=int, default=None,
+                              help="defaults to the worker's current EMBEDDING_TEXT_VERSION")
+    start_parser.add_argument("--dims", type=int, default=None, help="project vectors to this many PCA dimensions")
+    start_parser.add_argument("--fit-sample", type=int, default=20000, help="transactions to fit the projection on")
+    start_parser.add_argument("--pq", action="store_true", help="enable product quantization after the backfill")
+    start_parser.add_argument("--pq-segments", type=int, default=None,
+                              help="bytes per compressed vector; must divide the vector dimensions")
+    build_parser = sub.add_parser("build", help="backfill the building version")
+    build_parser.add_argument("--max-rate", type=float, default=float(os.getenv("REEMBED_MAX_RATE", "0")),
+                              help="objects per second, 0 for no limit")
+    build_parser.add_argument("--batch-size", type=int, default=256)
+    build_parser.add_argument("--restart", action="store_true", help="start over instead of resuming")
+    sub.add_parser("status", help="show versions with backfill progress, rate and ETA")
+    cutover_parser = sub.add_parser("cutover", help="switch readers to the building version")
+    cutover_parser.add_argument("--force", action="store_true")
+    drop_parser = sub.add_parser("drop", help="delete a retired or building version's class")
+    drop_parser.add_argument("version")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(DATABASE_URL)
+    try:
+        if args.command == "status":
+            status(conn)
+            return
+        if args.command == "cutover":
+            if not cutover(conn, force=args.force):
+                sys.exit(1)
+            return
+
+        client = weaviate.Client(url=WEAVIATE_URL)
+        if args.command == "drop":
+            if not drop(conn, client, args.version):
+                sys.exit(1)
+            return
+
+        # The worker owns the embedding models and the text the vectors are built from
+        from worker import EMBEDDING_TEXT_VERSION, TransactionProcessor
+
+        processor = TransactionProcessor()
+        if args.command == "start":
+            text_version = args.text_version or EMBEDDING_TEXT_VERSION
+            if text_version != EMBEDDING_TEXT_VERSION:
+                print(f"❌ This worker builds text version {EMBEDDING_TEXT_VERSION}, not {text_version}")
+                sys.exit(1)
+            pq_segments = None
+            if args.pq or args.pq_segments:
+                dims = args.dims or len(processor.embedder_for(args.model).encode(["dimension probe"])[0])
+                pq_segments = args.pq_segments or default_pq_segments(dims)
+                if dims % pq_segments:
+                    print(f"❌ --pq-segments must divide the vector dimensions ({dims})")
+                    sys.exit(1)
+            if start(conn, client, processor, args.model, text_version, dims=args.dims,
+                     pq_segments=pq_segments, fit_sample=args.fit_sample) is None:
+                sys.exit(1)
+        else:
+            build(conn, client, processor, max_rate=args.max_rate, batch_size=args.batch_size, restart=args.restart)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Recall versus memory for compact vector storage.
+
+Embeds a random sample of our transactions the way the worker does and
+compares each compact setting's top-k neighbours with exact search on the
+full vectors:
+
+    python evaluate_compact.py [--sample 20000] [--queries 500] [--k 10]
+                               [--dims 256 128 64] [--pq] [--queries-file questions.txt]
+
+Queries are held-out transactions, or real questions from --queries-file
+(one per line). The PCA projection is fitted on the rest of the sample, as
+`embedding_versions.py start --dims` does. With --pq every setting is also
+run through product quantization with default_pq_segments; the codebooks are
+trained here with k-means and scored without rescoring, so the recall is a
+lower bound for what Weaviate serves.
+
+Index memory is estimated from Weaviate's sizing rule of thumb: the vectors
+held in memory plus about 10 bytes per HNSW connection (maxConnections
+defaults to 64), for the full transactions table.
+"""
+import argparse
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from embedding_versions import EMBEDDING_MODEL, ENCODE_BATCH_SIZE, FIT_SAMPLE_SQL
+from projection import PQ_CENTROIDS, PQ_TRAINING_LIMIT, Projection, default_pq_segments
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+BYTES_PER_CONNECTION = 10
+
+
+class ProductQuantizer:
+    """Per-segment k-means codebooks with one-byte codes, as Weaviate's PQ stores vectors"""
+
+    def __init__(self, segments: int, centroids: int = PQ_CENTROIDS, iterations: int = 15, seed: int = 0):
+        self.segments = segments
+        self.centroids = centroids
+        self.iterations = iterations
+        self.rng = np.random.default_rng(seed)
+        # (segments, centroids, segment_dims)
+        self.codebooks: Optional[np.ndarray] = None
+
+    def fit(self, vectors: np.ndarray) -> "ProductQuantizer":
+        if len(vectors) > PQ_TRAINING_LIMIT:
+            vectors = vectors[self.rng.choice(len(vectors), PQ_TRAINING_LIMIT, replace=False)]
+        self.codebooks = np.stack([_kmeans(part, self.centroids, self.iterations, self.rng)
+                                   for part in self._split(vectors)])
+        return self
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = [np.argmin(-2 * part @ book.T + (book ** 2).sum(axis=1), axis=1)
+                 for part, book in zip(self._split(vectors), self.codebooks)]
+        return np.stack(codes, axis=1).astype(np.uint8)
+
+    def scores(self, queries: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """(queries, objects) dot products from per-segment lookup tables (asymmetric distance)"""
+        scores = np.zeros((len(queries), len(codes)), dtype=np.float32)
+        for s, (part, book) in enumerate(zip(self._split(queries), self.codebooks)):
+            scores += (part @ book.T)[:, codes[:, s]]
+        return scores
+
+    def _split(self, vectors: np.ndarray) -> List[np.ndarray]:
+        return np.split(np.asarray(vectors, dtype=np.float32), self.segments, axis=1)
+
+
+def _kmeans(vectors: np.ndarray, k: int, iterations: int, rng: np.random.Generator) -> np.ndarray:
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=len(vectors) < k)].copy()
+    for _ in range(iterations):
+        assignment = np.argmin(-2 * vectors @ centroids.T + (centroids ** 2).sum(axis=1), axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        counts = np.bincount(assignment, minlength=k)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1), axis=1)
+
+
+def _recall(found: np.ndarray, exact: np.ndarray) -> float:
+    return float(np.mean([len(set(f) & set(e)) / len(e) for f, e in zip(found, exact)]))
+
+
+def evaluate(corpus: np.ndarray, queries: np.ndarray, dims: List[int], k: int = 10, pq: bool = False,
+             objects: Optional[int] = None, max_connections: int = 64) -> List[Dict]:
+    """Recall@k and estimated index memory per setting, with full float32 vectors as the baseline"""
+    corpus = np.asarray(corpus, dtype=np.float32)
+    queries = np.asarray(queries, dtype=np.float32)
+    objects = objects or len(corpus)
+    k = min(k, len(corpus))
+    exact = _top_k(_normalize(queries) @ _normalize(corpus).T, k)
+    graph_bytes = max_connections * BYTES_PER_CONNECTION
+
+    results = []
+    source_dims = corpus.shape[1]
+    for d in sorted({source_dims, *[d for d in dims if 0 < d < source_dims]}, reverse=True):
+        projection = Projection.fit(corpus, d) if d < source_dims else None
+        stored = _normalize(projection.apply(corpus) if projection else corpus)
+        asked = _normalize(projection.apply(queries) if projection else queries)
+        name = f"pca{d}" if projection else f"full{d}"
+        settings = [(name, d * 4, _top_k(asked @ stored.T, k))]
+
+        if pq:
+            segments = default_pq_segments(d)
+            quantizer = ProductQuantizer(segments).fit(stored)
+            settings.append((f"{name}+pq{segments}", segments, _top_k(quantizer.scores(asked, quantizer.encode(stored)), k)))
+
+        for setting, vector_bytes, found in settings:
+            results.append({
+                "setting": setting,
+                "dims": d,
+                "explained_variance": round(projection.explained_variance, 4) if projection else 1.0,
+                "bytes_per_vector": vector_bytes,
+                "index_mb": round(objects * (vector_bytes + graph_bytes) / 1024 ** 2, 1),
+                f"recall@{k}": round(_recall(found, exact), 4),
+            })
+
+    baseline = results[0]["index_mb"]
+    for result in results:
+        result["memory_saved"] = round(1 - result["index_mb"] / baseline, 3) if baseline else 0.0
+    return results
+
+
+def _encode(embedder, texts: List[str]) -> np.ndarray:
+    return np.concatenate([
+        np.asarray(embedder.encode(texts[i:i + ENCODE_BATCH_SIZE]), dtype=np.float32)
+        for i in range(0, len(texts), ENCODE_BATCH_SIZE)
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=EMBEDDING_MODEL)
+    parser.add_argument("--sample", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=500, help="held-out transactions used as queries")
+    parser.add_argument("--queries-file", default=None, help="real questions, one per line, instead")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--dims", type=int, nargs="+", default=[256, 128, 64])
+    parser.add_argument("--pq", action="store_true", help="also evaluate product quantization")
+    parser.add_argument("--max-connections", type=int, default=64)
+    args = parser.parse_args()
+
+    # The worker owns the embedding models and the text the vectors are built from
+    from worker import TransactionProcessor
+
+    processor = TransactionProcessor()
+    embedder = processor.embedder_for(args.model)
+    conn = psycopg2.connect(DATABASE_URL)
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(FIT_SAMPLE_SQL, (args.sample,))
+            rows = cursor.fetchall()
+            cursor.execute("SELECT COUNT(*) AS total FROM transactions")
+            total = cursor.fetchone()['total']
+    finally:
+        conn.close()
+
+    vectors = _encode(embedder, [processor._build_embedding_text(row) for row in rows])
+    if args.queries_file:
+        with open(args.queries_file) as f:
+            questions = [line.strip() for line in f if line.strip()]
+        corpus, queries = vectors, _encode(embedder, questions)
+    else:
+        corpus, queries = vectors[args.queries:], vectors[:args.queries]
+    if len(corpus) < max(args.dims) or not len(queries):
+        print(f"❌ Not enough transactions: {len(corpus)} corpus vectors, {len(queries)} queries")
+        return
+
+    print(f"📊 {args.model}: {len(corpus)} corpus vectors, {len(queries)} queries, "
+          f"memory estimated for {total} transactions")
+    print(f"{'setting':<16}{'bytes/vec':>10}{'index MB':>10}{'saved':>8}{'variance':>10}{f'recall@{args.k}':>11}")
+    for r in evaluate(corpus, queries, args.dims, k=args.k, pq=args.pq, objects=total,
+                      max_connections=args.max_connections):
+        print(f"{r['setting']:<16}{r['bytes_per_vector']:>10}{r['index_mb']:>10}{r['memory_saved']:>8.1%}"
+              f"{r['explained_variance']:>10.1%}{r[f'recall@{args.k}']:>11.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Compact vector storage: a PCA projection fitted on our own transactions, and
+the Weaviate product quantization (PQ) settings that go with it.
+
+The projection is stored with its embedding version (embedding_versions.py),
+so the worker, the backfill and the ai-engine all apply the same matrix, and
+switching it on or off goes through the usual shadow build and cutover.
+evaluate_compact.py measures what it costs in recall.
+"""
+import hashlib
+import io
+from typing import Any, Dict
+
+import numpy as np
+
+# Weaviate's PQ codebooks have 256 centroids, so every segment is stored as one byte
+PQ_CENTROIDS = 256
+PQ_TRAINING_LIMIT = 100000
+
+
+class Projection:
+    """Centers embeddings and projects them onto the corpus's top principal components"""
+
+    def __init__(self, mean: np.ndarray, components: np.ndarray, explained_variance: float = 0.0):
+        self.mean = np.asarray(mean, dtype=np.float32)
+        # (source_dims, dims)
+        self.components = np.asarray(components, dtype=np.float32)
+        self.explained_variance = float(explained_variance)
+
+    @property
+    def dims(self) -> int:
+        return self.components.shape[1]
+
+    @property
+    def source_dims(self) -> int:
+        return self.components.shape[0]
+
+    @classmethod
+    def fit(cls, vectors: np.ndarray, dims: int) -> "Projection":
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not 0 < dims < vectors.shape[1]:
+            raise ValueError(f"dims must be between 1 and {vectors.shape[1] - 1}")
+        if len(vectors) < dims:
+            raise ValueError(f"Need at least {dims} vectors to fit {dims} components, got {len(vectors)}")
+        mean = vectors.mean(axis=0)
+        _, singular_values, vt = np.linalg.svd(vectors - mean, full_matrices=False)
+        variance = singular_values ** 2
+        return cls(mean, vt[:dims].T, variance[:dims].sum() / variance.sum())
+
+    def apply(self, vectors: np.ndarray) -> np.ndarray:
+        """Project one vector or a (n, source_dims) batch"""
+        return (np.asarray(vectors, dtype=np.float32) - self.mean) @ self.components
+
+    def to_bytes(self) -> bytes:
+        buffer = io.BytesIO()
+        np.savez(buffer, mean=self.mean, components=self.components,
+                 explained_variance=np.array(self.explained_variance))
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Projection":
+        arrays = np.load(io.BytesIO(data))
+        return cls(arrays["mean"], arrays["components"], float(arrays["explained_variance"]))
+
+    def fingerprint(self) -> str:
+        return hashlib.sha1(self.components.tobytes() + self.mean.tobytes()).hexdigest()[:8]
+
+
+def default_pq_segments(dims: int) -> int:
+    """About four dimensions per one-byte segment; Weaviate needs segments to divide dims"""
+    segments = max(1, dims // 4)
+    while dims % segments:
+        segments -= 1
+    return segments
+
+
+def pq_config(segments: int) -> Dict[str, Any]:
+    """vectorIndexConfig that compresses a populated class's vectors to `segments` bytes each"""
+    return {
+        "pq": {
+            "enabled": True,
+            "segments": segments,
+            "centroids": PQ_CENTROIDS,
+            "trainingLimit": PQ_TRAINING_LIMIT,
+        }
+    }
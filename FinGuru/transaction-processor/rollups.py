@@ -0,0 +1,155 @@
+import argparse
+import os
+import sys
+import time
+from decimal import Decimal
+from typing import Dict, Optional
+
+import psycopg2
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+
+def _apply_delta(cursor, user_id: str, month, category: str, amount: Decimal, sign: int):
+    """Add (sign=1) or remove (sign=-1) one transaction's amount from its rollup row and budget"""
+    spent = -amount if amount < 0 else Decimal(0)
+    income = amount if amount > 0 else Decimal(0)
+
+    cursor.execute("""
+        INSERT INTO monthly_spending_rollups
+            (user_id, month, category, total_spent, total_income, transaction_count, updated_at)
+        VALUES (%s, %s, %s, %s, %s, %s, NOW())
+        ON CONFLICT (user_id, month, category) DO UPDATE SET
+            total_spent = monthly_spending_rollups.total_spent + EXCLUDED.total_spent,
+            total_income = monthly_spending_rollups.total_income + EXCLUDED.total_income,
+            transaction_count = monthly_spending_rollups.transaction_count + EXCLUDED.transaction_count,
+            updated_at = NOW()
+    """, (user_id, month, category, sign * spent, sign * income, sign))
+
+    if spent:
+        cursor.execute("""
+            UPDATE budgets
+            SET current_spend = current_spend + %s, updated_at = NOW()
+            WHERE user_id = %s AND category = %s AND month = %s
+        """, (sign * spent, user_id, category, month))
+
+
+def sync_transaction(cursor, user_id: str, txn: Dict) -> bool:
+    """
+    Bring the rollups in line with a transaction's current category, amount and month.
+
+    Must run in the same database transaction that assigns the category, with
+    the transaction row locked. rollup_category/rollup_amount/rollup_month
+    record what the row currently contributes, so re-processing a message is
+    idempotent and a changed date moves the amount to the new month.
+    Returns True if the rollups changed.
+    """
+    category = txn.get('category') or 'Other'
+    amount = Decimal(txn['amount'])
+    month = txn['transaction_date'].replace(day=1)
+
+    previous_category = txn.get('rollup_category')
+    previous_amount = txn.get('rollup_amount')
+    # Rows synced before rollup_month existed contributed to their current month
+    previous_month = txn.get('rollup_month') or month
+    if (previous_category == category and previous_amount is not None and Decimal(previous_amount) == amount
+            and previous_month == month):
+        return False
+
+    if previous_category is not None and previous_amount is not None:
+        _apply_delta(cursor, user_id, previous_month, previous_category, Decimal(previous_amount), -1)
+    _apply_delta(cursor, user_id, month, category, amount, 1)
+
+    cursor.execute("""
+        UPDATE transactions
+        SET rollup_category = %s, rollup_amount = %s, rollup_month = %s
+        WHERE id = %s
+    """, (category, amount, month, txn['id']))
+
+    txn['rollup_category'] = category
+    txn['rollup_amount'] = amount
+    txn['rollup_month'] = month
+    return True
+
+
+def rebuild_user(cursor, user_id: str):
+    """Recompute one user's rollups and budget spend from raw transactions"""
+    # Lock the user's transaction rows first, in the same order the worker does
+    cursor.execute("""
+        UPDATE transactions
+        SET rollup_category = COALESCE(category, 'Other'), rollup_amount = amount,
+            rollup_month = DATE_TRUNC('month', transaction_date)::date
+        WHERE user_id = %s
+    """, (user_id,))
+
+    cursor.execute("DELETE FROM monthly_spending_rollups WHERE user_id = %s", (user_id,))
+    cursor.execute("""
+        INSERT INTO monthly_spending_rollups
+            (user_id, month, category, total_spent, total_income, transaction_count, updated_at)
+        SELECT user_id,
+               DATE_TRUNC('month', transaction_date)::date,
+               COALESCE(category, 'Other'),
+               SUM(CASE WHEN amount < 0 THEN -amount ELSE 0 END),
+               SUM(CASE WHEN amount > 0 THEN amount ELSE 0 END),
+               COUNT(*),
+               NOW()
+        FROM transactions
+        WHERE user_id = %s
+        GROUP BY 1, 2, 3
+    """, (user_id,))
+
+    cursor.execute("""
+        UPDATE budgets b
+        SET current_spend = COALESCE((
+                SELECT r.total_spent
+                FROM monthly_spending_rollups r
+                WHERE r.user_id = b.user_id AND r.month = b.month AND r.category = b.category
+            ), 0),
+            updated_at = NOW()
+        WHERE b.user_id = %s
+    """, (user_id,))
+
+
+def rebuild(conn, user_id: Optional[str] = None) -> int:
+    """Rebuild rollups for one user or for every user, one short transaction per user"""
+    if user_id:
+        user_ids = [user_id]
+    else:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT id FROM users ORDER BY id")
+            user_ids = [row[0] for row in cursor.fetchall()]
+
+    started = time.time()
+    for index, uid in enumerate(user_ids, start=1):
+        try:
+            with conn.cursor() as cursor:
+                rebuild_user(cursor, uid)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"❌ Rollup rebuild failed for user {uid}: {e}")
+            continue
+
+        if index % 100 == 0 or index == len(user_ids):
+            print(f"🔄 Rebuilt rollups for {index}/{len(user_ids)} users ({time.time() - started:.1f}s)")
+
+    return len(user_ids)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain monthly spending rollups")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = subcommands.add_parser("rebuild", help="Recompute rollups from raw transactions (backfill)")
+    rebuild_parser.add_argument("--user", help="Only rebuild this user_id")
+    args = parser.parse_args()
+
+    if not DATABASE_URL:
+        print("❌ DATABASE_URL is not set")
+        sys.exit(1)
+
+    connection = psycopg2.connect(DATABASE_URL)
+    try:
+        count = rebuild(connection, args.user)
+        print(f"✅ Rollups rebuilt for {count} user(s)")
+    finally:
+        connection.close()
@@ -0,0 +1,210 @@
+"""
+Per-user Weaviate tenants for transaction embeddings.
+
+With WEAVIATE_MULTI_TENANCY=true the worker writes to the multi-tenant
+UserTransaction class, one tenant per user, created on the user's first
+write. Cut over in this order:
+
+    1. enable WEAVIATE_MULTI_TENANCY on the worker (new writes go to tenants)
+    2. python tenants.py migrate             copy the single Transaction class
+    3. enable WEAVIATE_MULTI_TENANCY on the ai-engine (reads use tenants)
+    4. python tenants.py migrate --drop-source   optional, once verified
+
+Dormant users can be offloaded with `python tenants.py deactivate --days 90`.
+Their tenants are reactivated on the next read or write.
+"""
+import argparse
+import os
+import sys
+import time
+from typing import Any, Dict, Iterable, List, Set
+
+import psycopg2
+import weaviate
+from weaviate.schema.crud_schema import Tenant, TenantActivityStatus
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+WEAVIATE_URL = os.getenv("WEAVIATE_URL", "http://weaviate:8080")
+
+SOURCE_CLASS = "Transaction"
+TENANT_CLASS = "UserTransaction"
+
+# Tenant admin calls accept a bounded number of tenants per request
+TENANT_BATCH_SIZE = 100
+
+DORMANT_USERS_SQL = """
+    SELECT u.id FROM users u
+    WHERE NOT EXISTS (
+        SELECT 1 FROM transactions t
+        WHERE t.user_id = u.id AND t.created_at > NOW() - make_interval(days => %s)
+    )
+"""
+
+
+def enabled() -> bool:
+    return os.getenv("WEAVIATE_MULTI_TENANCY", "false").lower() == "true"
+
+
+def tenant_schema(schema: Dict[str, Any], class_name: str = TENANT_CLASS) -> Dict[str, Any]:
+    """The single-class schema turned into the multi-tenant class"""
+    return {
+        **schema,
+        "class": class_name,
+        "description": "Per-user transaction embeddings (one tenant per user)",
+        "multiTenancyConfig": {"enabled": True},
+    }
+
+
+def _problem(error: Any) -> str:
+    text = str(error).lower()
+    if "tenant not found" in text:
+        return "missing"
+    if "not active" in text or "cold" in text or "inactive" in text:
+        return "inactive"
+    return ""
+
+
+def create_object(client, user_id: str, data_object: Dict[str, Any], vector: List[float], uuid: str = None,
+                  class_name: str = TENANT_CLASS):
+    """Write into the user's tenant, creating it on first write and reactivating it if offloaded"""
+    for attempt in range(3):
+        try:
+            return client.data_object.create(
+                data_object=data_object,
+                class_name=class_name,
+                uuid=uuid,
+                vector=vector,
+                tenant=user_id
+            )
+        except Exception as e:
+            problem = _problem(e)
+            if not problem or attempt == 2:
+                raise
+            if problem == "missing":
+                add_tenants(client, [user_id], class_name)
+            else:
+                set_activity(client, [user_id], TenantActivityStatus.HOT, class_name)
+
+
+def add_tenants(client, user_ids: Iterable[str], class_name: str = TENANT_CLASS):
+    tenants = [Tenant(name=user_id) for user_id in user_ids]
+    for i in range(0, len(tenants), TENANT_BATCH_SIZE):
+        try:
+            client.schema.add_class_tenants(class_name, tenants[i:i + TENANT_BATCH_SIZE])
+        except Exception as e:
+            # Another worker may have created it first
+            if "already exists" not in str(e).lower():
+                raise
+
+
+def set_activity(client, user_ids: Iterable[str], status: TenantActivityStatus, class_name: str = TENANT_CLASS):
+    tenants = [Tenant(name=user_id, activity_status=status) for user_id in user_ids]
+    for i in range(0, len(tenants), TENANT_BATCH_SIZE):
+        client.schema.update_class_tenants(class_name, tenants[i:i + TENANT_BATCH_SIZE])
+
+
+def existing_tenants(client, class_name: str = TENANT_CLASS) -> Dict[str, TenantActivityStatus]:
+    return {t.name: t.activity_status for t in client.schema.get_class_tenants(class_name)}
+
+
+def migrate(client, page_size: int = 500, drop_source: bool = False) -> int:
+    """
+    Copy every object of the single Transaction class into its user's tenant.
+
+    Objects keep their UUIDs, so the copy is idempotent and can be resumed or
+    re-run after new writes.
+    """
+    known: Set[str] = set(existing_tenants(client))
+    copied = 0
+    after = None
+    started = time.monotonic()
+
+    while True:
+        page = client.data_object.get(class_name=SOURCE_CLASS, limit=page_size, after=after, with_vector=True)
+        objects = page.get("objects", [])
+        if not objects:
+            break
+
+        new_tenants = {o["properties"]["user_id"] for o in objects if o["properties"].get("user_id")} - known
+        if new_tenants:
+            add_tenants(client, new_tenants)
+            known |= new_tenants
+
+        with client.batch as batch:
+            for obj in objects:
+                properties = obj["properties"]
+                user_id = properties.get("user_id")
+                if not user_id:
+                    continue
+                if properties.get("transaction_date") and not properties.get("transaction_day"):
+                    properties["transaction_day"] = f"{properties['transaction_date'][:10]}T00:00:00Z"
+                batch.add_data_object(
+                    data_object=properties,
+                    class_name=TENANT_CLASS,
+                    uuid=obj["id"],
+                    vector=obj.get("vector"),
+                    tenant=user_id
+                )
+                copied += 1
+
+        after = objects[-1]["id"]
+        rate = copied / max(time.monotonic() - started, 1e-6)
+        print(f"⏳ Migrated {copied} objects across {len(known)} tenants ({rate:.0f}/s)")
+
+    print(f"✅ Migration complete: {copied} objects, {len(known)} tenants")
+    if drop_source:
+        client.schema.delete_class(SOURCE_CLASS)
+        print(f"🗑️ Dropped {SOURCE_CLASS}")
+    return copied
+
+
+def deactivate_dormant(client, conn, days: int) -> int:
+    """Offload (COLD) tenants of users with no new transactions in the last `days` days"""
+    with conn.cursor() as cursor:
+        cursor.execute(DORMANT_USERS_SQL, (days,))
+        dormant = {row[0] for row in cursor.fetchall()}
+
+    tenants = existing_tenants(client)
+    to_deactivate = [u for u in dormant if tenants.get(u) == TenantActivityStatus.HOT]
+    set_activity(client, to_deactivate, TenantActivityStatus.COLD)
+    print(f"✅ Deactivated {len(to_deactivate)} dormant tenants")
+    return len(to_deactivate)
+
+
+def remove_user(client, user_id: str):
+    """Delete all of a user's vectors by dropping their tenant"""
+    client.schema.remove_class_tenants(TENANT_CLASS, [user_id])
+    print(f"🗑️ Removed tenant {user_id}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = sub.add_parser("migrate", help="copy the single Transaction class into per-user tenants")
+    migrate_parser.add_argument("--page-size", type=int, default=500)
+    migrate_parser.add_argument("--drop-source", action="store_true")
+    deactivate_parser = sub.add_parser("deactivate", help="offload tenants of dormant users")
+    deactivate_parser.add_argument("--days", type=int, default=90)
+    remove_parser = sub.add_parser("remove", help="delete one user's vectors")
+    remove_parser.add_argument("user_id")
+    args = parser.parse_args()
+
+    client = weaviate.Client(url=WEAVIATE_URL)
+    if not any(c["class"] == TENANT_CLASS for c in client.schema.get().get("classes", [])):
+        print(f"❌ {TENANT_CLASS} does not exist; start the worker with WEAVIATE_MULTI_TENANCY=true first")
+        sys.exit(1)
+
+    if args.command == "migrate":
+        migrate(client, page_size=args.page_size, drop_source=args.drop_source)
+    elif args.command == "deactivate":
+        conn = psycopg2.connect(DATABASE_URL)
+        try:
+            deactivate_dormant(client, conn, args.days)
+        finally:
+            conn.close()
+    else:
+        remove_user(client, args.user_id)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,9 +7,13 @@ import psycopg2
 from psycopg2.extras import RealDictCursor
 import weaviate
 from categorizer import TransactionCategorizer
+import rollups
+import tenants
+from centroids import CentroidCategorizer, CentroidRefresher
+from embedding_versions import EMBEDDING_MODEL, VersionRegistry, object_uuid, write_object
 from embedder import TransactionEmbedder
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 
 # Environment variables
 DATABASE_URL = os.getenv("DATABASE_URL")
@@ -18,7 +22,87 @@ WEAVIATE_URL = os.getenv("WEAVIATE_URL", "http://weaviate:8080")
 
 # Initialize components
 categorizer = TransactionCategorizer()
-embedder = TransactionEmbedder()
+embedder = TransactionEmbedder(model_name=EMBEDDING_MODEL)
+
+# Bump whenever _build_embedding_text changes, then re-embed with embedding_versions.py
+EMBEDDING_TEXT_VERSION = 1
+
+# Date-typed copy of transaction_date so retrieval can push range filters into the inverted index
+TRANSACTION_DAY_PROPERTY = {
+    "name": "transaction_day",
+    "dataType": ["date"],
+    "description": "Date of transaction (RFC 3339) for range filters",
+    "indexInverted": True
+}
+
+# Which embedding version produced an object's vector (see embedding_versions.py)
+EMBEDDING_VERSION_PROPERTY = {
+    "name": "embedding_version",
+    "dataType": ["string"],
+    "description": "Embedding model and text version of the vector",
+    "indexInverted": True
+}
+
+
+def transaction_schema(class_name: str = "Transaction") -> Dict[str, Any]:
+    """Single-class Weaviate schema for transaction embeddings"""
+    return {
+        "class": class_name,
+        "description": "Financial transaction data with semantic embeddings",
+        "vectorizer": "none",
+        "properties": [
+            {
+                "name": "transaction_id",
+                "dataType": ["string"],
+                "description": "Unique transaction identifier"
+            },
+            {
+                "name": "user_id",
+                "dataType": ["string"],
+                "description": "User identifier",
+                "indexInverted": True
+            },
+            {
+                "name": "merchant_name",
+                "dataType": ["string"],
+                "description": "Merchant or business name"
+            },
+            {
+                "name": "category",
+                "dataType": ["string"],
+                "description": "Transaction category",
+                "indexInverted": True
+            },
+            {
+                "name": "subcategory",
+                "dataType": ["string"],
+                "description": "Transaction subcategory"
+            },
+            {
+                "name": "amount",
+                "dataType": ["number"],
+                "description": "Transaction amount"
+            },
+            {
+                "name": "transaction_date",
+                "dataType": ["string"],
+                "description": "Date of transaction"
+            },
+            TRANSACTION_DAY_PROPERTY,
+            {
+                "name": "description",
+                "dataType": ["text"],
+                "description": "Transaction description or memo"
+            },
+            {
+                "name": "created_at",
+                "dataType": ["string"],
+                "description": "Timestamp when record was created"
+            },
+            EMBEDDING_VERSION_PROPERTY
+        ]
+    }
+
 
 # Weaviate client (will be initialized in main)
 weaviate_client = None
@@ -29,12 +113,19 @@ class TransactionProcessor:
     def __init__(self):
         self.categorizer = categorizer
         self.embedder = embedder
+        # Active version plus the one being built, if any; every embedding is written to each
+        self.versions = VersionRegistry(self.get_db_connection)
+        self.embedders = {embedder.model_name: embedder}
+        # Second stage for rows the keyword rules can't place, using the row's own embedding
+        self.centroids = CentroidCategorizer(min_similarity=float(os.getenv("CENTROID_MIN_SIMILARITY", "0.5")))
         self.weaviate_client = None
         self.db_conn = None
         self.stats = {
             "processed": 0,
             "categorized": 0,
+            "centroid_categorized": 0,
             "embedded": 0,
+            "shadow_errors": 0,
             "errors": 0
         }
     
@@ -62,73 +153,68 @@ class TransactionProcessor:
     
     def _initialize_weaviate_schema(self):
         """Initialize Weaviate schema if not exists"""
-        schema = {
-            "class": "Transaction",
-            "description": "Financial transaction data with semantic embeddings",
-            "vectorizer": "none",
-            "properties": [
-                {
-                    "name": "transaction_id",
-                    "dataType": ["string"],
-                    "description": "Unique transaction identifier"
-                },
-                {
-                    "name": "user_id",
-                    "dataType": ["string"],
-                    "description": "User identifier",
-                    "indexInverted": True
-                },
-                {
-                    "name": "merchant_name",
-                    "dataType": ["string"],
-                    "description": "Merchant or business name"
-                },
-                {
-                    "name": "category",
-                    "dataType": ["string"],
-                    "description": "Transaction category",
-                    "indexInverted": True
-                },
-                {
-                    "name": "subcategory",
-                    "dataType": ["string"],
-                    "description": "Transaction subcategory"
-                },
-                {
-                    "name": "amount",
-                    "dataType": ["number"],
-                    "description": "Transaction amount"
-                },
-                {
-                    "name": "transaction_date",
-                    "dataType": ["string"],
-                    "description": "Date of transaction"
-                },
-                {
-                    "name": "description",
-                    "dataType": ["text"],
-                    "description": "Transaction description or memo"
-                },
-                {
-                    "name": "created_at",
-                    "dataType": ["string"],
-                    "description": "Timestamp when record was created"
-                }
-            ]
-        }
+        schema = transaction_schema()
         
         try:
             existing_schema = self.weaviate_client.schema.get()
             existing_classes = [c['class'] for c in existing_schema.get('classes', [])]
             
+            if tenants.enabled():
+                # Tenants are created lazily on each user's first write
+                if tenants.TENANT_CLASS not in existing_classes:
+                    self.weaviate_client.schema.create_class(tenants.tenant_schema(schema))
+                    print(f"✅ Weaviate multi-tenant '{tenants.TENANT_CLASS}' schema created")
+                else:
+                    print(f"✅ Weaviate multi-tenant '{tenants.TENANT_CLASS}' schema already exists")
+                if 'Transaction' not in existing_classes:
+                    return
+            
             if 'Transaction' not in existing_classes:
                 self.weaviate_client.schema.create_class(schema)
                 print("✅ Weaviate 'Transaction' schema created")
             else:
                 print("✅ Weaviate 'Transaction' schema already exists")
+                current = next(c for c in existing_schema['classes'] if c['class'] == 'Transaction')
+                properties = {p['name'] for p in current.get('properties', [])}
+                if 'embedding_version' not in properties:
+                    self.weaviate_client.schema.property.create("Transaction", EMBEDDING_VERSION_PROPERTY)
+                    print("✅ Added 'embedding_version' property")
+                if 'transaction_day' not in properties:
+                    self.weaviate_client.schema.property.create("Transaction", TRANSACTION_DAY_PROPERTY)
+                    print("✅ Added 'transaction_day' property")
+                    self.backfill_transaction_days()
         except Exception as e:
             print(f"⚠️ Schema initialization error: {e}")
     
+    def backfill_transaction_days(self, page_size: int = 500) -> int:
+        """Set transaction_day on objects written before the property existed; safe to re-run"""
+        updated = 0
+        after = None
+        while True:
+            page = self.weaviate_client.data_object.get(
+                class_name="Transaction", limit=page_size, after=after
+            )
+            objects = page.get("objects", [])
+            if not objects:
+                break
+            
+            for obj in objects:
+                properties = obj.get("properties", {})
+                if properties.get("transaction_day") or not properties.get("transaction_date"):
+                    continue
+                self.weaviate_client.data_object.update(
+                    data_object={"transaction_day": _to_rfc3339(properties["transaction_date"])},
+                    class_name="Transaction",
+                    uuid=obj["id"]
+                )
+                updated += 1
+            
+            after = objects[-1]["id"]
+            print(f"⏳ transaction_day backfill: {updated} objects updated")
+        
+        print(f"✅ transaction_day backfill complete ({updated} objects)")
+        return updated
+    
     def get_db_connection(self):
         """Get database connection with retry logic"""
         max_retries = 5
@@ -145,8 +231,90 @@ class TransactionProcessor:
         
         raise Exception("Failed to connect to database after all retries")
     
-    def process_transaction(self, transaction_id: str, user_id: str) -> Dict[str, Any]:
-        """Process a single transaction: categorize and embed"""
+    def embedder_for(self, model: str) -> TransactionEmbedder:
+        """The embedder for a version's model, created on first use"""
+        if model not in self.embedders:
+            self.embedders[model] = TransactionEmbedder(model_name=model)
+        return self.embedders[model]
+    
+    def rebuild_centroids(self, conn=None, per_subcategory: int = 200, min_rows: int = 10) -> int:
+        """Recompute category centroids from already-categorized transactions"""
+        own_conn = conn is None
+        conn = conn or self.get_db_connection()
+        try:
+            return self.centroids.build(
+                conn,
+                self.embedder.encode,
+                lambda row: self._build_embedding_text(row, include_category=False),
+                per_subcategory=per_subcategory,
+                min_rows=min_rows
+            )
+        finally:
+            if own_conn:
+                conn.close()
+    
+    def _categorize_batch(self, rows: List[Dict]) -> Dict[Any, Tuple[str, str, float, str]]:
+        """
+        Categorize rows that have no category yet.
+        
+        Keyword rules go first; rows they leave as "Other" are embedded together
+        and matched against the subcategory centroids in one matrix multiply.
+        Returns id -> (category, subcategory, confidence, source), source being
+        'rules' or 'centroid'. The matching vectors come from the text without
+        category and are never stored in Weaviate.
+        """
+        results = {}
+        misses = []
+        for row in rows:
+            if row['category'] and row['category'] != 'Other':
+                continue
+            category, subcategory, confidence = self.categorizer.categorize(
+                merchant_name=row['merchant_name'] or '',
+                description=row['description'] or '',
+                amount=float(row['amount'])
+            )
+            results[row['id']] = (category, subcategory, confidence, 'rules')
+            if category == 'Other':
+                misses.append(row)
+        
+        if misses and self.centroids.ready:
+            vectors = self.embedder.encode([self._build_embedding_text(row, include_category=False) for row in misses])
+            for row, match in zip(misses, self.centroids.classify_batch(vectors)):
+                if match:
+                    results[row['id']] = (*match, 'centroid')
+                    self.stats["centroid_categorized"] += 1
+        
+        return results
+    
+    def sync_user(self, user_id: str, batch_size: int = 64) -> int:
+        """Categorize and embed every pending transaction of a user, categorizing a batch at a time"""
+        conn = self.get_db_connection()
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("""
+                    SELECT id, merchant_name, category, subcategory, amount, description
+                    FROM transactions
+                    WHERE user_id = %s
+                      AND (category IS NULL OR category = 'Other' OR embedding_synced = FALSE)
+                    ORDER BY transaction_date
+                """, (user_id,))
+                rows = cursor.fetchall()
+        finally:
+            conn.close()
+        
+        processed = 0
+        for i in range(0, len(rows), batch_size):
+            batch = rows[i:i + batch_size]
+            hints = self._categorize_batch(batch)
+            for row in batch:
+                if self.process_transaction(row['id'], user_id, hint=hints.get(row['id']))["success"]:
+                    processed += 1
+        print(f"✅ Synced {processed}/{len(rows)} pending transactions for user {user_id}")
+        return processed
+    
+    def process_transaction(self, transaction_id: str, user_id: str,
+                            hint: Optional[Tuple[str, str, float, str]] = None) -> Dict[str, Any]:
+        """Process a single transaction: categorize and embed; hint is a precomputed _categorize_batch result"""
         result = {
             "success": False,
             "transaction_id": transaction_id,
@@ -166,9 +334,11 @@ class TransactionProcessor:
             # Fetch transaction from database
             cursor.execute("""
                 SELECT id, merchant_name, category, subcategory, amount, 
-                       transaction_date, description, embedding_synced
+                       transaction_date, description, embedding_synced,
+                       rollup_category, rollup_amount, rollup_month
                 FROM transactions
                 WHERE id = %s
+                FOR UPDATE
             """, (transaction_id,))
             
             txn = cursor.fetchone()
@@ -180,17 +350,14 @@ class TransactionProcessor:
             
             # Step 1: Categorize if needed
             if not txn['category'] or txn['category'] == 'Other':
-                category, subcategory, confidence = self.categorizer.categorize(
-                    merchant_name=txn['merchant_name'] or '',
-                    description=txn['description'] or '',
-                    amount=float(txn['amount'])
-                )
+                category, subcategory, confidence, source = hint or self._categorize_batch([txn])[txn['id']]
                 
+                # The source keeps centroid-labelled rows out of the next centroid build
                 cursor.execute("""
                     UPDATE transactions
-                    SET category = %s, subcategory = %s
+                    SET category = %s, subcategory = %s, category_source = %s
                     WHERE id = %s
-                """, (category, subcategory, transaction_id))
+                """, (category, subcategory, source, transaction_id))
                 
                 txn['category'] = category
                 txn['subcategory'] = subcategory
@@ -199,38 +366,41 @@ class TransactionProcessor:
                 print(f"✅ Categorized: {txn['merchant_name']} -> {category}/{subcategory} (confidence: {confidence:.2f})")
                 self.stats["categorized"] += 1
             
+            # Keep monthly rollups and budget spend in step with the category, atomically
+            rollups.sync_transaction(cursor, user_id, txn)
+            
             # Step 2: Generate embedding and store in Weaviate
             if self.weaviate_client and not txn['embedding_synced']:
-                # Generate embedding
-                text = self._build_embedding_text(txn)
-                embedding = self.embedder.encode(text)
+                # Embedded once per model from the final category, the same text the backfill uses
+                vectors = {}
                 
-                # Store in Weaviate
+                # Store in Weaviate, in the active version and in any version being built
                 try:
-                    data_object = {
-                        "transaction_id": str(txn['id']),
-                        "user_id": user_id,
-                        "merchant_name": txn['merchant_name'] or "Unknown",
-                        "category": txn['category'] or "Other",
-                        "subcategory": txn['subcategory'] or "",
-                        "amount": float(txn['amount']),
-                        "transaction_date": str(txn['transaction_date']),
-                        "description": txn['description'] or "",
-                        "created_at": datetime.utcnow().isoformat()
-                    }
-                    
-                    self.weaviate_client.data_object.create(
-                        data_object=data_object,
-                        class_name="Transaction",
-                        vector=embedding.tolist()
-                    )
+                    data_object = self._build_weaviate_object(txn, user_id)
+                    targets = self.versions.targets()
+                    for version in targets:
+                        if version.model not in vectors:
+                            vectors[version.model] = self.embedder_for(version.model).encode(self._build_embedding_text(txn))
+                        try:
+                            write_object(self.weaviate_client, version, user_id, data_object,
+                                         version.project(vectors[version.model]).tolist(), object_uuid(txn['id']))
+                        except Exception as e:
+                            if version.status == "active":
+                                raise
+                            # The shadow class must not hold up live traffic; the build job can be re-run
+                            print(f"⚠️ Shadow write to {version.id} failed for {txn['merchant_name']}: {e}")
+                            self.stats["shadow_errors"] += 1
+                    embedding = targets[0].project(vectors[targets[0].model])
                     
-                    # Mark as synced in PostgreSQL
+                    # Mark as synced in PostgreSQL, tagged with the newest version written
                     cursor.execute("""
                         UPDATE transactions
-                        SET embedding_synced = TRUE
+                        SET embedding_synced = TRUE, embedding_version = %s
                         WHERE id = %s
-                    """, (transaction_id,))
+                    """, (targets[-1].id, transaction_id))
+                    
+                    # Tell ai-engine instances to drop this user's cached vectors once we commit
+                    cursor.execute("SELECT pg_notify('transaction_embeddings', %s)", (user_id,))
                     
                     result["embedded"] = True
                     print(f"✅ Embedded: {txn['merchant_name']} (vector dim: {len(embedding)})")
@@ -264,17 +434,32 @@ class TransactionProcessor:
             if conn:
                 conn.close()
     
-    def _build_embedding_text(self, txn: Dict) -> str:
-        """Build text representation for embedding"""
+    def _build_weaviate_object(self, txn: Dict, user_id: str) -> Dict[str, Any]:
+        """Weaviate properties for a transaction row"""
+        return {
+            "transaction_id": str(txn['id']),
+            "user_id": user_id,
+            "merchant_name": txn['merchant_name'] or "Unknown",
+            "category": txn['category'] or "Other",
+            "subcategory": txn['subcategory'] or "",
+            "amount": float(txn['amount']),
+            "transaction_date": str(txn['transaction_date']),
+            "transaction_day": _to_rfc3339(txn['transaction_date']),
+            "description": txn['description'] or "",
+            "created_at": datetime.utcnow().isoformat()
+        }
+    
+    def _build_embedding_text(self, txn: Dict, include_category: bool = True) -> str:
+        """Build text representation for embedding; centroids compare the text without category"""
         parts = []
         
         if txn.get('merchant_name'):
             parts.append(txn['merchant_name'])
         
-        if txn.get('category'):
+        if include_category and txn.get('category'):
             parts.append(f"category: {txn['category']}")
         
-        if txn.get('subcategory'):
+        if include_category and txn.get('subcategory'):
             parts.append(f"subcategory: {txn['subcategory']}")
         
         if txn.get('description'):
@@ -296,11 +481,18 @@ class TransactionProcessor:
         print("="*60)
         print(f"Total Processed:  {self.stats['processed']}")
         print(f"Categorized:      {self.stats['categorized']}")
+        print(f"  by centroid:    {self.stats['centroid_categorized']}")
         print(f"Embedded:         {self.stats['embedded']}")
+        print(f"  shadow errors:  {self.stats['shadow_errors']}")
         print(f"Errors:           {self.stats['errors']}")
         print("="*60 + "\n")
 
 
+def _to_rfc3339(day) -> str:
+    """Weaviate date properties take RFC 3339 timestamps"""
+    return f"{str(day)[:10]}T00:00:00Z"
+
+
 def callback(ch, method, properties, body, processor: TransactionProcessor):
     """RabbitMQ message handler"""
     try:
@@ -330,7 +522,10 @@ def callback(ch, method, properties, body, processor: TransactionProcessor):
             # Handle bulk sync operation
             user_id = message.get('user_id')
             print(f"🔄 Bulk sync requested for user {user_id}")
-            # Could trigger batch processing here
+            if user_id:
+                processor.sync_user(user_id)
+            else:
+                print("⚠️ Missing user_id in sync message")
         
         else:
             print(f"⚠️ Unknown action: {action}")
@@ -372,6 +567,12 @@ def main():
     if not weaviate_connected:
         print("⚠️ Continuing without Weaviate (embeddings disabled)")
     
+    # Centroids from the last build are used right away; the refresher rebuilds them when stale
+    processor.centroids.load()
+    rebuild_seconds = float(os.getenv("CENTROID_REBUILD_SECONDS", "86400"))
+    if rebuild_seconds > 0:
+        CentroidRefresher(processor.centroids, processor.rebuild_centroids, rebuild_seconds).start()
+    
     # Connect to RabbitMQ
     print("🔌 Connecting to RabbitMQ...")
     max_retries = 10
@@ -427,4 +628,9 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:] == ["backfill-transaction-days"]:
+        processor = TransactionProcessor()
+        if processor.connect_weaviate():
+            processor.backfill_transaction_days()
+    else:
+        main()